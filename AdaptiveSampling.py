@@ -0,0 +1,200 @@
+import heapq
+import json
+import math
+import random
+from statistics import NormalDist
+from typing import Dict, Iterator, List, Optional, Sequence
+
+from Pipeline import EmailTask
+from Testing import EmailAnalysisTesting
+
+
+class RunningInterval:
+    """
+    Running mean and variance of per-email accuracies (Welford's algorithm), with a normal
+    approximation confidence interval.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, value: float):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+
+    def half_width(self, z: float, population: Optional[int] = None) -> float:
+        """
+        Half width of the confidence interval of the mean.
+
+        Args:
+            z: Standard normal quantile of the confidence level
+            population: Number of emails sampled from, to apply the finite population correction
+
+        Returns:
+            float: Half width, infinite with fewer than two observations
+        """
+        if self.count < 2:
+            return math.inf
+        variance = self._m2 / (self.count - 1)
+        width = z * math.sqrt(variance / self.count)
+        if population is not None and population > 1:
+            width *= math.sqrt(max(population - self.count, 0) / (population - 1))
+        return width
+
+
+def load_baseline(path: str) -> Dict:
+    """
+    Load an accuracy summary saved from an earlier run (see `--save-summary` in main.py).
+
+    Args:
+        path: JSON file with `overall_accuracy` and `field_accuracies`
+
+    Returns:
+        Dict: Baseline summary
+    """
+    with open(path, 'r') as file:
+        return json.load(file)
+
+
+class AdaptiveSampler:
+    """
+    Feeds an evaluation run with emails in stratified random order and stops it early.
+    Rows are grouped by the ground truth `primary_purpose` and `sentiment.overall_tone`, shuffled
+    within each stratum and interleaved so every prefix of the stream keeps the strata proportions.
+    `observe` is used as the pipeline sink: it keeps running confidence intervals on the overall and
+    field-wise accuracies, and `rows` stops yielding once the intervals are tight enough or the
+    overall accuracy is significantly below the baseline.
+    """
+
+    def __init__(
+        self,
+        rows: Sequence[Dict[str, str]],
+        tester: EmailAnalysisTesting,
+        tolerance: float = 0.02,
+        field_tolerance: float = 0.05,
+        confidence: float = 0.95,
+        min_samples: int = 30,
+        max_samples: Optional[int] = None,
+        baseline: Optional[Dict] = None,
+        seed: Optional[int] = None,
+    ):
+        self.tester = tester
+        self.tolerance = tolerance
+        self.field_tolerance = field_tolerance
+        self.z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        self.min_samples = min_samples
+        self.max_samples = max_samples
+        self.baseline = baseline
+        self.population = len(rows)
+        self.overall = RunningInterval()
+        self.fields: Dict[str, RunningInterval] = {}
+        self.stop_reason: Optional[str] = None
+        self._order = self._stratified_order(rows, random.Random(seed))
+
+    def _stratum(self, row: Dict[str, str]):
+        truth = self.tester._parse_json_input(json.loads(row['GroundTruth']))
+        return truth.get('primary_purpose'), (truth.get('sentiment') or {}).get('overall_tone')
+
+    def _stratified_order(self, rows: Sequence[Dict[str, str]], rng: random.Random) -> List[Dict[str, str]]:
+        strata: Dict[tuple, List[Dict[str, str]]] = {}
+        for row in rows:
+            strata.setdefault(self._stratum(row), []).append(row)
+        # Always draw from the stratum furthest behind its share of the sample
+        heap = []
+        for members in strata.values():
+            rng.shuffle(members)
+            heapq.heappush(heap, (0.5 / len(members), rng.random(), 0, members))
+        order = []
+        while heap:
+            _, tie, taken, members = heapq.heappop(heap)
+            order.append(members[taken])
+            taken += 1
+            if taken < len(members):
+                heapq.heappush(heap, ((taken + 0.5) / len(members), tie, taken, members))
+        return order
+
+    def rows(self) -> Iterator[Dict[str, str]]:
+        """
+        Yield rows in stratified random order until a stopping rule is met.
+        """
+        for drawn, row in enumerate(self._order):
+            if self.stop_reason is not None:
+                return
+            if self.max_samples is not None and drawn >= self.max_samples:
+                self.stop_reason = "sample limit"
+                return
+            yield row
+        if self.stop_reason is None:
+            self.stop_reason = "dataset exhausted"
+
+    def observe(self, task: EmailTask):
+        """
+        Pipeline sink: add a scored email to the running intervals and check the stopping rules.
+        Triaged emails only scored their triage fields, so like the pipeline's own accuracy they
+        are left out of the intervals.
+        """
+        if task.error is not None or task.triaged:
+            return
+        self.overall.add(task.accuracy['overall_accuracy'])
+        for field, accuracy in task.accuracy['field_accuracies'].items():
+            self.fields.setdefault(field, RunningInterval()).add(accuracy)
+        if self.stop_reason is None and self.overall.count >= self.min_samples:
+            if self.regressions(fields=False):
+                self.stop_reason = "significant regression"
+            elif self._is_tight():
+                self.stop_reason = "intervals within tolerance"
+
+    def _is_tight(self) -> bool:
+        if self.overall.half_width(self.z, self.population) > self.tolerance:
+            return False
+        return all(
+            interval.half_width(self.z, self.population) <= self.field_tolerance
+            for interval in self.fields.values()
+        )
+
+    def regressions(self, fields: bool = True) -> List[str]:
+        """
+        Metrics whose whole confidence interval lies below the baseline.
+
+        Args:
+            fields: Also check the field-wise accuracies
+
+        Returns:
+            List[str]: "overall" and/or the names of the regressed fields
+        """
+        if self.baseline is None:
+            return []
+        regressed = []
+        if self.overall.mean + self.overall.half_width(self.z, self.population) < self.baseline['overall_accuracy']:
+            regressed.append("overall")
+        if fields:
+            for field, interval in self.fields.items():
+                baseline = self.baseline.get('field_accuracies', {}).get(field)
+                if baseline is not None and interval.mean + interval.half_width(self.z, self.population) < baseline:
+                    regressed.append(field)
+        return regressed
+
+    def summary(self) -> Dict:
+        """
+        Accuracy estimates with their confidence interval half widths.
+
+        Returns:
+            Dict: Number of scored emails, overall and field-wise accuracies and intervals,
+            the stopping reason and the regressed metrics
+        """
+        return {
+            "count": self.overall.count,
+            "population": self.population,
+            "overall_accuracy": self.overall.mean,
+            "overall_interval": self.overall.half_width(self.z, self.population),
+            "field_accuracies": {field: interval.mean for field, interval in self.fields.items()},
+            "field_intervals": {
+                field: interval.half_width(self.z, self.population) for field, interval in self.fields.items()
+            },
+            "stop_reason": self.stop_reason,
+            "regressions": self.regressions(),
+        }
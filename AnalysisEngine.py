@@ -0,0 +1,406 @@
+import asyncio
+import contextlib
+import heapq
+import itertools
+import math
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from openai import AsyncOpenAI
+from pydantic import BaseModel
+
+from EmailClass import EmailAnalysis
+from Metrics import Metrics, get_metrics
+from ModelClient import get_client_manager
+from PromptTemplate import Messages, prompt_text, to_messages
+from Resilience import ResilientCaller
+from StreamingParsing import ROUTING_FIELDS, FieldWatcher
+
+DEFAULT_MODEL = "gpt-4o-mini"
+
+
+def ensure_no_running_loop(name: str, alternative: str):
+    """
+    Fail clearly when a synchronous wrapper around `asyncio.run` is called from a running
+    event loop, e.g. in a notebook or a service, where `asyncio.run` cannot be used.
+
+    Args:
+        name: The synchronous function that was called
+        alternative: The coroutine to await instead
+
+    Raises:
+        RuntimeError: If an event loop is running in this thread
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    raise RuntimeError(f"{name} cannot be called from a running event loop; await {alternative} instead")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token estimate used for rate limiting (roughly 4 characters per token).
+
+    Args:
+        text: Text that will be sent to the model
+
+    Returns:
+        int: Estimated number of tokens
+    """
+    return math.ceil(len(text) / 4)
+
+
+class RateLimiter:
+    """
+    Token-bucket limiter enforcing requests-per-minute and tokens-per-minute budgets.
+    Either budget can be None to disable it.
+    """
+
+    def __init__(self, requests_per_minute: Optional[int] = None, tokens_per_minute: Optional[int] = None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._request_allowance = float(requests_per_minute or 0)
+        self._token_allowance = float(tokens_per_minute or 0)
+        self._last_refill = time.monotonic()
+        self._lock = None
+        self._loop = None
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        if self.requests_per_minute:
+            self._request_allowance = min(
+                float(self.requests_per_minute),
+                self._request_allowance + elapsed * self.requests_per_minute / 60
+            )
+        if self.tokens_per_minute:
+            self._token_allowance = min(
+                float(self.tokens_per_minute),
+                self._token_allowance + elapsed * self.tokens_per_minute / 60
+            )
+
+    async def acquire(self, tokens: int = 0):
+        """
+        Wait until one request and `tokens` tokens fit in the budget, then consume them.
+
+        Args:
+            tokens: Estimated tokens for the request (prompt + completion)
+        """
+        if self.tokens_per_minute:
+            # A single request larger than the whole budget would otherwise wait forever
+            tokens = min(tokens, self.tokens_per_minute)
+
+        # asyncio primitives are bound to the loop that first uses them
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._lock = asyncio.Lock()
+
+        # The lock keeps waiters in FIFO order so large requests are not starved
+        async with self._lock:
+            while True:
+                self._refill()
+                wait = 0.0
+                if self.requests_per_minute and self._request_allowance < 1:
+                    wait = max(wait, (1 - self._request_allowance) * 60 / self.requests_per_minute)
+                if self.tokens_per_minute and self._token_allowance < tokens:
+                    wait = max(wait, (tokens - self._token_allowance) * 60 / self.tokens_per_minute)
+                if wait == 0.0:
+                    break
+                await asyncio.sleep(wait)
+
+            if self.requests_per_minute:
+                self._request_allowance -= 1
+            if self.tokens_per_minute:
+                self._token_allowance -= tokens
+
+    def record_usage(self, estimated_tokens: int, actual_tokens: int):
+        """
+        Correct the token budget once the real usage of a request is known.
+
+        Args:
+            estimated_tokens: Tokens reserved in `acquire`
+            actual_tokens: Tokens reported by the API
+        """
+        if self.tokens_per_minute:
+            self._token_allowance += estimated_tokens - actual_tokens
+
+
+class PrioritySemaphore:
+    """
+    Semaphore whose waiters are granted in priority order (lowest value first), FIFO within a
+    priority. A released slot is handed straight to the next waiter, so later arrivals cannot
+    overtake the queue.
+    """
+
+    def __init__(self, value: int):
+        self._value = value
+        self._waiters: List = []
+        self._sequence = itertools.count()
+
+    def _release(self):
+        while self._waiters:
+            _, _, waiter = heapq.heappop(self._waiters)
+            if not waiter.cancelled():
+                waiter.set_result(None)
+                return
+        self._value += 1
+
+    @contextlib.asynccontextmanager
+    async def slot(self, priority: int = 0) -> AsyncIterator[None]:
+        """
+        Hold one slot for the enclosed block.
+
+        Args:
+            priority: Lower values are served first
+        """
+        if self._value > 0 and not self._waiters:
+            self._value -= 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiters, (priority, next(self._sequence), waiter))
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # Granted just before the cancellation arrived: hand the slot on
+                if waiter.done() and not waiter.cancelled():
+                    self._release()
+                else:
+                    waiter.cancel()
+                raise
+        try:
+            yield
+        finally:
+            self._release()
+
+
+class AsyncAnalysisEngine:
+    """
+    Sends many EmailAnalysis structured-output requests concurrently.
+    Concurrency is capped by a PrioritySemaphore and throughput by an optional RateLimiter.
+    Batch results are returned in the same order as the input prompts; `analyze_batch` is the
+    entry point for async code and `run_batch` a wrapper for scripts without an event loop.
+    Without an explicit client, the pooled client for the running event loop is used, and
+    `aclose` closes it.
+    Request latency, rate limit waits, token usage and failures are recorded in `metrics`.
+    With a ResilientCaller, every request is retried, hedged and circuit broken by it; each retry
+    and hedge takes its own concurrency slot and rate limit budget, and no slot is held while
+    backing off. Latency is measured from the moment an attempt has its slot; the wait for a
+    concurrency slot is recorded separately as `slot_wait_seconds`.
+    """
+
+    def __init__(
+        self,
+        client: Optional[AsyncOpenAI] = None,
+        model: str = DEFAULT_MODEL,
+        schema: type[BaseModel] = EmailAnalysis,
+        max_concurrency: int = 8,
+        requests_per_minute: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None,
+        expected_completion_tokens: int = 600,
+        metrics: Optional[Metrics] = None,
+        resilience: Optional[ResilientCaller] = None,
+    ):
+        self.client = client
+        self.model = model
+        self.schema = schema
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.expected_completion_tokens = expected_completion_tokens
+        self.metrics = metrics or get_metrics()
+        self.resilience = resilience
+        self.calls = 0
+        self.total_latency = 0.0
+        self.prompt_tokens = 0
+        self.cached_prompt_tokens = 0
+        self._semaphore = None
+        self._loop = None
+
+    def _get_semaphore(self) -> PrioritySemaphore:
+        # asyncio primitives are bound to the loop that first uses them
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._semaphore = PrioritySemaphore(self.max_concurrency)
+        return self._semaphore
+
+    def _get_client(self) -> AsyncOpenAI:
+        if self.client is not None:
+            return self.client
+        return get_client_manager().get_async_client()
+
+    async def analyze(
+        self,
+        prompt: Union[str, Messages],
+        model: Optional[str] = None,
+        schema: Optional[type[BaseModel]] = None,
+        priority: int = 0,
+    ) -> Any:
+        """
+        Run a single structured-output request, respecting concurrency and rate limits.
+
+        Args:
+            prompt: Rendered messages for one email, or a formatted system prompt
+            model: Model to call instead of the engine's default, so variants can share one pool
+            schema: Response schema to use instead of the engine's, e.g. a section profile
+            priority: Requests with lower values get the next free concurrency slot first
+
+        Returns:
+            The parsed chat completion returned by the API
+        """
+        estimated_tokens = estimate_tokens(prompt_text(prompt)) + self.expected_completion_tokens
+        try:
+            response, latency = await self._send(lambda: self._get_client().beta.chat.completions.parse(
+                model=model or self.model,
+                messages=to_messages(prompt),
+                response_format=schema or self.schema
+            ), estimated_tokens, priority)
+        except Exception as e:
+            self.metrics.increment("model_errors", type=type(e).__name__)
+            raise
+        self._record_response(response, estimated_tokens, latency)
+        return response
+
+    async def analyze_stream(
+        self,
+        prompt: Union[str, Messages],
+        on_fields: Callable[[Dict[str, Any]], Any],
+        fields: Iterable[str] = ROUTING_FIELDS,
+        model: Optional[str] = None,
+        schema: Optional[type[BaseModel]] = None,
+        priority: int = 0,
+    ) -> Any:
+        """
+        Like `analyze`, but streams the completion and calls `on_fields` as soon as `fields` are
+        complete, while the rest of the analysis is still being generated. The time until then is
+        recorded as `early_fields_seconds`.
+
+        Args:
+            prompt: Rendered messages for one email, or a formatted system prompt
+            on_fields: Called once with the values of `fields` by dotted path
+            fields: Dotted field paths to wait for, by default the routing fields
+            model: Model to call instead of the engine's default
+            schema: Response schema to use instead of the engine's
+            priority: Requests with lower values get the next free concurrency slot first
+
+        Returns:
+            The parsed chat completion, as returned by `analyze`
+        """
+        estimated_tokens = estimate_tokens(prompt_text(prompt)) + self.expected_completion_tokens
+        fired = False
+
+        def fields_ready(values: Dict[str, Any], start: float):
+            nonlocal fired
+            # A retried or hedged attempt streams the fields again
+            if not fired:
+                fired = True
+                self.metrics.observe("early_fields_seconds", time.perf_counter() - start)
+                on_fields(values)
+
+        async def attempt():
+            start = time.perf_counter()
+            watcher = FieldWatcher(lambda values: fields_ready(values, start), fields)
+            async with self._get_client().beta.chat.completions.stream(
+                model=model or self.model,
+                messages=to_messages(prompt),
+                response_format=schema or self.schema,
+                stream_options={"include_usage": True}
+            ) as stream:
+                async for event in stream:
+                    if event.type == "content.delta":
+                        watcher.feed(event.delta)
+                return await stream.get_final_completion()
+
+        try:
+            response, latency = await self._send(attempt, estimated_tokens, priority)
+        except Exception as e:
+            self.metrics.increment("model_errors", type=type(e).__name__)
+            raise
+        self._record_response(response, estimated_tokens, latency)
+        return response
+
+    @contextlib.asynccontextmanager
+    async def _slot(self, estimated_tokens: int, priority: int = 0) -> AsyncIterator[None]:
+        # One concurrency slot and one request's rate limit budget, held for a single attempt
+        start = time.perf_counter()
+        async with self._get_semaphore().slot(priority):
+            self.metrics.observe("slot_wait_seconds", time.perf_counter() - start)
+            with self.metrics.timer("rate_limit_wait_seconds"):
+                await self.rate_limiter.acquire(estimated_tokens)
+            yield
+
+    async def _send(self, request: Callable[[], Awaitable[Any]], estimated_tokens: int, priority: int = 0) -> Tuple[Any, float]:
+        # Returns the response with the latency of the attempt that produced it
+        latencies = []
+
+        async def timed():
+            start = time.perf_counter()
+            response = await request()
+            latencies.append(time.perf_counter() - start)
+            return response
+
+        if self.resilience is None:
+            async with self._slot(estimated_tokens, priority):
+                response = await timed()
+        else:
+            response = await self.resilience.call(timed, lambda: self._slot(estimated_tokens, priority))
+        return response, latencies[0]
+
+    def _record_response(self, response: Any, estimated_tokens: int, latency: float):
+        self.calls += 1
+        self.total_latency += latency
+        self.metrics.observe("model_request_seconds", latency)
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            self.rate_limiter.record_usage(estimated_tokens, usage.total_tokens)
+            self.prompt_tokens += usage.prompt_tokens
+            self.metrics.increment("prompt_tokens", usage.prompt_tokens)
+            self.metrics.increment("completion_tokens", usage.completion_tokens)
+            details = getattr(usage, "prompt_tokens_details", None)
+            if details is not None and details.cached_tokens:
+                self.cached_prompt_tokens += details.cached_tokens
+                self.metrics.increment("cached_prompt_tokens", details.cached_tokens)
+
+    async def analyze_batch(self, prompts: Sequence[Union[str, Messages]], return_exceptions: bool = False) -> List[Any]:
+        """
+        Run all prompts concurrently, on the running event loop.
+
+        Args:
+            prompts: Rendered prompts, one per email
+            return_exceptions: Return failures in place instead of raising the first one
+
+        Returns:
+            List: Responses in the same order as `prompts`
+        """
+        return await asyncio.gather(
+            *(self.analyze(prompt) for prompt in prompts),
+            return_exceptions=return_exceptions
+        )
+
+    def run_batch(self, prompts: Sequence[Union[str, Messages]], return_exceptions: bool = False) -> List[Any]:
+        """
+        Synchronous wrapper of `analyze_batch` for scripts, which runs it on a new event loop
+        and closes the pooled client of that loop afterwards.
+
+        Raises:
+            RuntimeError: If called from a running event loop; await `analyze_batch` there
+        """
+        ensure_no_running_loop("AsyncAnalysisEngine.run_batch", "AsyncAnalysisEngine.analyze_batch")
+
+        async def run():
+            try:
+                return await self.analyze_batch(prompts, return_exceptions=return_exceptions)
+            finally:
+                await self.aclose()
+
+        return asyncio.run(run())
+
+    async def aclose(self):
+        """
+        Close the pooled client of the running event loop. A client passed to the engine is left
+        to its owner.
+        """
+        if self.client is None:
+            await get_client_manager().aclose()
@@ -0,0 +1,323 @@
+import abc
+import argparse
+import json
+import os
+import time
+import uuid
+from typing import Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from pydantic import BaseModel
+
+from AnalysisEngine import DEFAULT_MODEL
+from EmailClass import EmailAnalysis
+from ModelClient import get_client_manager
+from Pipeline import iter_dataset_rows
+from PromptTemplate import load_prompt_template
+from ResponseParsing import parse_openai_email_analysis
+from ResultsSink import get_results_writer
+from Testing import batch_testing
+
+try:
+    # Private SDK helper (openai 1.40+) applying the same strict schema conversion as `beta.chat.completions.parse`
+    from openai.lib._parsing._completions import type_to_response_format_param as _sdk_response_format
+except ImportError:
+    _sdk_response_format = None
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+
+
+def response_format_param(schema: type[BaseModel]) -> Dict:
+    """
+    Build the `response_format` of a structured-output request body for a pydantic schema.
+    Uses the OpenAI SDK's strict conversion when this SDK version provides it, and otherwise
+    sends the schema's plain JSON schema without strict mode.
+
+    Args:
+        schema: Structured output schema
+
+    Returns:
+        Dict: `{"type": "json_schema", "json_schema": {...}}` parameter
+    """
+    if _sdk_response_format is not None:
+        return _sdk_response_format(schema)
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": schema.__name__,
+            "schema": schema.model_json_schema(),
+            "strict": False
+        }
+    }
+
+
+def write_batch_requests(
+    dataset_path: str = 'AcaiEmailsDataset.csv',
+    prompt_path: str = 'Prompt.md',
+    requests_path: str = 'requests.jsonl',
+    model: str = DEFAULT_MODEL,
+    schema: type[BaseModel] = EmailAnalysis,
+) -> int:
+    """
+    Render the prompt for every dataset row into a JSONL file of structured-output requests.
+    Each line follows the OpenAI Batch API input format, with `custom_id` set to `row-<index>`.
+
+    Args:
+        dataset_path: CSV file with the emails
+        prompt_path: Markdown prompt template
+        requests_path: Output JSONL file
+        model: Model name
+        schema: Structured output schema
+
+    Returns:
+        int: Number of requests written
+    """
+    template = load_prompt_template(prompt_path)
+    response_format = response_format_param(schema)
+
+    count = 0
+    with open(requests_path, mode='w', encoding='utf-8') as requests_file:
+        for index, row in enumerate(iter_dataset_rows(dataset_path)):
+            messages = template.render(
+                subject=row['Subject'],
+                sender_email=row['Sender'],
+                recipient_email=row['Recipients'],
+                email_body=row['EmailBody']
+            )
+            request = {
+                "custom_id": f"row-{index}",
+                "method": "POST",
+                "url": BATCH_ENDPOINT,
+                "body": {
+                    "model": model,
+                    "messages": messages,
+                    "response_format": response_format
+                }
+            }
+            requests_file.write(json.dumps(request) + "\n")
+            count += 1
+    return count
+
+
+class BatchBackend(abc.ABC):
+    """
+    Interface for services that run a JSONL file of requests as one bulk job.
+    """
+
+    @abc.abstractmethod
+    def submit(self, requests_path: str) -> str:
+        """Submit the requests file and return a job id."""
+
+    @abc.abstractmethod
+    def wait(self, job_id: str, poll_interval: float = 60.0) -> str:
+        """Block until the job finishes and return its final status."""
+
+    @abc.abstractmethod
+    def download_results(self, job_id: str, results_path: str) -> str:
+        """Write the results JSONL of a finished job to `results_path` and return the path."""
+
+
+class OpenAIBatchBackend(BatchBackend):
+    """
+    Runs jobs through the OpenAI Batch API.
+    """
+
+    FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+    def __init__(self, client=None, completion_window: str = "24h"):
+        self.client = client or get_client_manager().get_client()
+        self.completion_window = completion_window
+
+    def submit(self, requests_path: str) -> str:
+        with open(requests_path, 'rb') as requests_file:
+            input_file = self.client.files.create(file=requests_file, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window=self.completion_window
+        )
+        return batch.id
+
+    def wait(self, job_id: str, poll_interval: float = 60.0) -> str:
+        while True:
+            batch = self.client.batches.retrieve(job_id)
+            if batch.status in self.FINAL_STATUSES:
+                return batch.status
+            time.sleep(poll_interval)
+
+    def download_results(self, job_id: str, results_path: str) -> str:
+        batch = self.client.batches.retrieve(job_id)
+        if batch.output_file_id is None:
+            raise ValueError(f"Batch {job_id} has no output file (status: {batch.status})")
+        self.client.files.content(batch.output_file_id).write_to_file(results_path)
+        return results_path
+
+
+class LocalBatchBackend(BatchBackend):
+    """
+    File-based stand-in for a batch service, used for tests and offline runs.
+    Jobs run synchronously on submit; `responder` turns each request line into the
+    message content the model would have returned.
+    """
+
+    def __init__(self, responder: Callable[[Dict], str], jobs_dir: str = 'batch_jobs'):
+        self.responder = responder
+        self.jobs_dir = jobs_dir
+
+    def _results_path(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, f"{job_id}_results.jsonl")
+
+    def submit(self, requests_path: str) -> str:
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        job_id = f"batch_{uuid.uuid4().hex}"
+        with open(requests_path, mode='r', encoding='utf-8') as requests_file, \
+                open(self._results_path(job_id), mode='w', encoding='utf-8') as results_file:
+            for line in requests_file:
+                if not line.strip():
+                    continue
+                request = json.loads(line)
+                result = {
+                    "id": f"batch_req_{uuid.uuid4().hex}",
+                    "custom_id": request["custom_id"],
+                    "response": {
+                        "status_code": 200,
+                        "body": {
+                            "object": "chat.completion",
+                            "model": request["body"]["model"],
+                            "choices": [{
+                                "index": 0,
+                                "message": {"role": "assistant", "content": self.responder(request)},
+                                "finish_reason": "stop"
+                            }]
+                        }
+                    },
+                    "error": None
+                }
+                results_file.write(json.dumps(result) + "\n")
+        return job_id
+
+    def wait(self, job_id: str, poll_interval: float = 60.0) -> str:
+        return "completed" if os.path.exists(self._results_path(job_id)) else "failed"
+
+    def download_results(self, job_id: str, results_path: str) -> str:
+        with open(self._results_path(job_id), 'rb') as source, open(results_path, 'wb') as target:
+            target.write(source.read())
+        return results_path
+
+
+def ground_truth_responder(dataset_path: str = 'AcaiEmailsDataset.csv') -> Callable[[Dict], str]:
+    """
+    Build a LocalBatchBackend responder that replays the dataset's ground truth.
+
+    Args:
+        dataset_path: CSV file with the emails and ground truth
+
+    Returns:
+        Callable: Function mapping a request line to its ground truth JSON
+    """
+    ground_truths = [json.loads(row['GroundTruth']) for row in iter_dataset_rows(dataset_path)]
+
+    def respond(request: Dict) -> str:
+        index = int(request["custom_id"].split("-", 1)[1])
+        return ground_truths[index]
+
+    return respond
+
+
+def load_batch_results(results_path: str) -> Tuple[Dict[str, EmailAnalysis], Dict[str, str]]:
+    """
+    Read a batch results JSONL file.
+
+    Args:
+        results_path: Results file downloaded from the backend
+
+    Returns:
+        Tuple: Validated analyses by custom_id, and error messages by custom_id
+    """
+    analyses = {}
+    errors = {}
+    with open(results_path, mode='r', encoding='utf-8') as results_file:
+        for line in results_file:
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            custom_id = result["custom_id"]
+            response = result.get("response") or {}
+            if result.get("error") or response.get("status_code") != 200:
+                errors[custom_id] = str(result.get("error") or response)
+                continue
+            content = response["body"]["choices"][0]["message"]["content"]
+            try:
+                analyses[custom_id] = parse_openai_email_analysis(content)
+            except ValueError as e:
+                errors[custom_id] = str(e)
+    return analyses, errors
+
+
+def ingest_batch_results(results_path: str, dataset_path: str = 'AcaiEmailsDataset.csv') -> Tuple[List[EmailAnalysis], List[str]]:
+    """
+    Pair the analyses of a batch job with the dataset ground truth, ready for EmailAnalysisTesting.
+    Rows without a successful result are reported and left out.
+
+    Args:
+        results_path: Results file downloaded from the backend
+        dataset_path: CSV file with the emails and ground truth
+
+    Returns:
+        Tuple: Predictions and ground truths in dataset order
+    """
+    analyses, errors = load_batch_results(results_path)
+    predictions = []
+    ground_truths = []
+    for index, row in enumerate(iter_dataset_rows(dataset_path)):
+        custom_id = f"row-{index}"
+        if custom_id in analyses:
+            predictions.append(analyses[custom_id])
+            ground_truths.append(json.loads(row['GroundTruth']))
+    if errors:
+        print(f"{len(errors)} batch requests failed:")
+        for custom_id, error in errors.items():
+            print(f"{custom_id}: {error}")
+    return predictions, ground_truths
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Run the prompt evaluation as an offline batch job")
+    parser.add_argument("command", choices=["prepare", "submit", "ingest", "run"])
+    parser.add_argument("--dataset", default='AcaiEmailsDataset.csv')
+    parser.add_argument("--prompt", default='Prompt.md')
+    parser.add_argument("--requests", default='requests.jsonl', help="Requests JSONL file")
+    parser.add_argument("--results", default='results.jsonl', help="Results JSONL file")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--backend", choices=["openai", "local"], default="openai")
+    parser.add_argument("--job-id", help="Job to download results for (ingest)")
+    parser.add_argument("--poll-interval", type=float, default=60.0)
+    parser.add_argument("--score-workers", type=int, default=None, help="Score the results in this many processes")
+    args = parser.parse_args(argv)
+    load_dotenv()
+
+    if args.backend == "local":
+        backend = LocalBatchBackend(ground_truth_responder(args.dataset))
+    else:
+        backend = OpenAIBatchBackend()
+
+    if args.command in ("prepare", "run"):
+        count = write_batch_requests(args.dataset, args.prompt, args.requests, args.model)
+        print(f"Wrote {count} requests to {args.requests}")
+    if args.command in ("submit", "run"):
+        args.job_id = backend.submit(args.requests)
+        print(f"Submitted batch job {args.job_id}")
+    if args.command == "run":
+        status = backend.wait(args.job_id, args.poll_interval)
+        print(f"Batch job {args.job_id} finished with status {status}")
+    if args.command in ("ingest", "run"):
+        if args.job_id:
+            backend.download_results(args.job_id, args.results)
+        predictions, ground_truths = ingest_batch_results(args.results, args.dataset)
+        results_writer = get_results_writer(prompt_version=load_prompt_template(args.prompt).version)
+        batch_testing(predictions, ground_truths, workers=args.score_workers)
+        results_writer.close()
+
+
+if __name__ == "__main__":
+    main()
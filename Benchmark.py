@@ -0,0 +1,229 @@
+import argparse
+import asyncio
+import json
+import time
+from itertools import cycle, islice
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from AnalysisEngine import AsyncAnalysisEngine
+from EmailClass import EmailAnalysis
+from Metrics import Metrics
+from MockServer import LATENCY_DISTRIBUTIONS, MockModelServer
+from ModelClient import configure_client_manager
+from Pipeline import EmailTask, EvaluationPipeline, iter_dataset_rows
+from PromptTemplate import load_prompt_template
+from Testing import EmailAnalysisTesting
+from main import call_model
+
+SCENARIOS = ("sync", "batch", "pipeline")
+
+
+def latency_percentiles(latencies: List[float]) -> Dict[str, float]:
+    """
+    p50/p95/p99 of a list of latencies, in milliseconds.
+    """
+    if not latencies:
+        return {"p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0}
+    p50, p95, p99 = np.percentile(np.asarray(latencies) * 1000, [50, 95, 99])
+    return {"p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99)}
+
+
+class SampleRecorder(Metrics):
+    """
+    Keeps every observed duration of the given timers, so exact percentiles can be computed.
+    """
+
+    def __init__(self, names=("model_request_seconds", "slot_wait_seconds")):
+        self.samples: Dict[str, List[float]] = {name: [] for name in names}
+
+    def observe(self, name: str, seconds: float, **labels):
+        if name in self.samples:
+            self.samples[name].append(seconds)
+
+
+def _engine_outcome(recorder: SampleRecorder) -> Dict:
+    # Request latency only counts time holding a slot; waiting for one is reported as queue wait
+    return {"latencies": recorder.samples["model_request_seconds"], "queue_waits": recorder.samples["slot_wait_seconds"]}
+
+
+class InstrumentedPipeline(EvaluationPipeline):
+    """
+    EvaluationPipeline that records the CPU time of the synchronous stages.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stage_cpu = {"render": 0.0, "parse": 0.0, "score": 0.0}
+
+    def _timed(self, stage: str, func, task: EmailTask) -> EmailTask:
+        start = time.process_time()
+        result = func(task)
+        self.stage_cpu[stage] += time.process_time() - start
+        return result
+
+    def render(self, task: EmailTask) -> EmailTask:
+        return self._timed("render", super().render, task)
+
+    def parse(self, task: EmailTask) -> EmailTask:
+        return self._timed("parse", super().parse, task)
+
+    def score(self, task: EmailTask) -> EmailTask:
+        return self._timed("score", super().score, task)
+
+
+def bench_sync(rows: List[Dict[str, str]], template) -> Dict:
+    """
+    One `call_model` request at a time, as the original evaluation loop did.
+    """
+    latencies = []
+    errors = 0
+    for row in rows:
+        messages = template.render(row['Subject'], row['Sender'], row['Recipients'], row['EmailBody'])
+        start = time.perf_counter()
+        try:
+            call_model(messages)
+        except Exception:
+            errors += 1
+        latencies.append(time.perf_counter() - start)
+    return {"latencies": latencies, "errors": errors}
+
+
+def bench_batch(rows: List[Dict[str, str]], template, concurrency: int) -> Dict:
+    """
+    All requests through `AsyncAnalysisEngine`, like `batch_call_model`.
+    """
+    recorder = SampleRecorder()
+    engine = AsyncAnalysisEngine(schema=EmailAnalysis, max_concurrency=concurrency, metrics=recorder)
+    prompts = [template.render(row['Subject'], row['Sender'], row['Recipients'], row['EmailBody']) for row in rows]
+    responses = engine.run_batch(prompts, return_exceptions=True)
+    return {**_engine_outcome(recorder), "errors": sum(isinstance(response, Exception) for response in responses)}
+
+
+def bench_pipeline(rows: List[Dict[str, str]], template, concurrency: int) -> Dict:
+    """
+    The full streaming evaluation pipeline used by main.py, without the cache, journal or results CSV.
+    """
+    recorder = SampleRecorder()
+    engine = AsyncAnalysisEngine(schema=EmailAnalysis, max_concurrency=concurrency, metrics=recorder)
+    tester = EmailAnalysisTesting(EmailAnalysis, log_results=False)
+    pipeline = InstrumentedPipeline(engine, template, tester)
+    summary = asyncio.run(pipeline.run(rows))
+    return {
+        **_engine_outcome(recorder),
+        "errors": summary['failed'],
+        "stage_cpu_seconds": pipeline.stage_cpu,
+        "overall_accuracy": summary['overall_accuracy'],
+    }
+
+
+def run_benchmarks(
+    emails: int = 200,
+    scenarios=SCENARIOS,
+    concurrency: int = 16,
+    dataset_path: str = 'AcaiEmailsDataset.csv',
+    prompt_path: str = 'Prompt.md',
+    server: Optional[MockModelServer] = None,
+) -> Dict[str, Dict]:
+    """
+    Run the benchmark scenarios against a mock model server.
+
+    Args:
+        emails: Number of emails per scenario, cycling through the dataset
+        scenarios: Scenarios to run, from SCENARIOS
+        concurrency: Requests in flight for the batch and pipeline scenarios
+        dataset_path: CSV file with the emails and ground truth
+        prompt_path: Markdown prompt template
+        server: Running mock server, one with default settings is started if not given
+
+    Returns:
+        Dict[str, Dict]: Per scenario, emails/sec, request latency percentiles (time holding a concurrency
+        slot), queue wait percentiles, errors, CPU time and stage CPU time
+    """
+    own_server = server is None
+    if own_server:
+        server = MockModelServer(dataset_path, prompt_path).start()
+    configure_client_manager(api_key="mock", base_url=server.base_url, max_connections=concurrency,
+                             max_keepalive_connections=concurrency)
+    template = load_prompt_template(prompt_path)
+    rows = list(islice(cycle(list(iter_dataset_rows(dataset_path))), emails))
+
+    results = {}
+    try:
+        for scenario in scenarios:
+            wall_start = time.perf_counter()
+            cpu_start = time.process_time()
+            if scenario == "sync":
+                outcome = bench_sync(rows, template)
+            elif scenario == "batch":
+                outcome = bench_batch(rows, template, concurrency)
+            elif scenario == "pipeline":
+                outcome = bench_pipeline(rows, template, concurrency)
+            else:
+                raise ValueError(f"Unknown scenario {scenario!r}, expected one of {SCENARIOS}")
+            elapsed = time.perf_counter() - wall_start
+            result = {
+                "emails": len(rows),
+                "seconds": elapsed,
+                "emails_per_sec": len(rows) / elapsed if elapsed else 0.0,
+                "errors": outcome["errors"],
+                "cpu_seconds": time.process_time() - cpu_start,
+            }
+            result.update(latency_percentiles(outcome["latencies"]))
+            result.update({f"queue_{key}": value for key, value in latency_percentiles(outcome.get("queue_waits", [])).items()})
+            for key in ("stage_cpu_seconds", "overall_accuracy"):
+                if key in outcome:
+                    result[key] = outcome[key]
+            results[scenario] = result
+    finally:
+        if own_server:
+            server.stop()
+    return results
+
+
+def report_benchmarks(results: Dict[str, Dict]):
+    print(f"{'scenario':<10}{'emails/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+          f"{'queue p50':>11}{'queue p95':>11}{'cpu s':>8}{'errors':>8}")
+    for scenario, result in results.items():
+        print(f"{scenario:<10}{result['emails_per_sec']:>10.1f}{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}"
+              f"{result['p99_ms']:>10.1f}{result['queue_p50_ms']:>11.1f}{result['queue_p95_ms']:>11.1f}"
+              f"{result['cpu_seconds']:>8.2f}{result['errors']:>8}")
+        if "stage_cpu_seconds" in result:
+            stages = ", ".join(f"{stage} {seconds * 1000:.1f} ms" for stage, seconds in result["stage_cpu_seconds"].items())
+            print(f"{'':<10}stage CPU: {stages}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the evaluation paths against a local mock model server")
+    parser.add_argument("--emails", type=int, default=200, help="Emails per scenario, cycling through the dataset")
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="Scenario to run, can be repeated (default: all)")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--dataset", default='AcaiEmailsDataset.csv')
+    parser.add_argument("--prompt", default='Prompt.md')
+    parser.add_argument("--latency", type=float, default=0.05, help="Mean mock response latency in seconds")
+    parser.add_argument("--latency-distribution", choices=LATENCY_DISTRIBUTIONS, default="lognormal")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of mock requests answered with a 500")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", default=None, help="Also write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    server = MockModelServer(
+        args.dataset,
+        args.prompt,
+        latency=args.latency,
+        latency_distribution=args.latency_distribution,
+        error_rate=args.error_rate,
+        seed=args.seed
+    )
+    with server:
+        results = run_benchmarks(args.emails, args.scenario or SCENARIOS, args.concurrency,
+                                 args.dataset, args.prompt, server=server)
+    report_benchmarks(results)
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
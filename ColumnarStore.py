@@ -0,0 +1,406 @@
+import argparse
+import csv
+import enum
+import functools
+import json
+import os
+import threading
+import typing
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pydantic import BaseModel
+
+from EmailClass import EmailAnalysis
+
+PREDICTIONS = "predictions"
+ACCURACY = "accuracy"
+
+# Enum values are stored as small integer codes into a fixed dictionary of the enum's values
+_ENUM_TYPE = pa.dictionary(pa.int8(), pa.string())
+
+
+def _unwrap_optional(annotation):
+    if typing.get_origin(annotation) is Union:
+        args = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+        if len(args) == 1:
+            return args[0]
+    return annotation
+
+
+def _is_model(annotation) -> bool:
+    return isinstance(annotation, type) and issubclass(annotation, BaseModel)
+
+
+def _is_enum(annotation) -> bool:
+    return isinstance(annotation, type) and issubclass(annotation, enum.Enum)
+
+
+def _arrow_type(annotation) -> pa.DataType:
+    annotation = _unwrap_optional(annotation)
+    if typing.get_origin(annotation) in (list, List):
+        return pa.list_(_arrow_type(typing.get_args(annotation)[0]))
+    if _is_model(annotation):
+        return pa.struct([pa.field(name, _arrow_type(field.annotation)) for name, field in annotation.model_fields.items()])
+    if _is_enum(annotation):
+        return _ENUM_TYPE
+    if annotation is bool:
+        return pa.bool_()
+    if annotation is int:
+        return pa.int64()
+    if annotation is float:
+        return pa.float64()
+    return pa.string()
+
+
+@functools.lru_cache(maxsize=None)
+def leaf_fields(model_class: type[BaseModel] = EmailAnalysis) -> Tuple[Tuple[str, Any], ...]:
+    """
+    The flattened field paths of a model with their annotations, in schema order. Nested models
+    become dotted paths (e.g. "sentiment.urgency"), like the keys scored by EmailAnalysisTesting;
+    lists are kept as one field.
+    """
+    leaves = []
+
+    def walk(model, prefix):
+        for name, field in model.model_fields.items():
+            annotation = _unwrap_optional(field.annotation)
+            path = f"{prefix}{name}"
+            if _is_model(annotation):
+                walk(annotation, f"{path}.")
+            else:
+                leaves.append((path, annotation))
+
+    walk(model_class, "")
+    return tuple(leaves)
+
+
+@functools.lru_cache(maxsize=None)
+def predictions_schema(model_class: type[BaseModel] = EmailAnalysis) -> pa.Schema:
+    """
+    Arrow schema of the predictions table: one column per flattened field path, enums
+    dictionary-encoded. The run id is the partition key and is not stored in the files.
+    """
+    fields = [pa.field("prompt_version", pa.dictionary(pa.int32(), pa.string())), pa.field("row_id", pa.string())]
+    fields += [pa.field(path, _arrow_type(annotation)) for path, annotation in leaf_fields(model_class)]
+    return pa.schema(fields)
+
+
+@functools.lru_cache(maxsize=None)
+def accuracy_schema(model_class: type[BaseModel] = EmailAnalysis) -> pa.Schema:
+    """
+    Arrow schema of the accuracy table: the overall accuracy and one float column per field path.
+    """
+    fields = [
+        pa.field("prompt_version", pa.dictionary(pa.int32(), pa.string())),
+        pa.field("row_id", pa.string()),
+        pa.field("timestamp", pa.timestamp("us")),
+        pa.field("overall_accuracy", pa.float32()),
+    ]
+    fields += [pa.field(path, pa.float32()) for path, _ in leaf_fields(model_class)]
+    return pa.schema(fields)
+
+
+def _enum_array(values: Sequence[Any], enum_class: type[enum.Enum]) -> pa.Array:
+    members = [member.value for member in enum_class]
+    codes = {value: code for code, value in enumerate(members)}
+    # Values outside the enum are stored as nulls rather than growing the dictionary
+    indices = pa.array([codes.get(value.value if isinstance(value, enum.Enum) else value) for value in values], pa.int8())
+    return pa.DictionaryArray.from_arrays(indices, pa.array(members, pa.string()))
+
+
+def _build_array(values: Sequence[Any], annotation) -> pa.Array:
+    annotation = _unwrap_optional(annotation)
+    if typing.get_origin(annotation) in (list, List):
+        offsets = [0]
+        items = []
+        for value in values:
+            items.extend(value or [])
+            offsets.append(len(items))
+        child = _build_array(items, typing.get_args(annotation)[0])
+        return pa.ListArray.from_arrays(pa.array(offsets, pa.int32()), child)
+    if _is_model(annotation):
+        names = list(annotation.model_fields)
+        children = [
+            _build_array([(value or {}).get(name) for value in values], annotation.model_fields[name].annotation)
+            for name in names
+        ]
+        return pa.StructArray.from_arrays(children, names=names)
+    if _is_enum(annotation):
+        return _enum_array(values, annotation)
+    return pa.array(values, _arrow_type(annotation))
+
+
+def _flatten(analysis: Dict, prefix: str = "", flat: Optional[Dict] = None) -> Dict:
+    flat = {} if flat is None else flat
+    for key, value in analysis.items():
+        if isinstance(value, dict):
+            _flatten(value, f"{prefix}{key}.", flat)
+        else:
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def _constant_column(value: Optional[str], length: int) -> pa.Array:
+    if value is None:
+        return pa.DictionaryArray.from_arrays(pa.nulls(length, pa.int32()), pa.array([], pa.string()))
+    return pa.DictionaryArray.from_arrays(pa.array([0] * length, pa.int32()), pa.array([value], pa.string()))
+
+
+def predictions_table(rows: Sequence[Tuple[str, Union[BaseModel, Dict]]], prompt_version: Optional[str] = None,
+                      model_class: type[BaseModel] = EmailAnalysis) -> pa.Table:
+    """
+    Build a predictions table.
+
+    Args:
+        rows: (row id, analysis) pairs; analyses are models or their JSON dictionaries
+        prompt_version: Version of the prompt that produced the analyses
+        model_class: Model of the analyses
+
+    Returns:
+        pa.Table: One row per analysis, with the `predictions_schema` columns
+    """
+    flat = [
+        _flatten(analysis.model_dump(mode='json') if isinstance(analysis, BaseModel) else analysis)
+        for _, analysis in rows
+    ]
+    columns = [
+        _constant_column(prompt_version, len(rows)),
+        pa.array([row_id for row_id, _ in rows], pa.string()),
+    ]
+    columns += [_build_array([row.get(path) for row in flat], annotation) for path, annotation in leaf_fields(model_class)]
+    return pa.Table.from_arrays(columns, schema=predictions_schema(model_class))
+
+
+def accuracy_table(rows: Sequence[Tuple[str, Dict]], prompt_version: Optional[str] = None,
+                   model_class: type[BaseModel] = EmailAnalysis) -> pa.Table:
+    """
+    Build an accuracy table.
+
+    Args:
+        rows: (row id, accuracy record) pairs, records as returned by `calculate_accuracy`
+        prompt_version: Version of the prompt that produced the analyses
+        model_class: Model the accuracies were computed for
+
+    Returns:
+        pa.Table: One row per record; fields a record did not score are null
+    """
+    columns = [
+        _constant_column(prompt_version, len(rows)),
+        pa.array([row_id for row_id, _ in rows], pa.string()),
+        pa.array([datetime.fromisoformat(record["timestamp"]) if record.get("timestamp") else None for _, record in rows], pa.timestamp("us")),
+        pa.array([record.get("overall_accuracy") for _, record in rows], pa.float32()),
+    ]
+    columns += [
+        pa.array([record.get("field_accuracies", {}).get(path) for _, record in rows], pa.float32())
+        for path, _ in leaf_fields(model_class)
+    ]
+    return pa.Table.from_arrays(columns, schema=accuracy_schema(model_class))
+
+
+class ColumnarResultsStore:
+    """
+    Parquet store of predictions and per-field accuracies, partitioned by run:
+    `<root>/predictions/run_id=<id>/part-00000.parquet` and likewise for `accuracy`.
+    Every run appends its own files, so earlier runs are never rewritten, and the whole store can
+    be scanned as one dataset with `read_table`. Rows are buffered and written `batch_size` at a time.
+    A store opened for an existing run (main.py keeps the run id on `--resume`) appends new part
+    files to it and skips the rows the run already stored.
+    """
+
+    def __init__(
+        self,
+        root: str = "results_store",
+        run_id: str = "default",
+        prompt_version: Optional[str] = None,
+        model_class: type[BaseModel] = EmailAnalysis,
+        batch_size: int = 10000,
+    ):
+        self.root = root
+        self.run_id = run_id
+        self.prompt_version = prompt_version
+        self.model_class = model_class
+        self.batch_size = batch_size
+        self.written = 0
+        self._predictions: List[Tuple[str, Union[BaseModel, Dict]]] = []
+        self._accuracies: List[Tuple[str, Dict]] = []
+        self._lock = threading.Lock()
+        self._stored = {table: self._stored_row_ids(table) for table in (PREDICTIONS, ACCURACY)}
+
+    def _stored_row_ids(self, table: str) -> set:
+        directory = os.path.join(self.root, table, f"run_id={self.run_id}")
+        if not os.path.isdir(directory) or not any(file.endswith(".parquet") for file in os.listdir(directory)):
+            return set()
+        return set(ds.dataset(directory, format="parquet").to_table(columns=["row_id"])["row_id"].to_pylist())
+
+    def _run_directory(self, table: str) -> str:
+        directory = os.path.join(self.root, table, f"run_id={self.run_id}")
+        os.makedirs(directory, exist_ok=True)
+        return directory
+
+    def _write(self, table_name: str, table: pa.Table):
+        directory = self._run_directory(table_name)
+        # A resumed run continues the numbering of the parts it already wrote
+        part = sum(1 for file in os.listdir(directory) if file.endswith(".parquet"))
+        name = f"part-{part:05d}.parquet"
+        # Written under a hidden name first so readers never scan a partial file
+        temporary = os.path.join(directory, f".{name}.tmp")
+        pq.write_table(table, temporary, compression="zstd")
+        os.replace(temporary, os.path.join(directory, name))
+
+    def add(self, row_id: str, analysis: Optional[Union[BaseModel, Dict]] = None, accuracy: Optional[Dict] = None):
+        """
+        Buffer the prediction and/or accuracy record of one email. Records of rows this run
+        already stored are ignored.
+
+        Args:
+            row_id: Identifier of the email
+            analysis: Validated analysis or its JSON dictionary
+            accuracy: Accuracy record from `calculate_accuracy`
+        """
+        with self._lock:
+            if analysis is not None and row_id not in self._stored[PREDICTIONS]:
+                self._stored[PREDICTIONS].add(row_id)
+                self._predictions.append((row_id, analysis))
+            if accuracy is not None and row_id not in self._stored[ACCURACY]:
+                self._stored[ACCURACY].add(row_id)
+                self._accuracies.append((row_id, accuracy))
+            full = max(len(self._predictions), len(self._accuracies)) >= self.batch_size
+        if full:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered rows as new part files of this run.
+        """
+        with self._lock:
+            predictions, self._predictions = self._predictions, []
+            accuracies, self._accuracies = self._accuracies, []
+            if predictions:
+                self._write(PREDICTIONS, predictions_table(predictions, self.prompt_version, self.model_class))
+            if accuracies:
+                self._write(ACCURACY, accuracy_table(accuracies, self.prompt_version, self.model_class))
+            self.written += len(predictions)
+
+    def close(self):
+        self.flush()
+
+
+def read_table(root: str = "results_store", table: str = ACCURACY, columns: Optional[List[str]] = None,
+               run_ids: Optional[List[str]] = None) -> pa.Table:
+    """
+    Scan a table of the store across runs, reading only the requested columns and runs.
+
+    Args:
+        root: Store directory
+        table: PREDICTIONS or ACCURACY
+        columns: Columns to read, including the `run_id` partition column; all by default
+        run_ids: Only read these runs
+
+    Returns:
+        pa.Table: Matching rows of every run
+    """
+    dataset = ds.dataset(
+        os.path.join(root, table),
+        format="parquet",
+        partitioning=ds.HivePartitioning.discover(infer_dictionary=True)
+    )
+    run_filter = ds.field("run_id").isin(run_ids) if run_ids else None
+    return dataset.to_table(columns=columns, filter=run_filter)
+
+
+def accuracy_trend(root: str = "results_store", fields: Sequence[str] = ()) -> List[Dict]:
+    """
+    Mean accuracy per run, oldest run first.
+
+    Args:
+        root: Store directory
+        fields: Field paths whose mean accuracy is reported next to the overall accuracy
+
+    Returns:
+        List[Dict]: run_id, emails, first timestamp and mean accuracies of every run
+    """
+    table = read_table(root, ACCURACY, columns=["run_id", "row_id", "timestamp", "overall_accuracy", *fields])
+    table = table.set_column(0, "run_id", table["run_id"].cast(pa.string()))
+    grouped = table.group_by("run_id").aggregate(
+        [("row_id", "count"), ("timestamp", "min"), ("overall_accuracy", "mean")] + [(field, "mean") for field in fields]
+    )
+    rows = [
+        {
+            "run_id": row["run_id"],
+            "emails": row["row_id_count"],
+            "started": row["timestamp_min"],
+            "overall_accuracy": row["overall_accuracy_mean"],
+            **{field: row[f"{field}_mean"] for field in fields},
+        }
+        for row in grouped.to_pylist()
+    ]
+    return sorted(rows, key=lambda row: (row["started"] is None, row["started"] or datetime.min))
+
+
+def value_counts(root: str = "results_store", column: str = "primary_purpose") -> List[Dict]:
+    """
+    Distribution of a predicted field per run, e.g. purposes or `sentiment.overall_tone`.
+
+    Returns:
+        List[Dict]: run_id, value and count, sorted by run and descending count
+    """
+    table = read_table(root, PREDICTIONS, columns=["run_id", column])
+    table = pa.table({
+        "run_id": table["run_id"].cast(pa.string()),
+        "value": table[column].cast(pa.string()),
+    })
+    grouped = table.group_by(["run_id", "value"]).aggregate([("value", "count")]).to_pylist()
+    return sorted(grouped, key=lambda row: (row["run_id"], -row["value_count"]))
+
+
+def import_results_csv(path: str = "Results.csv", root: str = "results_store") -> int:
+    """
+    Convert the JSON accuracy records of a results CSV into the accuracy table, one run per
+    run id. Records written before runs were tagged go to the run "legacy".
+
+    Returns:
+        int: Number of records imported
+    """
+    by_run: Dict[Tuple[str, Optional[str]], List[Tuple[str, Dict]]] = {}
+    with open(path, newline="") as file:
+        for i, (line,) in enumerate(csv.reader(file)):
+            record = json.loads(line)
+            key = (record.get("run_id") or "legacy", record.get("prompt_version"))
+            by_run.setdefault(key, []).append((f"record-{i}", record))
+    for (run_id, prompt_version), rows in by_run.items():
+        store = ColumnarResultsStore(root, run_id=run_id, prompt_version=prompt_version)
+        for row_id, record in rows:
+            store.add(row_id, accuracy=record)
+        store.close()
+    return sum(len(rows) for rows in by_run.values())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query the columnar results store")
+    parser.add_argument("--store", default="results_store", help="Store directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    trend = commands.add_parser("trend", help="Mean accuracy per run")
+    trend.add_argument("--field", action="append", default=[], help="Also report this field path (repeatable)")
+    counts = commands.add_parser("counts", help="Distribution of a predicted field per run")
+    counts.add_argument("--column", default="primary_purpose", help="Field path, e.g. sentiment.overall_tone")
+    imported = commands.add_parser("import-results", help="Import the JSON records of a results CSV")
+    imported.add_argument("path", nargs="?", default="Results.csv")
+    args = parser.parse_args(argv)
+
+    if args.command == "trend":
+        for row in accuracy_trend(args.store, args.field):
+            fields = "".join(f", {field} {row[field]:.2%}" for field in args.field if row[field] is not None)
+            print(f"{row['run_id']} ({row['started']}): {row['emails']} emails, overall {row['overall_accuracy']:.2%}{fields}")
+    elif args.command == "counts":
+        for row in value_counts(args.store, args.column):
+            print(f"{row['run_id']}\t{row['value']}\t{row['value_count']}")
+    else:
+        print(f"Imported {import_results_csv(args.path, args.store)} records into {args.store}")
+
+
+if __name__ == "__main__":
+    main()
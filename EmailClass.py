@@ -159,8 +159,8 @@ class SentimentAnalysis(BaseModel):
     Critical for prioritizing responses and identifying customer satisfaction issues.
     
     Attributes:
-        overall_tone: General sentiment of the message
         urgency: Level of urgency expressed
+        overall_tone: General sentiment of the message
         satisfaction_score: Customer satisfaction indicator (0-1)
         emotional_indicators: Detected emotional expressions
         key_phrases: Important phrases identified
@@ -169,8 +169,9 @@ class SentimentAnalysis(BaseModel):
         frustration_level: Detected frustration (0-1)
         response_expectation: Expected response timeframe
     """
-    overall_tone: SentimentLevel
+    # Urgency comes first so it is complete early when the response is streamed
     urgency: UrgencyLevel
+    overall_tone: SentimentLevel
     satisfaction_score: float
     #emotional_indicators: List[str]
     #key_phrases: List[str]]
@@ -253,6 +254,7 @@ class EmailAnalysis(BaseModel):
     Combines all aspects of email analysis for customer service and business intelligence.
     
     Key Components:
+    - Routing fields, first so they can be acted on while the rest is still generated
     - Basic email metadata (ID, timestamp, subject)
     - Purpose and type classification
     - Content analysis (services, monetary aspects, competitors)
@@ -270,6 +272,11 @@ class EmailAnalysis(BaseModel):
     4. Compliance tracking
     5. Performance analytics
     """
+    # Triage: generated first so a streamed response can be routed before it is complete
+    requires_immediate_attention: bool
+    primary_purpose: PurposeType
+    sentiment: SentimentAnalysis
+
     # Basic Email Information
     email_id: str
     subject: str
@@ -279,7 +286,6 @@ class EmailAnalysis(BaseModel):
     #response_to: str]
     
     # Purpose Classification
-    primary_purpose: PurposeType
     secondary_purposes: List[PurposeType] 
     booking_type: BookingType
     support_type: SupportType
@@ -293,9 +299,6 @@ class EmailAnalysis(BaseModel):
     # urls_mentioned: List[str]]
     # attachments: List[str]]
     
-    # Sentiment Analysis
-    sentiment: SentimentAnalysis
-    
     # Trip Information
     trip_details: TripDetails
     
@@ -315,7 +318,6 @@ class EmailAnalysis(BaseModel):
     
     # Additional Metadata
     #tags: List[str] = []
-    requires_immediate_attention: bool 
     # processed_by: str]
     # processing_time: float]
     confidence_score: float
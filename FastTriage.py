@@ -0,0 +1,406 @@
+import argparse
+import json
+import random
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from EmailClass import PurposeType, SentimentLevel, UrgencyLevel
+from NearDuplicates import normalize_email_text
+
+# Enum fields predicted by the fast path, by field path in EmailAnalysis
+TRIAGE_FIELDS = {
+    "primary_purpose": PurposeType,
+    "sentiment.overall_tone": SentimentLevel,
+    "sentiment.urgency": UrgencyLevel,
+}
+
+
+def hashed_features(subject: str, body: str, n_features: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Sparse hashed unigram and bigram features of an email, L2-normalized.
+
+    Args:
+        subject: Email subject
+        body: Email body
+        n_features: Size of the hashed feature space
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Feature indices and their values
+    """
+    tokens = normalize_email_text(subject, body)
+    grams = tokens + [f"{first} {second}" for first, second in zip(tokens, tokens[1:])]
+    counts: Dict[int, float] = {}
+    for gram in grams:
+        index = zlib.crc32(gram.encode("utf-8")) % n_features
+        counts[index] = counts.get(index, 0.0) + 1.0
+    indices = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+    values = np.fromiter(counts.values(), dtype=np.float64, count=len(counts))
+    norm = np.sqrt((values ** 2).sum())
+    if norm:
+        values /= norm
+    return indices, values
+
+
+def is_held_out(subject: str, body: str, fraction: float) -> bool:
+    """
+    Whether an email belongs to the held-out split. The split hashes the email text, so it is the
+    same across runs, dataset orderings and repeated copies of an email.
+
+    Args:
+        subject: Email subject
+        body: Email body
+        fraction: Share of emails held out
+
+    Returns:
+        bool: True if the email must not be trained on
+    """
+    return zlib.crc32(f"{subject}\n{body}".encode("utf-8")) % 10000 < fraction * 10000
+
+
+def split_rows(rows: Sequence[Dict[str, str]], holdout_fraction: float) -> Tuple[List[Dict[str, str]], List[Dict[str, str]]]:
+    """
+    Split dataset rows into training rows and held-out rows with `is_held_out`.
+
+    Returns:
+        Tuple[List, List]: Training rows and held-out rows
+    """
+    train, held_out = [], []
+    for row in rows:
+        (held_out if is_held_out(row['Subject'], row['EmailBody'], holdout_fraction) else train).append(row)
+    return train, held_out
+
+
+def _stack(features: Sequence[Tuple[np.ndarray, np.ndarray]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Sparse batch as (row, column, value) triplets
+    rows = np.concatenate([np.full(len(indices), i, dtype=np.int64) for i, (indices, _) in enumerate(features)])
+    columns = np.concatenate([indices for indices, _ in features])
+    values = np.concatenate([values for _, values in features])
+    return rows, columns, values
+
+
+def _softmax(logits: np.ndarray) -> np.ndarray:
+    logits = logits - logits.max(axis=1, keepdims=True)
+    exp = np.exp(logits)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+class SoftmaxClassifier:
+    """
+    Multinomial logistic regression over sparse hashed features, trained by full-batch gradient
+    descent with L2 regularization, with a temperature fitted on held-out data to calibrate
+    the predicted probabilities.
+    """
+
+    def __init__(self, classes: Sequence[str], n_features: int, l2: float = 1e-3):
+        self.classes = list(classes)
+        self.n_features = n_features
+        self.l2 = l2
+        self.weights = np.zeros((n_features, len(self.classes)))
+        self.bias = np.zeros(len(self.classes))
+        self.temperature = 1.0
+
+    def logits(self, batch: Tuple[np.ndarray, np.ndarray, np.ndarray], n: int) -> np.ndarray:
+        rows, columns, values = batch
+        logits = np.zeros((n, len(self.classes)))
+        np.add.at(logits, rows, self.weights[columns] * values[:, None])
+        return logits + self.bias
+
+    def fit(self, batch, labels: np.ndarray, epochs: int = 200, learning_rate: float = 2.0):
+        n = len(labels)
+        rows, columns, values = batch
+        targets = np.zeros((n, len(self.classes)))
+        targets[np.arange(n), labels] = 1.0
+        for _ in range(epochs):
+            gradient = (_softmax(self.logits(batch, n)) - targets) / n
+            weight_gradient = np.zeros_like(self.weights)
+            np.add.at(weight_gradient, columns, gradient[rows] * values[:, None])
+            self.weights -= learning_rate * (weight_gradient + self.l2 * self.weights)
+            self.bias -= learning_rate * gradient.sum(axis=0)
+
+    def calibrate(self, logits: np.ndarray, labels: np.ndarray):
+        """
+        Pick the temperature that minimizes the negative log likelihood of `labels`,
+        given logits computed on rows the classifier was not trained on.
+        """
+        best = None
+        for temperature in np.geomspace(0.2, 10.0, 50):
+            probabilities = _softmax(logits / temperature)
+            nll = -np.log(probabilities[np.arange(len(labels)), labels] + 1e-12).mean()
+            if best is None or nll < best[0]:
+                best = (nll, temperature)
+        self.temperature = float(best[1])
+
+    def predict_proba(self, batch, n: int) -> np.ndarray:
+        return _softmax(self.logits(batch, n) / self.temperature)
+
+    def predict_one(self, indices: np.ndarray, values: np.ndarray) -> np.ndarray:
+        # Dense dot product over the few active features, much faster than the batch path for one email
+        logits = (values @ self.weights[indices] + self.bias) / self.temperature
+        exp = np.exp(logits - logits.max())
+        return exp / exp.sum()
+
+
+@dataclass
+class TriageResult:
+    """
+    Fast-path prediction of the triage enum fields of one email.
+    """
+    predictions: Dict[str, str]
+    confidences: Dict[str, float]
+    seconds: float
+
+    @property
+    def confidence(self) -> float:
+        return min(self.confidences.values())
+
+    def as_partial_analysis(self) -> Dict:
+        """
+        Predictions nested like an EmailAnalysis JSON, for scoring with `calculate_accuracy(..., fields=TRIAGE_FIELDS)`.
+        """
+        partial: Dict = {}
+        for field_path, value in self.predictions.items():
+            *parents, name = field_path.split(".")
+            level = partial
+            for parent in parents:
+                level = level.setdefault(parent, {})
+            level[name] = value
+        return partial
+
+
+class FastTriageModel:
+    """
+    Lightweight local classifier for the triage enum fields (purpose, tone and urgency),
+    trained from the GroundTruth column. One calibrated softmax classifier per field shares
+    the hashed n-gram features of the email, so a prediction takes microseconds.
+    `holdout_fraction` records the share of emails kept out of training with `is_held_out`,
+    None if the model was trained on every row it was given.
+    """
+
+    def __init__(self, n_features: int = 2 ** 16, l2: float = 1e-3, epochs: int = 200,
+                 holdout_fraction: Optional[float] = None):
+        self.n_features = n_features
+        self.l2 = l2
+        self.epochs = epochs
+        self.holdout_fraction = holdout_fraction
+        self.classifiers: Dict[str, SoftmaxClassifier] = {}
+
+    def was_trained_on(self, subject: str, body: str) -> bool:
+        """
+        Whether an email may have been in the training rows, so its predictions are in-sample.
+        """
+        return self.holdout_fraction is None or not is_held_out(subject, body, self.holdout_fraction)
+
+    @staticmethod
+    def _label(ground_truth: Dict, field_path: str) -> str:
+        value = ground_truth
+        for key in field_path.split("."):
+            value = value[key]
+        return value
+
+    def fit(self, rows: Sequence[Dict[str, str]], calibration_fraction: float = 0.2, seed: int = 0, folds: int = 5) -> "FastTriageModel":
+        """
+        Train on dataset rows and calibrate the confidences on rows held out from training.
+        With too few rows to hold out a calibration set, out-of-fold predictions from
+        `folds`-fold cross-validation are used for calibration instead.
+
+        Args:
+            rows: Dataset rows with Subject, EmailBody and GroundTruth
+            calibration_fraction: Share of rows used for temperature calibration
+            seed: Shuffling seed
+            folds: Number of cross-validation folds for small datasets
+
+        Returns:
+            FastTriageModel: This model
+        """
+        rows = list(rows)
+        random.Random(seed).shuffle(rows)
+        truths = [json.loads(json.loads(row['GroundTruth'])) for row in rows]
+        features = [hashed_features(row['Subject'], row['EmailBody'], self.n_features) for row in rows]
+        n_calibration = int(len(rows) * calibration_fraction)
+        for field_path, enum_class in TRIAGE_FIELDS.items():
+            classes = [member.value for member in enum_class]
+            labels = np.array([classes.index(self._label(truth, field_path)) for truth in truths])
+            if n_calibration >= 50:
+                classifier = self._train(classes, features[n_calibration:], labels[n_calibration:])
+                calibration_logits = classifier.logits(_stack(features[:n_calibration]), n_calibration)
+                calibration_labels = labels[:n_calibration]
+            else:
+                calibration_logits = np.zeros((len(rows), len(classes)))
+                for fold in range(min(folds, len(rows))):
+                    held_out = np.arange(fold, len(rows), folds)
+                    kept = np.setdiff1d(np.arange(len(rows)), held_out)
+                    fold_classifier = self._train(classes, [features[i] for i in kept], labels[kept])
+                    calibration_logits[held_out] = fold_classifier.logits(_stack([features[i] for i in held_out]), len(held_out))
+                calibration_labels = labels
+                classifier = self._train(classes, features, labels)
+            classifier.calibrate(calibration_logits, calibration_labels)
+            self.classifiers[field_path] = classifier
+        return self
+
+    def _train(self, classes: Sequence[str], features, labels: np.ndarray) -> SoftmaxClassifier:
+        classifier = SoftmaxClassifier(classes, self.n_features, self.l2)
+        classifier.fit(_stack(features), labels, self.epochs)
+        return classifier
+
+    def predict(self, subject: str, body: str) -> TriageResult:
+        """
+        Predict the triage fields of one email.
+
+        Args:
+            subject: Email subject
+            body: Email body
+
+        Returns:
+            TriageResult: Predicted values, calibrated confidences and prediction time
+        """
+        start = time.perf_counter()
+        indices, values = hashed_features(subject, body, self.n_features)
+        predictions = {}
+        confidences = {}
+        for field_path, classifier in self.classifiers.items():
+            probabilities = classifier.predict_one(indices, values)
+            best = int(probabilities.argmax())
+            predictions[field_path] = classifier.classes[best]
+            confidences[field_path] = float(probabilities[best])
+        return TriageResult(predictions, confidences, time.perf_counter() - start)
+
+    def save(self, path: str):
+        arrays = {}
+        for field_path, classifier in self.classifiers.items():
+            arrays[f"{field_path}/weights"] = classifier.weights
+            arrays[f"{field_path}/bias"] = classifier.bias
+        meta = {
+            "n_features": self.n_features,
+            "l2": self.l2,
+            "holdout_fraction": self.holdout_fraction,
+            "fields": {
+                field_path: {"classes": classifier.classes, "temperature": classifier.temperature}
+                for field_path, classifier in self.classifiers.items()
+            },
+        }
+        arrays["meta"] = np.array(json.dumps(meta))
+        with open(path, "wb") as file:
+            np.savez_compressed(file, **arrays)
+
+    @classmethod
+    def load(cls, path: str) -> "FastTriageModel":
+        with np.load(path) as arrays:
+            meta = json.loads(str(arrays["meta"]))
+            model = cls(n_features=meta["n_features"], l2=meta["l2"], holdout_fraction=meta.get("holdout_fraction"))
+            for field_path, field_meta in meta["fields"].items():
+                classifier = SoftmaxClassifier(field_meta["classes"], model.n_features, model.l2)
+                classifier.weights = arrays[f"{field_path}/weights"]
+                classifier.bias = arrays[f"{field_path}/bias"]
+                classifier.temperature = field_meta["temperature"]
+                model.classifiers[field_path] = classifier
+        return model
+
+
+class TriageCascade:
+    """
+    Routes emails between the local fast path and the LLM. Emails whose least confident triage
+    field reaches `threshold` are triaged locally; the rest go to the model. With `held_out_only`,
+    emails the classifier was trained on always go to the model, so the accuracy measured on
+    triaged emails is out-of-sample.
+    """
+
+    def __init__(self, model: FastTriageModel, threshold: float = 0.9, held_out_only: bool = True):
+        self.model = model
+        self.threshold = threshold
+        self.held_out_only = held_out_only
+        self.confident = 0
+        self.uncertain = 0
+        self.in_sample = 0
+
+    def triage(self, subject: str, body: str) -> Tuple[TriageResult, bool]:
+        """
+        Args:
+            subject: Email subject
+            body: Email body
+
+        Returns:
+            Tuple[TriageResult, bool]: The fast-path prediction, and whether it is confident enough to skip the model
+        """
+        result = self.model.predict(subject, body)
+        if self.held_out_only and self.model.was_trained_on(subject, body):
+            self.in_sample += 1
+            return result, False
+        confident = result.confidence >= self.threshold
+        if confident:
+            self.confident += 1
+        else:
+            self.uncertain += 1
+        return result, confident
+
+
+def evaluate(model: FastTriageModel, rows: Sequence[Dict[str, str]], threshold: float) -> Dict:
+    """
+    Accuracy and coverage of the fast path on labelled rows.
+
+    Returns:
+        Dict: Share of rows above the threshold, accuracy per field on those rows and on all rows,
+        and the median prediction time in microseconds
+    """
+    covered = 0
+    correct_covered = {field_path: 0 for field_path in TRIAGE_FIELDS}
+    correct_all = {field_path: 0 for field_path in TRIAGE_FIELDS}
+    timings = []
+    for row in rows:
+        truth = json.loads(json.loads(row['GroundTruth']))
+        result = model.predict(row['Subject'], row['EmailBody'])
+        timings.append(result.seconds)
+        confident = result.confidence >= threshold
+        covered += confident
+        for field_path in TRIAGE_FIELDS:
+            hit = result.predictions[field_path] == FastTriageModel._label(truth, field_path)
+            correct_all[field_path] += hit
+            correct_covered[field_path] += hit and confident
+    return {
+        "rows": len(rows),
+        "coverage": covered / len(rows) if rows else 0.0,
+        "accuracy_on_covered": {field: count / covered if covered else 0.0 for field, count in correct_covered.items()},
+        "accuracy_on_all": {field: count / len(rows) if rows else 0.0 for field, count in correct_all.items()},
+        "median_microseconds": float(np.median(timings) * 1e6) if timings else 0.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train or evaluate the local fast-path triage classifier")
+    parser.add_argument("command", choices=["train", "evaluate"])
+    parser.add_argument("--dataset", default='AcaiEmailsDataset.csv')
+    parser.add_argument("--model-path", default='fast_triage.npz')
+    parser.add_argument("--threshold", type=float, default=0.9, help="Confidence needed to skip the model")
+    parser.add_argument("--n-features", type=int, default=2 ** 16)
+    parser.add_argument("--epochs", type=int, default=200)
+    parser.add_argument("--holdout", type=float, default=0.2,
+                        help="Share of emails kept out of training; evaluation and pipeline triage only use these")
+    args = parser.parse_args(argv)
+
+    # Imported here because the pipeline itself imports this module
+    from Pipeline import iter_dataset_rows
+    rows = list(iter_dataset_rows(args.dataset))
+    if args.command == "train":
+        train, _ = split_rows(rows, args.holdout)
+        model = FastTriageModel(n_features=args.n_features, epochs=args.epochs, holdout_fraction=args.holdout).fit(train)
+        model.save(args.model_path)
+        print(f"Trained on {len(train)} emails ({len(rows) - len(train)} held out), saved to {args.model_path}")
+    else:
+        model = FastTriageModel.load(args.model_path)
+    if model.holdout_fraction is not None:
+        _, rows = split_rows(rows, model.holdout_fraction)
+    else:
+        print("The model does not record a held-out split, accuracy below is in-sample")
+    report = evaluate(model, rows, args.threshold)
+    print(f"Coverage at confidence {args.threshold:.2f}: {report['coverage']:.1%} of {report['rows']} emails, "
+          f"median prediction {report['median_microseconds']:.0f} µs")
+    for field_path in TRIAGE_FIELDS:
+        print(f"{field_path}: {report['accuracy_on_covered'][field_path]:.2%} on covered, "
+              f"{report['accuracy_on_all'][field_path]:.2%} on all")
+
+
+if __name__ == "__main__":
+    main()
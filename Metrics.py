@@ -0,0 +1,201 @@
+import contextlib
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterator, Optional, Tuple
+
+# Upper bounds of the duration histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _key(name: str, labels: Dict[str, str]) -> _Key:
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+
+def _escape_label_value(value: str) -> str:
+    # Backslashes, double quotes and newlines must be escaped in Prometheus label values
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    """
+    Metrics interface used by the pipeline, engine, client and results writer.
+    This base class discards everything; subclass it to send metrics elsewhere.
+    """
+
+    def increment(self, name: str, value: float = 1, **labels):
+        """
+        Add to a counter.
+
+        Args:
+            name: Counter name, e.g. "prompt_tokens"
+            value: Amount to add
+            **labels: Label values, e.g. stage="call"
+        """
+
+    def observe(self, name: str, seconds: float, **labels):
+        """
+        Record one duration.
+
+        Args:
+            name: Timer name, e.g. "stage_seconds"
+            seconds: Measured duration
+            **labels: Label values, e.g. stage="call"
+        """
+
+    @contextlib.contextmanager
+    def timer(self, name: str, **labels) -> Iterator[None]:
+        """
+        Time the enclosed block with `observe`, also when it raises.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+
+class InMemoryMetrics(Metrics):
+    """
+    Thread-safe counters and duration histograms kept in memory, exported at the end of a run
+    as Prometheus text format (`write_prometheus`) or as a JSON summary (`summary`).
+    """
+
+    def __init__(self, prefix: str = "email_analysis", buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.prefix = prefix
+        self.buckets = buckets
+        self.counters: Dict[_Key, float] = {}
+        self.timers: Dict[_Key, Dict] = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name: str, value: float = 1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            timer = self.timers.get(key)
+            if timer is None:
+                timer = self.timers[key] = {
+                    "count": 0, "sum": 0.0, "min": seconds, "max": seconds, "buckets": [0] * len(self.buckets)
+                }
+            timer["count"] += 1
+            timer["sum"] += seconds
+            timer["min"] = min(timer["min"], seconds)
+            timer["max"] = max(timer["max"], seconds)
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    timer["buckets"][i] += 1
+                    break
+
+    @staticmethod
+    def _name(name: str, labels: Tuple[Tuple[str, str], ...]) -> str:
+        if not labels:
+            return name
+        return name + "{" + ",".join(f"{label}={value}" for label, value in labels) + "}"
+
+    def summary(self) -> Dict:
+        """
+        Counters and timer statistics, keyed by metric name with its labels.
+
+        Returns:
+            Dict: `counters` by name, and `timers` with count, total, mean, min and max seconds
+        """
+        with self._lock:
+            return {
+                "counters": {self._name(name, labels): value for (name, labels), value in sorted(self.counters.items())},
+                "timers": {
+                    self._name(name, labels): {
+                        "count": timer["count"],
+                        "total_seconds": timer["sum"],
+                        "mean_seconds": timer["sum"] / timer["count"],
+                        "min_seconds": timer["min"],
+                        "max_seconds": timer["max"],
+                    }
+                    for (name, labels), timer in sorted(self.timers.items())
+                },
+            }
+
+    def prometheus_text(self) -> str:
+        """
+        Render every metric in the Prometheus text exposition format.
+        """
+        def label_text(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{label}="{_escape_label_value(value)}"' for label, value in pairs) + "}"
+
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            timers = sorted((key, dict(timer, buckets=list(timer["buckets"]))) for key, timer in self.timers.items())
+        declared = set()
+        for (name, labels), value in counters:
+            metric = f"{self.prefix}_{name}_total"
+            if metric not in declared:
+                declared.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{label_text(labels)} {value:g}")
+        for (name, labels), timer in timers:
+            metric = f"{self.prefix}_{name}"
+            if metric not in declared:
+                declared.add(metric)
+                lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, count in zip(self.buckets, timer["buckets"]):
+                cumulative += count
+                lines.append(f"{metric}_bucket{label_text(labels, [('le', f'{bound:g}')])} {cumulative}")
+            lines.append(f"{metric}_bucket{label_text(labels, [('le', '+Inf')])} {timer['count']}")
+            lines.append(f"{metric}_sum{label_text(labels)} {timer['sum']:.6f}")
+            lines.append(f"{metric}_count{label_text(labels)} {timer['count']}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str):
+        """
+        Write the metrics for the node_exporter text file collector. The file is replaced
+        atomically so the collector never reads a partial file.
+
+        Args:
+            path: Output file, conventionally ending in `.prom`
+        """
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as file:
+            file.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+    def write_json(self, path: str):
+        """
+        Write `summary` to a JSON file.
+        """
+        with open(path, 'w') as file:
+            json.dump(self.summary(), file, indent=2)
+
+
+_default_metrics: Optional[Metrics] = None
+
+
+def get_metrics() -> Metrics:
+    """
+    Get the process-wide metrics recorder, an InMemoryMetrics unless replaced with `set_metrics`.
+
+    Returns:
+        Metrics: Shared metrics recorder
+    """
+    global _default_metrics
+    if _default_metrics is None:
+        _default_metrics = InMemoryMetrics()
+    return _default_metrics
+
+
+def set_metrics(metrics: Metrics):
+    """
+    Replace the process-wide metrics recorder, e.g. with an exporter for another backend.
+    """
+    global _default_metrics
+    _default_metrics = metrics
@@ -0,0 +1,335 @@
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional
+
+from AnalysisEngine import estimate_tokens
+from EmailClass import EmailAnalysis
+from Pipeline import iter_dataset_rows
+from PromptTemplate import load_prompt_template
+
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "exponential", "lognormal")
+
+
+class MockModelServer:
+    """
+    Local stand-in for the chat completions endpoint, for benchmarks and tests without network access.
+    Every request is answered with the ground truth EmailAnalysis of the dataset email found in its
+    messages, after a latency drawn from the configured distribution. A fraction of the requests
+    can fail with a 500 or a 429 carrying `retry-after` and rate limit headers, like the real API.
+    A `slow_rate` fraction of the requests are stragglers that take `slow_latency` seconds.
+    Answers are generated at `token_latency` seconds per `chunk_chars` characters after the first
+    token, and are sent as server-sent events when the request asks for a stream.
+    Point a client at it with `configure_client_manager(base_url=server.base_url, api_key="mock")`,
+    or main.py and Service.py with the OPENAI_BASE_URL and OPENAI_API_KEY environment variables.
+    """
+
+    def __init__(
+        self,
+        dataset_path: str = 'AcaiEmailsDataset.csv',
+        prompt_path: str = 'Prompt.md',
+        host: str = '127.0.0.1',
+        port: int = 0,
+        latency: float = 0.2,
+        latency_distribution: str = "lognormal",
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        retry_after: float = 1.0,
+        seed: Optional[int] = None,
+        token_latency: float = 0.0,
+        chunk_chars: int = 16,
+        slow_rate: float = 0.0,
+        slow_latency: float = 5.0,
+    ):
+        if latency_distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution {latency_distribution!r}, expected one of {LATENCY_DISTRIBUTIONS}")
+        self.latency = latency
+        self.latency_distribution = latency_distribution
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.token_latency = token_latency
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.chunk_chars = chunk_chars
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._seen_prefixes = set()
+        self._subject_marker = self._find_subject_marker(load_prompt_template(prompt_path).dynamic_template)
+        self._ground_truths: Dict[str, str] = {}
+        for row in iter_dataset_rows(dataset_path):
+            # Answer in the schema's field order, as a structured-output completion would
+            ground_truth = EmailAnalysis.model_validate_json(json.loads(row['GroundTruth']))
+            self._ground_truths.setdefault(row['Subject'], ground_truth.model_dump_json())
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @staticmethod
+    def _find_subject_marker(dynamic_template: str) -> Optional[str]:
+        # Text preceding the subject field on its line, e.g. "**Subject:** "
+        for line in dynamic_template.splitlines():
+            if "{subject}" in line:
+                return line.split("{subject}", 1)[0]
+        return None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "MockModelServer":
+        """
+        Serve requests from a background thread.
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-model-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self) -> "MockModelServer":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def sample_latency(self) -> float:
+        """
+        Draw a response latency in seconds. `latency` is the mean of every distribution.
+        """
+        with self._lock:
+            if self.slow_rate and self._random.random() < self.slow_rate:
+                return self.slow_latency
+            if self.latency_distribution == "fixed" or self.latency <= 0:
+                return max(self.latency, 0.0)
+            if self.latency_distribution == "uniform":
+                return self._random.uniform(0, 2 * self.latency)
+            if self.latency_distribution == "exponential":
+                return self._random.expovariate(1 / self.latency)
+            # Heavy right tail with sigma 0.5, scaled so the mean is `latency`
+            return self._random.lognormvariate(0, 0.5) * self.latency / 1.1331
+
+    def _draw_failure(self) -> Optional[int]:
+        with self._lock:
+            self.requests += 1
+            draw = self._random.random()
+            if draw < self.rate_limit_rate:
+                self.rate_limited += 1
+                return 429
+            if draw < self.rate_limit_rate + self.error_rate:
+                self.errors += 1
+                return 500
+        return None
+
+    def find_ground_truth(self, messages) -> Optional[str]:
+        """
+        Find the ground truth JSON of the email rendered into a request's messages.
+        """
+        text = "\n".join(message.get("content") or "" for message in messages)
+        if self._subject_marker:
+            for line in text.splitlines():
+                if line.startswith(self._subject_marker):
+                    ground_truth = self._ground_truths.get(line[len(self._subject_marker):].strip())
+                    if ground_truth is not None:
+                        return ground_truth
+        # The prompt does not use the template layout, fall back to a scan
+        for subject, ground_truth in self._ground_truths.items():
+            if subject in text:
+                return ground_truth
+        return None
+
+    def _usage(self, messages, content: str) -> Dict:
+        prefix = (messages[0].get("content") or "") if messages else ""
+        prompt_tokens = sum(estimate_tokens(message.get("content") or "") for message in messages)
+        prefix_tokens = estimate_tokens(prefix)
+        # Prompt caching applies to repeated prefixes of at least 1024 tokens, in 128-token steps
+        with self._lock:
+            seen = prefix in self._seen_prefixes
+            self._seen_prefixes.add(prefix)
+        cached_tokens = (prefix_tokens // 128) * 128 if seen and prefix_tokens >= 1024 else 0
+        completion_tokens = estimate_tokens(content)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached_tokens},
+        }
+
+    @staticmethod
+    def answer(request: Dict, content: str) -> str:
+        """
+        The content answering a request. When the request's response schema only has some of the
+        fields (a schema profile section), only those are answered.
+        """
+        properties = request.get("response_format", {}).get("json_schema", {}).get("schema", {}).get("properties")
+        if properties:
+            answer = json.loads(content)
+            content = json.dumps({field: value for field, value in answer.items() if field in properties})
+        return content
+
+    def chunks(self, content: str) -> List[str]:
+        return [content[i:i + self.chunk_chars] for i in range(0, len(content), self.chunk_chars)]
+
+    def completion(self, request: Dict, content: str) -> Dict:
+        """
+        Build the chat completion body answering a request with `content`.
+        """
+        messages = request.get("messages", [])
+        return {
+            "id": f"chatcmpl-mock-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "mock"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content, "refusal": None},
+                "logprobs": None,
+                "finish_reason": "stop",
+            }],
+            "usage": self._usage(messages, content),
+        }
+
+    def completion_chunks(self, request: Dict, content: str) -> Iterator[Dict]:
+        """
+        Build the `chat.completion.chunk` events streaming `content`, with a final usage chunk
+        when the request sets `stream_options.include_usage`.
+        """
+        completion_id = f"chatcmpl-mock-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+
+        def chunk(delta: Dict, finish_reason: Optional[str] = None, choices: bool = True, usage: Optional[Dict] = None):
+            return {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": request.get("model", "mock"),
+                "choices": [{"index": 0, "delta": delta, "logprobs": None, "finish_reason": finish_reason}] if choices else [],
+                "usage": usage,
+            }
+
+        yield chunk({"role": "assistant", "content": ""})
+        for piece in self.chunks(content):
+            yield chunk({"content": piece})
+        yield chunk({}, finish_reason="stop")
+        if (request.get("stream_options") or {}).get("include_usage"):
+            yield chunk({}, choices=False, usage=self._usage(request.get("messages", []), content))
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status: int, body: Dict, headers: Optional[Dict[str, str]] = None):
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _send_stream(self, request: Dict, content: str):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                for i, event in enumerate(server.completion_chunks(request, content)):
+                    # The first content chunk is the first token, which arrives after the latency
+                    if i > 1 and "content" in (event["choices"] or [{}])[0].get("delta", {}):
+                        time.sleep(server.token_latency)
+                    self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+                    return
+                time.sleep(server.sample_latency())
+                failure = server._draw_failure()
+                if failure == 429:
+                    self._send_json(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}}, {
+                        "retry-after": f"{server.retry_after:g}",
+                        "x-ratelimit-remaining-requests": "0",
+                        "x-ratelimit-reset-requests": f"{server.retry_after:g}s",
+                    })
+                    return
+                if failure == 500:
+                    self._send_json(500, {"error": {"message": "Injected server error", "type": "server_error"}})
+                    return
+                request = json.loads(body)
+                content = server.find_ground_truth(request.get("messages", []))
+                if content is None:
+                    self._send_json(400, {"error": {"message": "No dataset email found in the messages", "type": "invalid_request_error"}})
+                    return
+                content = server.answer(request, content)
+                if request.get("stream"):
+                    self._send_stream(request, content)
+                    return
+                time.sleep(server.token_latency * max(len(server.chunks(content)) - 1, 0))
+                self._send_json(200, server.completion(request, content))
+
+        return Handler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a mock chat completions endpoint that replays the dataset ground truth")
+    parser.add_argument("--dataset", default='AcaiEmailsDataset.csv')
+    parser.add_argument("--prompt", default='Prompt.md')
+    parser.add_argument("--host", default='127.0.0.1')
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.2, help="Mean response latency in seconds")
+    parser.add_argument("--latency-distribution", choices=LATENCY_DISTRIBUTIONS, default="lognormal")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with a 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of requests answered with a 429")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Fraction of straggler requests")
+    parser.add_argument("--slow-latency", type=float, default=5.0, help="Latency of straggler requests in seconds")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Seconds to generate each chunk of the answer")
+    args = parser.parse_args(argv)
+
+    server = MockModelServer(
+        args.dataset,
+        args.prompt,
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        latency_distribution=args.latency_distribution,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        seed=args.seed,
+        token_latency=args.token_latency,
+        slow_rate=args.slow_rate,
+        slow_latency=args.slow_latency
+    )
+    print(f"Mock model server listening on {server.base_url}")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._server.server_close()
+
+
+if __name__ == "__main__":
+    main()
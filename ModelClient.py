@@ -0,0 +1,193 @@
+import asyncio
+import os
+import threading
+import weakref
+from typing import Optional
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
+
+from Metrics import get_metrics
+
+
+def _record_request(request: httpx.Request):
+    # The SDK numbers its automatic retries in this header
+    retries = int(request.headers.get("x-stainless-retry-count", "0") or 0)
+    if retries:
+        get_metrics().increment("retries")
+
+
+def _record_response(response: httpx.Response):
+    get_metrics().increment("http_responses", status=response.status_code)
+
+
+async def _async_record_request(request: httpx.Request):
+    _record_request(request)
+
+
+async def _async_record_response(response: httpx.Response):
+    _record_response(response)
+
+
+class ModelClientManager:
+    """
+    Owns long-lived OpenAI clients so HTTP connections are reused across emails.
+    The sync client is created once per process and the async client once per event loop,
+    both backed by a keep-alive connection pool. An async client is closed with `aclose` from
+    its own loop before the loop shuts down. HTTP status codes and SDK retries are counted in
+    the process-wide metrics.
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+        max_connections: int = 20,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 60.0,
+        timeout: float = 60.0,
+        connect_timeout: float = 10.0,
+        max_retries: int = 2,
+    ):
+        # The arguments the manager was created with, to detect conflicting reconfiguration
+        self.settings = {
+            "api_key": api_key,
+            "base_url": base_url,
+            "max_connections": max_connections,
+            "max_keepalive_connections": max_keepalive_connections,
+            "keepalive_expiry": keepalive_expiry,
+            "timeout": timeout,
+            "connect_timeout": connect_timeout,
+            "max_retries": max_retries,
+        }
+        # api_key defaults to the OPENAI_API_KEY environment variable
+        self.api_key = api_key
+        self.base_url = base_url
+        self.max_retries = max_retries
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self._client = None
+        self._client_pid = None
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def get_client(self) -> OpenAI:
+        """
+        Get the process-wide synchronous client, creating it on first use.
+
+        Returns:
+            OpenAI: Client backed by a persistent connection pool
+        """
+        with self._lock:
+            # A forked worker must not share the parent's sockets
+            if self._client is None or self._client_pid != os.getpid():
+                self._client = OpenAI(
+                    api_key=self.api_key,
+                    base_url=self.base_url,
+                    max_retries=self.max_retries,
+                    http_client=DefaultHttpxClient(
+                        limits=self.limits,
+                        timeout=self.timeout,
+                        event_hooks={"request": [_record_request], "response": [_record_response]}
+                    )
+                )
+                self._client_pid = os.getpid()
+            return self._client
+
+    def get_async_client(self) -> AsyncOpenAI:
+        """
+        Get the async client for the running event loop, creating it on first use.
+        httpx async connections cannot be shared between loops, so each loop gets its own.
+
+        Returns:
+            AsyncOpenAI: Client backed by a persistent connection pool
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._async_clients.get(loop)
+            if client is None:
+                client = AsyncOpenAI(
+                    api_key=self.api_key,
+                    base_url=self.base_url,
+                    max_retries=self.max_retries,
+                    http_client=DefaultAsyncHttpxClient(
+                        limits=self.limits,
+                        timeout=self.timeout,
+                        event_hooks={"request": [_async_record_request], "response": [_async_record_response]}
+                    )
+                )
+                self._async_clients[loop] = client
+            return client
+
+    async def aclose(self):
+        """
+        Close the async client of the running event loop and its connection pool.
+        A later `get_async_client` on the loop creates a new one.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._async_clients.pop(loop, None)
+        if client is not None:
+            await client.close()
+
+    def close(self):
+        """
+        Close the synchronous client and its connection pool.
+        Async clients are closed from their own event loop with `aclose`.
+        """
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+
+_default_manager = None
+
+
+def get_client_manager(**kwargs) -> ModelClientManager:
+    """
+    Get the process-wide ModelClientManager, creating it on first use.
+
+    Args:
+        **kwargs: ModelClientManager settings, used when the manager is first created
+
+    Returns:
+        ModelClientManager: Shared client manager
+
+    Raises:
+        ValueError: If the manager already exists with different settings; use
+            `configure_client_manager` to replace it
+    """
+    global _default_manager
+    if _default_manager is None:
+        _default_manager = ModelClientManager(**kwargs)
+        return _default_manager
+    conflicts = sorted(name for name, value in kwargs.items() if name not in _default_manager.settings or _default_manager.settings[name] != value)
+    if conflicts:
+        raise ValueError(
+            f"The client manager already exists with different {', '.join(conflicts)}; "
+            f"call configure_client_manager to replace it"
+        )
+    return _default_manager
+
+
+def configure_client_manager(**kwargs) -> ModelClientManager:
+    """
+    Replace the process-wide ModelClientManager with one using these settings, closing the
+    previous synchronous client. Entry points call this once at startup.
+
+    Args:
+        **kwargs: ModelClientManager settings
+
+    Returns:
+        ModelClientManager: The new shared client manager
+    """
+    global _default_manager
+    if _default_manager is not None:
+        _default_manager.close()
+    _default_manager = ModelClientManager(**kwargs)
+    return _default_manager
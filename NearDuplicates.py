@@ -0,0 +1,170 @@
+import hashlib
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+FINGERPRINT_BITS = 64
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+_EMAIL_PATTERN = re.compile(r"\S+@\S+")
+_URL_PATTERN = re.compile(r"https?://\S+")
+_DIGITS_PATTERN = re.compile(r"\d+")
+
+
+def normalize_email_text(subject: str, body: str) -> List[str]:
+    """
+    Tokens of an email for near-duplicate detection. Addresses, links and numbers are replaced
+    by placeholders so templated mails (booking references, dates, amounts) look alike.
+
+    Args:
+        subject: Email subject
+        body: Email body
+
+    Returns:
+        List[str]: Lowercase word tokens of the subject followed by the body
+    """
+    text = f"{subject}\n{body}".lower()
+    text = _EMAIL_PATTERN.sub(" emailaddr ", text)
+    text = _URL_PATTERN.sub(" url ", text)
+    text = _DIGITS_PATTERN.sub("0", text)
+    return _TOKEN_PATTERN.findall(text)
+
+
+def simhash(tokens: List[str], shingle_size: int = 1) -> int:
+    """
+    64-bit SimHash of the word shingles of a token list. Similar texts get fingerprints that
+    differ in few bits.
+
+    Args:
+        tokens: Normalized tokens, e.g. from `normalize_email_text`
+        shingle_size: Number of consecutive words per feature
+
+    Returns:
+        int: Fingerprint
+    """
+    if len(tokens) < shingle_size:
+        shingles = [" ".join(tokens)]
+    else:
+        shingles = [" ".join(tokens[i:i + shingle_size]) for i in range(len(tokens) - shingle_size + 1)]
+    weights = [0] * FINGERPRINT_BITS
+    for shingle in shingles:
+        value = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(FINGERPRINT_BITS):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    fingerprint = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+class SimHashIndex:
+    """
+    Finds stored fingerprints within a Hamming distance of a query.
+    The fingerprint is split into `max_distance + 1` bands: two fingerprints that differ in at most
+    `max_distance` bits agree on at least one whole band, so only entries sharing a band are compared.
+    """
+
+    def __init__(self, max_distance: int = 4):
+        self.max_distance = max_distance
+        self._bands = max_distance + 1
+        self._band_bits = -(-FINGERPRINT_BITS // self._bands)
+        self._buckets: Dict[Tuple[int, int], List[int]] = {}
+        self._entries: List[Tuple[int, Any]] = []
+
+    def _band_keys(self, fingerprint: int):
+        mask = (1 << self._band_bits) - 1
+        for band in range(self._bands):
+            yield band, fingerprint >> (band * self._band_bits) & mask
+
+    def add(self, fingerprint: int, value: Any):
+        index = len(self._entries)
+        self._entries.append((fingerprint, value))
+        for key in self._band_keys(fingerprint):
+            self._buckets.setdefault(key, []).append(index)
+
+    def find(self, fingerprint: int) -> Optional[Tuple[Any, int]]:
+        """
+        Closest stored value within `max_distance` bits.
+
+        Returns:
+            Optional[Tuple[Any, int]]: The value and its Hamming distance, or None
+        """
+        best = None
+        seen = set()
+        for key in self._band_keys(fingerprint):
+            for index in self._buckets.get(key, ()):
+                if index in seen:
+                    continue
+                seen.add(index)
+                stored, value = self._entries[index]
+                distance = bin(stored ^ fingerprint).count("1")
+                if distance <= self.max_distance and (best is None or distance < best[1]):
+                    best = (value, distance)
+        return best
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class NearDuplicateIndex:
+    """
+    Reuses the analysis of an already analyzed email for near-duplicates of it (templated
+    confirmations, repeated complaints, mass outreach). Only the per-email fields are patched:
+    `email_id`, `subject`, `sender_email` and `recipient_email`.
+    """
+
+    def __init__(self, max_distance: int = 4, shingle_size: int = 1):
+        self.shingle_size = shingle_size
+        self.index = SimHashIndex(max_distance)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def fingerprint(self, subject: str, body: str) -> int:
+        return simhash(normalize_email_text(subject, body), self.shingle_size)
+
+    def add(self, fingerprint: int, analysis: BaseModel, source_id: str):
+        """
+        Store a fresh analysis.
+
+        Args:
+            fingerprint: Fingerprint from `fingerprint`
+            analysis: Validated analysis of the email
+            source_id: Identifier of the analyzed email, reported on reuse
+        """
+        with self._lock:
+            self.index.add(fingerprint, (analysis, source_id))
+
+    def lookup(self, fingerprint: int, subject: str, sender_email: str, recipient_email: str,
+               email_id: str) -> Optional[Tuple[BaseModel, str, int]]:
+        """
+        Find a near-duplicate and return its analysis patched for this email.
+
+        Args:
+            fingerprint: Fingerprint from `fingerprint`
+            subject: Subject of this email
+            sender_email: Sender of this email
+            recipient_email: Comma-separated recipients of this email
+            email_id: Identifier of this email, never the one of the reused analysis
+
+        Returns:
+            Optional[Tuple]: Patched analysis, source email id and Hamming distance, or None
+        """
+        with self._lock:
+            found = self.index.find(fingerprint)
+            if found is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        (analysis, source_id), distance = found
+        update = {
+            "email_id": email_id,
+            "subject": subject,
+            "sender_email": sender_email,
+            "recipient_email": [address.strip() for address in recipient_email.split(",") if address.strip()],
+        }
+        patched = analysis.model_copy(update=update)
+        return patched, source_id, distance
@@ -0,0 +1,89 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from EmailClass import EmailAnalysis
+from Testing import AccuracyAggregate, EmailAnalysisTesting
+
+# Tester built once in every worker process by `_init_worker`
+_worker_tester: Optional[EmailAnalysisTesting] = None
+
+
+def _init_worker(model_class: type[BaseModel]):
+    global _worker_tester
+    # Workers only return sums; per-email records are not written to the results CSV
+    _worker_tester = EmailAnalysisTesting(model_class, log_results=False)
+
+
+def _score_chunk(predictions: List[Any], ground_truths: List[Any], vectorized: bool) -> AccuracyAggregate:
+    if vectorized:
+        return _worker_tester.calculate_batch_aggregate(predictions, ground_truths)
+    aggregate = AccuracyAggregate()
+    for pred, truth in zip(predictions, ground_truths):
+        aggregate.add(_worker_tester.calculate_accuracy(pred, truth))
+    return aggregate
+
+
+def iter_chunks(predictions: Iterable[Any], ground_truths: Iterable[Any], chunk_size: int) -> Iterator[Tuple[List[Any], List[Any]]]:
+    """
+    Split prediction/ground truth pairs into chunks without materializing the inputs.
+
+    Args:
+        predictions: Prediction JSONs
+        ground_truths: Ground truth JSONs, in the same order
+        chunk_size: Number of pairs per chunk
+
+    Yields:
+        Tuple[List[Any], List[Any]]: Predictions and ground truths of one chunk
+    """
+    pairs = zip(predictions, ground_truths)
+    while True:
+        chunk = list(islice(pairs, chunk_size))
+        if not chunk:
+            return
+        preds, truths = zip(*chunk)
+        yield list(preds), list(truths)
+
+
+def parallel_batch_accuracy(
+    predictions: Iterable[Any],
+    ground_truths: Iterable[Any],
+    model_class: type[BaseModel] = EmailAnalysis,
+    workers: Optional[int] = None,
+    chunk_size: int = 500,
+    vectorized: bool = False,
+) -> Dict:
+    """
+    Score prediction/ground truth pairs across a pool of worker processes.
+    Each worker builds its tester once, scores whole chunks and sends back an AccuracyAggregate,
+    so only running sums cross the process boundary. At most two chunks per worker are in flight,
+    which keeps memory bounded for generator inputs.
+
+    Args:
+        predictions: Prediction JSONs
+        ground_truths: Ground truth JSONs, in the same order
+        model_class: Pydantic model the pairs are scored against
+        workers: Number of worker processes, defaults to the CPU count
+        chunk_size: Number of pairs sent to a worker at a time
+        vectorized: Score every chunk with NumPy (`calculate_batch_aggregate`) instead of pair by pair
+
+    Returns:
+        Dict: Number of emails, overall average accuracy and field-wise average accuracies
+    """
+    workers = workers or os.cpu_count() or 1
+    aggregate = AccuracyAggregate()
+    chunks = iter_chunks(predictions, ground_truths, chunk_size)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(model_class,)) as executor:
+        pending = set()
+        for preds, truths in chunks:
+            pending.add(executor.submit(_score_chunk, preds, truths, vectorized))
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    aggregate.merge(future.result())
+        for future in pending:
+            aggregate.merge(future.result())
+    return aggregate.summary()
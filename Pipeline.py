@@ -0,0 +1,374 @@
+import asyncio
+import contextlib
+import csv
+import inspect
+import json
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Set
+
+from AnalysisEngine import AsyncAnalysisEngine
+from ColumnarStore import ColumnarResultsStore
+from EmailClass import UrgencyLevel
+from FastTriage import TRIAGE_FIELDS, TriageCascade
+from Metrics import Metrics, get_metrics
+from NearDuplicates import NearDuplicateIndex
+from Preprocessing import EmailPreprocessor
+from PromptTemplate import Messages, PromptTemplate
+from ResponseCache import CacheMissError, ResponseCache
+from ResponseParsing import get_validator, parse_openai_email_analysis
+from RunJournal import RunJournal
+from Scheduling import PriorityScheduler, estimate_urgency
+from SchemaProfiles import SectionedAnalyzer
+from Testing import AccuracyAggregate, EmailAnalysisTesting
+
+# Marks the end of a stage's input
+_DONE = object()
+
+
+def iter_dataset_rows(dataset_path: str = 'AcaiEmailsDataset.csv') -> Iterator[Dict[str, str]]:
+    """
+    Stream the rows of the email dataset without loading the whole file.
+
+    Args:
+        dataset_path: CSV file with the emails and ground truth
+
+    Yields:
+        Dict[str, str]: One dataset row
+    """
+    with open(dataset_path, mode='r', encoding='utf-8', newline='') as csv_file:
+        yield from csv.DictReader(csv_file)
+
+
+@dataclass
+class EmailTask:
+    """
+    One email flowing through the evaluation pipeline.
+    """
+    index: int
+    row: Dict[str, str]
+    messages: Optional[Messages] = None
+    response: Any = None
+    analysis: Any = None
+    accuracy: Optional[Dict] = None
+    cached: bool = False
+    error: Optional[Exception] = None
+    resumed: bool = False
+    reused: bool = False
+    triaged: bool = False
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def row_id(self) -> str:
+        return f"row-{self.index}"
+
+
+class EvaluationPipeline:
+    """
+    Streaming evaluation pipeline: row reader -> prompt render -> model call -> parse -> score -> sink.
+    Stages run concurrently and are connected by bounded queues, so memory stays constant
+    regardless of the dataset size and a slow stage applies backpressure to the ones before it.
+    Failed emails are counted and passed to the sink with `error` set instead of stopping the run.
+    With a journal, every new analysis is recorded as soon as it is parsed, and emails whose
+    fingerprint is found in `completed` (loaded from the journal on resume) are scored without
+    calling the model; their accuracy is not logged again if their fingerprint is in `logged`, the
+    analyses the resumed run already logged.
+    Every stage is timed under the `stage_seconds` metric, labelled with the stage name.
+    With a preprocessor, email bodies are cleaned before rendering and their token estimates
+    before and after are kept on each task and totalled in the summary. With a near-duplicate
+    index, emails close to one already analyzed reuse its analysis instead of calling the model,
+    and their accuracy is aggregated separately so the impact of the reuse can be reported.
+    With a triage cascade, emails the local classifier is confident about are triaged without
+    calling the model and only their triage fields are scored. With a sectioned analyzer, each
+    model call is split into parallel section requests that are merged into one analysis. With
+    `on_routing`, completions are streamed and it is called with the task and its routing fields
+    as soon as they are generated, before the rest of the analysis. With a priority scheduler,
+    model calls are ordered by an early urgency estimate instead of arrival order. With a columnar
+    store, every scored analysis and its per-field accuracy are appended to the run's Parquet files.
+    """
+
+    def __init__(
+        self,
+        engine: AsyncAnalysisEngine,
+        template: PromptTemplate,
+        tester: EmailAnalysisTesting,
+        cache: Optional[ResponseCache] = None,
+        sink: Optional[Callable[[EmailTask], Any]] = None,
+        queue_size: int = 64,
+        journal: Optional[RunJournal] = None,
+        completed: Optional[Dict[str, Dict]] = None,
+        logged: Optional[Set[str]] = None,
+        run_id: Optional[str] = None,
+        metrics: Optional[Metrics] = None,
+        preprocessor: Optional[EmailPreprocessor] = None,
+        near_duplicates: Optional[NearDuplicateIndex] = None,
+        triage: Optional[TriageCascade] = None,
+        sections: Optional[SectionedAnalyzer] = None,
+        on_routing: Optional[Callable[[EmailTask, Dict[str, Any]], Any]] = None,
+        scheduler: Optional[PriorityScheduler] = None,
+        store: Optional[ColumnarResultsStore] = None,
+    ):
+        self.engine = engine
+        self.template = template
+        self.tester = tester
+        self.cache = cache
+        self.sink = sink
+        self.queue_size = queue_size
+        self.journal = journal
+        self.completed = completed or {}
+        self.logged = logged or set()
+        self.run_id = run_id
+        self.metrics = metrics or get_metrics()
+        self.preprocessor = preprocessor
+        self.body_tokens_before = 0
+        self.body_tokens_after = 0
+        self.near_duplicates = near_duplicates
+        self.triage = triage
+        self.triaged = 0
+        self.sections = sections
+        self.on_routing = on_routing
+        self.scheduler = scheduler
+        self.store = store
+        self.triage_aggregate = AccuracyAggregate()
+        self.aggregate = AccuracyAggregate()
+        self.reused_aggregate = AccuracyAggregate()
+        self.processed = 0
+        self.failed = 0
+        self.resumed = 0
+        self.reused = 0
+
+    def render(self, task: EmailTask) -> EmailTask:
+        row = task.row
+        email_body = row['EmailBody']
+        if self.preprocessor is not None:
+            with self.metrics.timer("stage_seconds", stage="preprocess"):
+                cleaned = self.preprocessor.clean(email_body)
+            email_body = cleaned.text
+            task.extra['tokens_before'] = cleaned.tokens_before
+            task.extra['tokens_after'] = cleaned.tokens_after
+            self.body_tokens_before += cleaned.tokens_before
+            self.body_tokens_after += cleaned.tokens_after
+            self.metrics.increment("body_tokens", cleaned.tokens_before, stage="before")
+            self.metrics.increment("body_tokens", cleaned.tokens_after, stage="after")
+        with self.metrics.timer("stage_seconds", stage="render"):
+            task.messages = self.template.render(
+                subject=row['Subject'],
+                sender_email=row['Sender'],
+                recipient_email=row['Recipients'],
+                email_body=email_body
+            )
+        return task
+
+    def _validate(self, analysis: Dict):
+        with self.metrics.timer("stage_seconds", stage="validate"):
+            return get_validator(self.engine.schema).validate_python(analysis)
+
+    def _route(self, task: EmailTask, values: Dict[str, Any]):
+        task.extra['routing'] = values
+        self.on_routing(task, values)
+
+    def _estimate_urgency(self, task: EmailTask) -> UrgencyLevel:
+        # The fast-path prediction is better than the keywords, even when it was not confident enough to skip the model
+        if 'triage' in task.extra:
+            return UrgencyLevel(task.extra['triage'].predictions['sentiment.urgency'])
+        return estimate_urgency(task.row['Subject'], task.row['EmailBody'])
+
+    async def call(self, task: EmailTask) -> EmailTask:
+        if task.error is not None:
+            return task
+        if self.journal is not None or self.completed:
+            task.extra['journal_key'] = RunJournal.make_key(task.row, task.messages, self.engine.model, self.engine.schema)
+        if task.extra.get('journal_key') in self.completed:
+            task.analysis = self._validate(self.completed[task.extra['journal_key']])
+            task.resumed = True
+            return task
+        if self.cache is not None:
+            task.extra['cache_key'] = self.cache.make_key(task.messages, self.engine.model, self.engine.schema)
+            cached = self.cache.get(task.extra['cache_key'])
+            self.metrics.increment("cache_lookups", result="miss" if cached is None else "hit")
+            if cached is not None:
+                task.analysis = self._validate(cached)
+                task.cached = True
+                return task
+        if self.near_duplicates is not None:
+            row = task.row
+            task.extra['fingerprint'] = self.near_duplicates.fingerprint(row['Subject'], row['EmailBody'])
+            found = self.near_duplicates.lookup(
+                task.extra['fingerprint'], row['Subject'], row['Sender'], row['Recipients'],
+                email_id=row.get('EmailId') or task.row_id
+            )
+            if found is not None:
+                task.analysis, task.extra['near_duplicate_of'], task.extra['near_duplicate_distance'] = found
+                task.reused = True
+                return task
+        # Only triage emails with no full analysis available, a confident triage must not replace one
+        if self.triage is not None:
+            result, confident = self.triage.triage(task.row['Subject'], task.row['EmailBody'])
+            task.extra['triage'] = result
+            self.metrics.observe("stage_seconds", result.seconds, stage="triage")
+            if confident:
+                task.triaged = True
+                return task
+        if self.cache is not None and self.cache.cache_only:
+            task.error = CacheMissError(f"Row {task.index} is not in the response cache")
+            return task
+        slot = contextlib.nullcontext()
+        if self.scheduler is not None:
+            task.extra['urgency_estimate'] = self._estimate_urgency(task)
+            slot = self.scheduler.slot(task.extra['urgency_estimate'])
+        try:
+            async with slot:
+                with self.metrics.timer("stage_seconds", stage="call"):
+                    if self.sections is not None:
+                        # The merged sections are already a validated analysis, which parse passes through
+                        task.response = await self.sections.analyze(task.messages)
+                    elif self.on_routing is not None:
+                        task.response = await self.engine.analyze_stream(task.messages, lambda values: self._route(task, values))
+                    else:
+                        task.response = await self.engine.analyze(task.messages)
+        except Exception as e:
+            task.error = e
+        return task
+
+    def parse(self, task: EmailTask) -> EmailTask:
+        if task.error is not None or task.resumed or task.triaged:
+            return task
+        if not task.cached and not task.reused:
+            try:
+                with self.metrics.timer("stage_seconds", stage="parse"):
+                    task.analysis = parse_openai_email_analysis(task.response, self.engine.schema)
+            except ValueError as e:
+                task.error = e
+                return task
+            # The raw completion is no longer needed; drop it to keep memory flat
+            task.response = None
+            if self.cache is not None:
+                self.cache.set(task.extra['cache_key'], task.analysis.model_dump(mode='json'), self.engine.model)
+            if self.near_duplicates is not None:
+                self.near_duplicates.add(task.extra['fingerprint'], task.analysis, task.row_id)
+        if self.journal is not None:
+            self.journal.record(
+                task.row_id, task.extra['journal_key'], self.template.version, task.analysis.model_dump(mode='json'), self.run_id
+            )
+        return task
+
+    def score(self, task: EmailTask) -> EmailTask:
+        if task.error is not None:
+            return task
+        with self.metrics.timer("stage_seconds", stage="score"):
+            ground_truth = json.loads(task.row['GroundTruth'])
+            if task.triaged:
+                task.accuracy = self.tester.calculate_accuracy(
+                    task.extra['triage'].as_partial_analysis(), ground_truth, fields=TRIAGE_FIELDS
+                )
+            else:
+                logged = task.resumed and task.extra.get('journal_key') in self.logged
+                task.accuracy = self.tester.calculate_accuracy(task.analysis, ground_truth, log=not logged)
+        return task
+
+    async def write(self, task: EmailTask):
+        start = time.perf_counter()
+        self.processed += 1
+        if task.resumed:
+            self.resumed += 1
+        if task.error is not None:
+            self.failed += 1
+            self.metrics.increment("emails", status="failed")
+            self.metrics.increment("errors", type=type(task.error).__name__)
+        elif task.triaged:
+            # Triage-only results cover three fields, keep them out of the full-analysis accuracy
+            self.triaged += 1
+            self.triage_aggregate.add(task.accuracy)
+            self.metrics.increment("emails", status="triaged")
+        else:
+            self.aggregate.add(task.accuracy)
+            if task.reused:
+                self.reused += 1
+                self.reused_aggregate.add(task.accuracy)
+            status = "resumed" if task.resumed else "cached" if task.cached else "reused" if task.reused else "analyzed"
+            self.metrics.increment("emails", status=status)
+            if self.store is not None:
+                self.store.add(task.row_id, task.analysis, task.accuracy)
+        if self.sink is not None:
+            result = self.sink(task)
+            if inspect.isawaitable(result):
+                await result
+        self.metrics.observe("stage_seconds", time.perf_counter() - start, stage="write")
+
+    async def _produce(self, rows: Iterable[Dict[str, str]], outbox: asyncio.Queue):
+        for index, row in enumerate(rows):
+            await outbox.put(EmailTask(index=index, row=row))
+        await outbox.put(_DONE)
+
+    async def _stage(self, func: Callable, inbox: asyncio.Queue, outbox: Optional[asyncio.Queue], workers: int = 1):
+        async def worker():
+            while True:
+                task = await inbox.get()
+                if task is _DONE:
+                    # Hand the marker back so sibling workers stop too
+                    await inbox.put(_DONE)
+                    return
+                result = func(task)
+                if inspect.isawaitable(result):
+                    result = await result
+                if outbox is not None:
+                    await outbox.put(result)
+
+        await asyncio.gather(*(worker() for _ in range(workers)))
+        if outbox is not None:
+            await outbox.put(_DONE)
+
+    def _call_workers(self) -> int:
+        if self.scheduler is None:
+            return self.engine.max_concurrency
+        return max(self.engine.max_concurrency, self.queue_size)
+
+    async def run(self, rows: Iterable[Dict[str, str]]) -> Dict:
+        """
+        Evaluate every row.
+
+        Args:
+            rows: Dataset rows, e.g. from `iter_dataset_rows`
+
+        Returns:
+            Dict: Accuracy summary with the number of processed, failed and resumed emails
+        """
+        queues = [asyncio.Queue(maxsize=self.queue_size) for _ in range(5)]
+        render_in, call_in, parse_in, score_in, write_in = queues
+        tasks = [
+            asyncio.ensure_future(self._produce(rows, render_in)),
+            asyncio.ensure_future(self._stage(self.render, render_in, call_in)),
+            # With a scheduler, every queued email waits in it, so it can pick the most urgent one for each free slot
+            asyncio.ensure_future(self._stage(self.call, call_in, parse_in, workers=self._call_workers())),
+            asyncio.ensure_future(self._stage(self.parse, parse_in, score_in)),
+            asyncio.ensure_future(self._stage(self.score, score_in, write_in)),
+            asyncio.ensure_future(self._stage(self.write, write_in, None)),
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        finally:
+            # The pooled client's connections belong to this loop, which the caller may be about to close
+            await self.engine.aclose()
+
+        summary = self.aggregate.summary()
+        summary['processed'] = self.processed
+        summary['failed'] = self.failed
+        summary['resumed'] = self.resumed
+        if self.near_duplicates is not None:
+            others = self.aggregate.count - self.reused_aggregate.count
+            summary['reused'] = self.reused
+            summary['reused_accuracy'] = self.reused_aggregate.summary()['overall_accuracy']
+            summary['other_accuracy'] = (self.aggregate.overall_sum - self.reused_aggregate.overall_sum) / others if others else 0.0
+        if self.triage is not None:
+            summary['triaged'] = self.triaged
+            summary['triage_accuracy'] = self.triage_aggregate.summary()
+        if self.scheduler is not None:
+            summary['queue_wait'] = self.scheduler.summary()
+        if self.preprocessor is not None:
+            summary['body_tokens_before'] = self.body_tokens_before
+            summary['body_tokens_after'] = self.body_tokens_after
+        return summary
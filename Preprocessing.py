@@ -0,0 +1,206 @@
+import html
+import re
+from dataclasses import dataclass
+from html.parser import HTMLParser
+from typing import List, Optional, Tuple
+
+from AnalysisEngine import estimate_tokens
+
+_HTML_PATTERN = re.compile(r"<\s*(html|body|div|p|br|table|tr|td|span|font|a|b|i|ul|ol|li|blockquote)\b[^>]*>", re.IGNORECASE)
+
+# Lines that start the quoted history of a reply or forward; everything after them is dropped
+_QUOTE_HEADERS = [
+    re.compile(r"^\s*On .{3,200}wrote:\s*$", re.IGNORECASE),
+    re.compile(r"^\s*-{2,}\s*(Original|Forwarded) Message\s*-{2,}\s*$", re.IGNORECASE),
+    re.compile(r"^\s*Begin forwarded message:\s*$", re.IGNORECASE),
+    re.compile(r"^\s*_{10,}\s*$"),
+]
+# An Outlook-style header block: "From:" followed by "Sent:"/"Date:" on one of the next lines
+_FROM_HEADER = re.compile(r"^\s*From:\s+\S", re.IGNORECASE)
+_SENT_HEADER = re.compile(r"^\s*(Sent|Date):\s+\S", re.IGNORECASE)
+
+_SIGNATURE_DELIMITER = re.compile(r"^--\s?$")
+_MOBILE_SIGNATURE = re.compile(r"^\s*Sent from my \w+", re.IGNORECASE)
+
+_FOOTER_MARKERS = re.compile(
+    r"(confidentiality notice|this (e-?mail|message)( and any attachments)? (is|are|may be) (confidential|intended solely)"
+    r"|if you are not the intended recipient|please consider the environment before printing|to unsubscribe"
+    r"|unsubscribe from (this|these|our) (list|emails)|this email was sent to)",
+    re.IGNORECASE
+)
+
+_TRUNCATION_MARKER = " [...]"
+
+
+class _TextExtractor(HTMLParser):
+    _BLOCK_TAGS = {"p", "div", "br", "tr", "li", "table", "h1", "h2", "h3", "h4", "h5", "h6", "blockquote"}
+    _SKIPPED_TAGS = {"script", "style", "head", "title"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: List[str] = []
+        self._skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self._SKIPPED_TAGS:
+            self._skipping += 1
+        elif tag in self._BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in self._SKIPPED_TAGS:
+            self._skipping = max(self._skipping - 1, 0)
+        elif tag in self._BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self._skipping:
+            self.parts.append(data)
+
+
+def html_to_text(body: str) -> str:
+    """
+    Convert an HTML email body to plain text. Bodies that do not look like HTML are returned unchanged.
+
+    Args:
+        body: Raw email body
+
+    Returns:
+        str: Text content with one line per block element
+    """
+    if not _HTML_PATTERN.search(body):
+        return body
+    extractor = _TextExtractor()
+    extractor.feed(body)
+    extractor.close()
+    text = html.unescape("".join(extractor.parts))
+    lines = [re.sub(r"[ \t\xa0]+", " ", line).strip() for line in text.splitlines()]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+
+def strip_quoted_history(text: str) -> str:
+    """
+    Drop the quoted reply chain or forwarded message below the newest message, and `>`-quoted lines.
+    """
+    lines = text.splitlines()
+    kept = []
+    for i, line in enumerate(lines):
+        if any(pattern.match(line) for pattern in _QUOTE_HEADERS):
+            break
+        if _FROM_HEADER.match(line) and any(_SENT_HEADER.match(following) for following in lines[i + 1:i + 4]):
+            break
+        if line.lstrip().startswith(">"):
+            continue
+        kept.append(line)
+    # A reply that is nothing but quoted text is left as it was
+    return "\n".join(kept).strip() or text
+
+
+def strip_signature(text: str) -> str:
+    """
+    Drop everything after a `-- ` signature delimiter and "Sent from my ..." lines.
+    """
+    lines = text.splitlines()
+    kept = []
+    for line in lines:
+        if _SIGNATURE_DELIMITER.match(line):
+            break
+        if _MOBILE_SIGNATURE.match(line):
+            continue
+        kept.append(line)
+    return "\n".join(kept).strip() or text
+
+
+def strip_footers(text: str) -> str:
+    """
+    Drop legal disclaimers and mailing list footers: the paragraphs containing a footer marker
+    once the message proper has ended.
+    """
+    paragraphs = re.split(r"\n\s*\n", text)
+    # Footers only ever follow the message, so stop at the first paragraph that is not one
+    while len(paragraphs) > 1 and _FOOTER_MARKERS.search(paragraphs[-1]):
+        paragraphs.pop()
+    return "\n\n".join(paragraphs).strip()
+
+
+def truncate_to_budget(text: str, max_tokens: Optional[int]) -> str:
+    """
+    Cut text at a word boundary so its estimated token count fits the budget.
+
+    Args:
+        text: Cleaned email body
+        max_tokens: Token budget, or None for no limit
+
+    Returns:
+        str: The text, ending with a truncation marker if it was cut
+    """
+    if max_tokens is None or estimate_tokens(text) <= max_tokens:
+        return text
+    max_chars = max(max_tokens * 4 - len(_TRUNCATION_MARKER), 0)
+    cut = text[:max_chars]
+    boundary = cut.rfind(" ")
+    if boundary > max_chars // 2:
+        cut = cut[:boundary]
+    return cut.rstrip() + _TRUNCATION_MARKER
+
+
+@dataclass
+class PreprocessedBody:
+    """
+    A cleaned email body with its token estimate before and after preprocessing.
+    """
+    text: str
+    tokens_before: int
+    tokens_after: int
+
+
+class EmailPreprocessor:
+    """
+    Cleans email bodies before they are rendered into the prompt: HTML is converted to text,
+    quoted reply history, signatures and legal footers are removed, and the result is cut to
+    a token budget. Each step only removes text the newest message does not depend on, and a
+    plain single-message body passes through unchanged.
+    """
+
+    def __init__(
+        self,
+        max_tokens: Optional[int] = None,
+        convert_html: bool = True,
+        strip_quotes: bool = True,
+        strip_signatures: bool = True,
+        strip_legal_footers: bool = True,
+    ):
+        self.max_tokens = max_tokens
+        self.convert_html = convert_html
+        self.strip_quotes = strip_quotes
+        self.strip_signatures = strip_signatures
+        self.strip_legal_footers = strip_legal_footers
+
+    @property
+    def config(self) -> Tuple:
+        """
+        The settings of this preprocessor; preprocessors with equal configs clean a body identically.
+        """
+        return self.max_tokens, self.convert_html, self.strip_quotes, self.strip_signatures, self.strip_legal_footers
+
+    def clean(self, body: str) -> PreprocessedBody:
+        """
+        Preprocess one email body.
+
+        Args:
+            body: Raw email body
+
+        Returns:
+            PreprocessedBody: Cleaned text and token estimates before and after
+        """
+        text = body.replace("\r\n", "\n")
+        if self.convert_html:
+            text = html_to_text(text)
+        if self.strip_quotes:
+            text = strip_quoted_history(text)
+        if self.strip_signatures:
+            text = strip_signature(text)
+        if self.strip_legal_footers:
+            text = strip_footers(text)
+        text = truncate_to_budget(text, self.max_tokens)
+        return PreprocessedBody(text=text, tokens_before=estimate_tokens(body), tokens_after=estimate_tokens(text))
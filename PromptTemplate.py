@@ -0,0 +1,99 @@
+import functools
+import hashlib
+import json
+import string
+from typing import Dict, List, Union
+
+Messages = List[Dict[str, str]]
+
+
+class PromptTemplate:
+    """
+    Markdown prompt template split into a static prefix and a per-email section.
+    The static prefix is sent unchanged as the `system` message of every request, so the
+    provider can reuse its cached prefix; the email fields are rendered into a trailing
+    `user` message. The split happens at the heading of the first section that contains a
+    template field, so Prompt.md must keep the email fields at the end.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.version = hashlib.sha256(text.encode("utf-8")).hexdigest()[:12]
+        self.static_prefix, self.dynamic_template = self._split(text)
+
+    @staticmethod
+    def _split(text: str):
+        lines = text.splitlines(keepends=True)
+        formatter = string.Formatter()
+        split_index = len(lines)
+        for i, line in enumerate(lines):
+            if any(field_name for _, field_name, _, _ in formatter.parse(line)):
+                split_index = i
+                break
+        # Move the split up to the heading that introduces the email section
+        for i in range(split_index - 1, -1, -1):
+            if lines[i].startswith("#"):
+                split_index = i
+                break
+            if lines[i].strip():
+                break
+        static_prefix = "".join(lines[:split_index]).strip()
+        dynamic_template = "".join(lines[split_index:]).strip()
+        # Unescape doubled braces in the prefix the same way str.format would
+        return static_prefix.format(), dynamic_template
+
+    def render(self, subject: str, sender_email: str, recipient_email: str, email_body: str) -> Messages:
+        """
+        Render the chat messages for one email.
+
+        Args:
+            subject: Email subject
+            sender_email: Sender address
+            recipient_email: Recipient addresses
+            email_body: Email body
+
+        Returns:
+            Messages: Static `system` message followed by the email `user` message
+        """
+        return [
+            {"role": "system", "content": self.static_prefix},
+            {"role": "user", "content": self.dynamic_template.format(
+                subject=subject,
+                sender_email=sender_email,
+                recipient_email=recipient_email,
+                email_body=email_body
+            )}
+        ]
+
+
+@functools.lru_cache(maxsize=None)
+def load_prompt_template(path: str = "Prompt.md") -> PromptTemplate:
+    """
+    Load and split a prompt template once per path.
+
+    Args:
+        path: Markdown prompt template
+
+    Returns:
+        PromptTemplate: Parsed template
+    """
+    with open(path, "r") as file:
+        return PromptTemplate(file.read())
+
+
+def to_messages(prompt: Union[str, Messages]) -> Messages:
+    """
+    Normalize a prompt into chat messages. A plain string is sent as a single `system` message.
+    """
+    if isinstance(prompt, str):
+        return [{"role": "system", "content": prompt}]
+    return prompt
+
+
+def prompt_text(prompt: Union[str, Messages]) -> str:
+    """
+    Stable text form of a prompt, used for hashing and token estimates.
+    """
+    if isinstance(prompt, str):
+        return prompt
+    return json.dumps(prompt, sort_keys=True)
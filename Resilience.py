@@ -0,0 +1,424 @@
+import asyncio
+import contextlib
+import random
+import re
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncContextManager, Awaitable, Callable, Deque, Optional, Tuple
+
+import openai
+
+from Metrics import Metrics, get_metrics
+
+# Status codes worth another attempt: timeouts, conflicts, rate limits and server errors
+RETRYABLE_STATUS = {408, 409, 429}
+BREAKER_MODES = ("shed", "queue")
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling the model while the circuit breaker is open in "shed" mode.
+    """
+    pass
+
+
+def parse_duration(value: str) -> Optional[float]:
+    """
+    Parse a rate limit reset duration such as "20ms", "1.5s" or "6m0s".
+
+    Returns:
+        Optional[float]: Seconds, or None if the value is not a duration
+    """
+    parts = _DURATION_PART.findall(value)
+    if not parts or "".join(number + unit for number, unit in parts) != value.strip():
+        return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """
+    The wait requested by the response headers of a failed call: `retry-after-ms`, `retry-after`
+    (seconds or an HTTP date), or the reset time of an exhausted `x-ratelimit-*` budget.
+
+    Args:
+        error: Exception raised by the OpenAI client
+
+    Returns:
+        Optional[float]: Seconds to wait, or None if the response does not say
+    """
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    if headers.get("retry-after"):
+        try:
+            return float(headers["retry-after"])
+        except ValueError:
+            try:
+                return max(parsedate_to_datetime(headers["retry-after"]).timestamp() - time.time(), 0.0)
+            except (TypeError, ValueError):
+                pass
+    resets = []
+    for budget in ("requests", "tokens"):
+        if headers.get(f"x-ratelimit-remaining-{budget}") == "0" and headers.get(f"x-ratelimit-reset-{budget}"):
+            reset = parse_duration(headers[f"x-ratelimit-reset-{budget}"])
+            if reset is not None:
+                resets.append(reset)
+    return max(resets) if resets else None
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Whether a failed call may succeed if repeated: connection errors, timeouts, rate limits
+    and server errors. Invalid requests and refusals are not retried.
+    """
+    if isinstance(error, (openai.APIConnectionError, asyncio.TimeoutError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS or error.status_code >= 500
+    return False
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter, so clients that failed together do not retry together.
+    A wait requested by the server's rate limit headers takes precedence over the backoff,
+    plus a little jitter.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 4,
+        base_delay: float = 0.5,
+        max_delay: float = 30.0,
+        seed: Optional[int] = None,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._random = random.Random(seed)
+
+    def delay(self, attempt: int, error: Exception) -> float:
+        """
+        Seconds to wait before the next attempt.
+
+        Args:
+            attempt: Number of the attempt that failed, starting at 1
+            error: The exception it raised
+
+        Returns:
+            float: Delay in seconds
+        """
+        requested = retry_after_seconds(error)
+        if requested is not None:
+            return min(requested, self.max_delay) + self._random.uniform(0, self.base_delay / 2)
+        return self._random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+class LatencyTracker:
+    """
+    Rolling window of call latencies, used to decide when a call is slow enough to hedge.
+    """
+
+    def __init__(self, percentile: float = 0.95, window: int = 200, min_samples: int = 20):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self._samples: Deque[float] = deque(maxlen=window)
+
+    def record(self, seconds: float):
+        self._samples.append(seconds)
+
+    def threshold(self) -> Optional[float]:
+        """
+        The configured latency percentile of the window, or None until `min_samples` calls finished.
+        """
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(int(self.percentile * len(ordered)), len(ordered) - 1)]
+
+
+class CircuitBreaker:
+    """
+    Stops sending calls to a degraded backend. The circuit opens when at least `failure_rate`
+    of the last `window` calls failed (after `min_calls` calls). While open, calls are rejected
+    with CircuitOpenError ("shed") or held back ("queue") until `cooldown` seconds have passed;
+    then up to `probes` calls are let through, and their outcome closes or reopens the circuit.
+    Every call that was let through as a probe must hand its slot back with `release`, whether it
+    finished, failed or was cancelled.
+    """
+
+    def __init__(
+        self,
+        failure_rate: float = 0.5,
+        window: int = 20,
+        min_calls: int = 10,
+        cooldown: float = 10.0,
+        probes: int = 1,
+        mode: str = "shed",
+        metrics: Optional[Metrics] = None,
+    ):
+        if mode not in BREAKER_MODES:
+            raise ValueError(f"Unknown circuit breaker mode {mode!r}, expected one of {BREAKER_MODES}")
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self.probes = probes
+        self.mode = mode
+        self.metrics = metrics if metrics is not None else get_metrics()
+        self.state = "closed"
+        self.opened = 0
+        self.shed = 0
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+
+    def _transition(self, state: str):
+        if state != self.state:
+            self.state = state
+            self.metrics.increment("circuit_transitions", state=state)
+            if state == "open":
+                self.opened += 1
+                self._opened_at = time.monotonic()
+
+    def _try_acquire(self) -> Tuple[Optional[float], bool]:
+        # (None, probe) when the call may go ahead, otherwise the seconds to wait before asking again
+        while True:
+            if self.state == "closed":
+                return None, False
+            if self.state == "open":
+                remaining = self._opened_at + self.cooldown - time.monotonic()
+                if remaining <= 0:
+                    self._transition("half_open")
+                    continue
+            elif self._probes_in_flight < self.probes:
+                self._probes_in_flight += 1
+                return None, True
+            else:
+                remaining = 0.05
+            if self.mode == "shed":
+                self.shed += 1
+                self.metrics.increment("calls_shed")
+                raise CircuitOpenError(f"Circuit breaker is {self.state}, the model backend is degraded")
+            return remaining, False
+
+    async def acquire(self) -> bool:
+        """
+        Wait for permission to make a call.
+
+        Returns:
+            bool: Whether the call is a half-open probe, to be passed to `release`
+
+        Raises:
+            CircuitOpenError: If the circuit is open and the breaker sheds load
+        """
+        while True:
+            wait, probe = self._try_acquire()
+            if wait is None:
+                return probe
+            await asyncio.sleep(wait)
+
+    def acquire_sync(self) -> bool:
+        """
+        Blocking variant of `acquire`, for synchronous callers.
+        """
+        while True:
+            wait, probe = self._try_acquire()
+            if wait is None:
+                return probe
+            time.sleep(wait)
+
+    def release(self, probe: bool):
+        """
+        Hand back the probe slot of a call made after `acquire`, once it is over.
+
+        Args:
+            probe: What `acquire` returned
+        """
+        if probe:
+            self._probes_in_flight = max(self._probes_in_flight - 1, 0)
+
+    def record(self, success: bool):
+        """
+        Record the outcome of a call made after `acquire`.
+        """
+        if self.state == "half_open":
+            if success:
+                self._outcomes.clear()
+                self._transition("closed")
+            else:
+                self._transition("open")
+            return
+        self._outcomes.append(success)
+        failures = self._outcomes.count(False)
+        if self.state == "closed" and len(self._outcomes) >= self.min_calls and failures >= self.failure_rate * len(self._outcomes):
+            self._transition("open")
+
+
+class ResilientCaller:
+    """
+    Wraps model calls with retries, hedging and circuit breaking.
+    Failed attempts are retried with RetryPolicy. An attempt still running past the `hedge_percentile`
+    latency of recent calls is hedged with a duplicate request, and the first answer wins; hedges
+    are capped at `hedge_budget` of all calls so a slow backend is not hit with twice the load.
+    Each attempt goes through the CircuitBreaker, and only backend failures count against it.
+    With a `slot`, every attempt and every hedge holds its own slot (concurrency and rate limits)
+    while it runs and none during the backoff, and the hedge clock only starts once the attempt
+    has its slot. Retries, hedges and their outcomes are recorded in `metrics`.
+    """
+
+    def __init__(
+        self,
+        retry: Optional[RetryPolicy] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        hedge_percentile: Optional[float] = 0.95,
+        hedge_budget: float = 0.1,
+        latency: Optional[LatencyTracker] = None,
+        metrics: Optional[Metrics] = None,
+    ):
+        self.retry = retry or RetryPolicy()
+        self.breaker = breaker
+        self.hedge_percentile = hedge_percentile
+        self.hedge_budget = hedge_budget
+        self.latency = latency or LatencyTracker(hedge_percentile or 0.95)
+        self.metrics = metrics if metrics is not None else get_metrics()
+        self.calls = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedges_won = 0
+
+    def _hedge_delay(self) -> Optional[float]:
+        if self.hedge_percentile is None or self.hedges >= self.hedge_budget * self.calls:
+            return None
+        return self.latency.threshold()
+
+    async def _hedged(self, request: Callable[[], Awaitable[Any]], slot: Optional[Callable[[], AsyncContextManager]]) -> Any:
+        started = asyncio.Event()
+
+        async def attempt(primary: bool):
+            async with slot() if slot is not None else contextlib.nullcontext():
+                if primary:
+                    started.set()
+                return await request()
+
+        primary = asyncio.ensure_future(attempt(True))
+        pending = {primary}
+        waiting = asyncio.ensure_future(started.wait())
+        try:
+            # Waiting for a slot is not backend latency, so the hedge clock starts once the call is sent
+            await asyncio.wait({primary, waiting}, return_when=asyncio.FIRST_COMPLETED)
+            start = time.perf_counter()
+            delay = self._hedge_delay()
+            if delay is not None and not primary.done():
+                done, _ = await asyncio.wait(pending, timeout=delay)
+                if not done:
+                    self.hedges += 1
+                    self.metrics.increment("hedges", outcome="sent")
+                    pending.add(asyncio.ensure_future(attempt(False)))
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for finished in done:
+                    if finished.exception() is None:
+                        if finished is not primary:
+                            self.hedges_won += 1
+                            self.metrics.increment("hedges", outcome="won")
+                        self.latency.record(time.perf_counter() - start)
+                        return finished.result()
+                    error = finished.exception()
+            raise error
+        finally:
+            waiting.cancel()
+            for task in pending:
+                task.cancel()
+
+    def _retry_delay(self, attempt: int, error: Exception) -> Optional[float]:
+        # Record a failed attempt; the backoff before the next one, or None to give up
+        retryable = is_retryable(error)
+        # Invalid requests say nothing about the health of the backend, so only backend failures are recorded
+        if self.breaker is not None and retryable:
+            self.breaker.record(False)
+        if not retryable or attempt >= self.retry.max_attempts:
+            return None
+        delay = self.retry.delay(attempt, error)
+        self.retries += 1
+        self.metrics.increment("call_retries", reason=type(error).__name__)
+        self.metrics.observe("retry_delay_seconds", delay)
+        return delay
+
+    async def call(self, request: Callable[[], Awaitable[Any]], slot: Optional[Callable[[], AsyncContextManager]] = None) -> Any:
+        """
+        Run a model call with retries, hedging and circuit breaking.
+
+        Args:
+            request: Starts one attempt of the call, e.g. `lambda: client.beta.chat.completions.parse(...)`
+            slot: Returns an async context manager held around every attempt and hedge, e.g. a
+                concurrency slot with its rate limit budget
+
+        Returns:
+            The result of the first successful attempt
+
+        Raises:
+            CircuitOpenError: If the breaker sheds the call
+            Exception: The last error once it is not retryable or the attempts are used up
+        """
+        self.calls += 1
+        attempt = 0
+        while True:
+            attempt += 1
+            probe = await self.breaker.acquire() if self.breaker is not None else False
+            try:
+                result = await self._hedged(request, slot)
+            except Exception as e:
+                delay = self._retry_delay(attempt, e)
+                if delay is None:
+                    raise
+            else:
+                if self.breaker is not None:
+                    self.breaker.record(True)
+                return result
+            finally:
+                # Also when the call is cancelled, e.g. a losing hedge, or the probe slot would never come back
+                if self.breaker is not None:
+                    self.breaker.release(probe)
+            await asyncio.sleep(delay)
+
+    def call_sync(self, request: Callable[[], Any]) -> Any:
+        """
+        Blocking variant of `call` for synchronous clients, with retries and circuit breaking.
+        Calls are not hedged, since that needs a second attempt running concurrently.
+
+        Args:
+            request: Makes one attempt of the call, e.g. `lambda: client.beta.chat.completions.parse(...)`
+
+        Returns:
+            The result of the first successful attempt
+        """
+        self.calls += 1
+        attempt = 0
+        while True:
+            attempt += 1
+            probe = self.breaker.acquire_sync() if self.breaker is not None else False
+            try:
+                result = request()
+            except Exception as e:
+                delay = self._retry_delay(attempt, e)
+                if delay is None:
+                    raise
+            else:
+                if self.breaker is not None:
+                    self.breaker.record(True)
+                return result
+            finally:
+                if self.breaker is not None:
+                    self.breaker.release(probe)
+            time.sleep(delay)
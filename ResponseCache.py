@@ -0,0 +1,230 @@
+import functools
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Optional, Tuple, Union
+
+from pydantic import BaseModel
+
+from PromptTemplate import Messages, prompt_text
+
+
+@functools.lru_cache(maxsize=None)
+def schema_fingerprint(schema: type[BaseModel]) -> str:
+    """
+    Stable hash of a pydantic model's JSON schema, computed once per model.
+
+    Args:
+        schema: Structured output schema
+
+    Returns:
+        str: Hex digest of the schema
+    """
+    schema_json = json.dumps(schema.model_json_schema(), sort_keys=True)
+    return hashlib.sha256(schema_json.encode("utf-8")).hexdigest()
+
+
+class CacheMissError(KeyError):
+    """Raised in cache-only mode when a prompt has no stored analysis."""
+
+
+class ResponseCache:
+    """
+    Persistent content-addressed cache of parsed model analyses, stored in SQLite.
+    Entries are keyed by a hash of the rendered prompt, the model name and the response schema,
+    so any change to one of them is a cache miss. Entries older than `max_age_seconds` are ignored
+    and evicted, and the least recently used entries are evicted beyond `max_entries`.
+    The access times of hits are buffered and written `touch_batch_size` at a time, before an
+    eviction and on `close`, so a lookup does not commit to disk.
+    """
+
+    def __init__(
+        self,
+        path: str = "response_cache.sqlite",
+        max_entries: Optional[int] = None,
+        max_age_seconds: Optional[float] = None,
+        cache_only: bool = False,
+        touch_batch_size: int = 256,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_seconds
+        self.cache_only = cache_only
+        self.touch_batch_size = touch_batch_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._touched: Dict[str, float] = {}
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                analysis TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)")
+        self._connection.commit()
+
+    @staticmethod
+    def make_key(prompt: Union[str, Messages], model: str, schema: type[BaseModel]) -> str:
+        """
+        Build the cache key for a request.
+
+        Args:
+            prompt: Fully rendered messages or formatted prompt
+            model: Model name
+            schema: Structured output schema
+
+        Returns:
+            str: Hex digest identifying the request
+        """
+        digest = hashlib.sha256()
+        for part in (model, schema_fingerprint(schema), prompt_text(prompt)):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[Dict]:
+        """
+        Look up a stored analysis.
+
+        Args:
+            key: Key from `make_key`
+
+        Returns:
+            Optional[Dict]: The stored analysis, or None on a miss or expired entry
+        """
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT analysis, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or (self.max_age_seconds is not None and now - row[1] > self.max_age_seconds):
+                self.misses += 1
+                return None
+            self._touch([key], now)
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key: str, analysis: Dict, model: str = ""):
+        """
+        Store a parsed analysis and apply the eviction policy.
+
+        Args:
+            key: Key from `make_key`
+            analysis: Parsed EmailAnalysis dictionary
+            model: Model name, stored for inspection
+        """
+        now = time.time()
+        with self._lock:
+            self._touched.pop(key, None)
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (key, model, analysis, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, model, json.dumps(analysis, default=str), now, now)
+            )
+            self._evict(now)
+            self._connection.commit()
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Dict]:
+        """
+        Look up several analyses with one query.
+
+        Args:
+            keys: Keys from `make_key`
+
+        Returns:
+            Dict[str, Dict]: Stored analyses by key; misses and expired entries are left out
+        """
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return {}
+        now = time.time()
+        with self._lock:
+            placeholders = ",".join("?" * len(keys))
+            rows = self._connection.execute(
+                f"SELECT key, analysis, created_at FROM responses WHERE key IN ({placeholders})", keys
+            ).fetchall()
+            found = {
+                key: analysis for key, analysis, created_at in rows
+                if self.max_age_seconds is None or now - created_at <= self.max_age_seconds
+            }
+            self._touch(found, now)
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return {key: json.loads(analysis) for key, analysis in found.items()}
+
+    def set_many(self, entries: Iterable[Tuple[str, Dict]], model: str = ""):
+        """
+        Store several parsed analyses in one transaction.
+
+        Args:
+            entries: (key, analysis) pairs
+            model: Model name, stored for inspection
+        """
+        now = time.time()
+        rows = [(key, model, json.dumps(analysis, default=str), now, now) for key, analysis in entries]
+        if not rows:
+            return
+        with self._lock:
+            for key, *_ in rows:
+                self._touched.pop(key, None)
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO responses (key, model, analysis, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            self._evict(now)
+            self._connection.commit()
+
+    def _touch(self, keys: Iterable[str], now: float):
+        # Called with the lock held
+        for key in keys:
+            self._touched[key] = now
+        if len(self._touched) >= self.touch_batch_size:
+            self._flush_touched()
+            self._connection.commit()
+
+    def _flush_touched(self):
+        # Write the buffered access times in the current transaction; the caller commits
+        if self._touched:
+            self._connection.executemany(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?",
+                [(accessed_at, key) for key, accessed_at in self._touched.items()]
+            )
+            self._touched.clear()
+
+    def _evict(self, now: float):
+        # Least recently used needs the buffered access times
+        self._flush_touched()
+        if self.max_age_seconds is not None:
+            self._connection.execute(
+                "DELETE FROM responses WHERE created_at < ?", (now - self.max_age_seconds,)
+            )
+        if self.max_entries is not None:
+            self._connection.execute(
+                """
+                DELETE FROM responses WHERE key IN (
+                    SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,)
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def close(self):
+        """
+        Write the buffered access times and close the database.
+        """
+        with self._lock:
+            self._flush_touched()
+            self._connection.commit()
+            self._connection.close()
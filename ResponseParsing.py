@@ -0,0 +1,53 @@
+import functools
+
+from typing import Any
+
+import pydantic
+from pydantic import BaseModel
+
+from EmailClass import EmailAnalysis
+
+
+@functools.lru_cache(maxsize=None)
+def get_validator(schema: type[BaseModel] = EmailAnalysis) -> pydantic.TypeAdapter:
+    """
+    Get the cached pydantic validator for a response schema, built once per schema.
+    """
+    return pydantic.TypeAdapter(schema)
+
+
+def parse_openai_email_analysis(api_response: Any, schema: type[BaseModel] = EmailAnalysis) -> BaseModel:
+    """
+    Extract the email analysis from an OpenAI structured-output response.
+
+    Args:
+        api_response: The chat completion returned by `client.beta.chat.completions.parse`,
+            the raw message content (str or bytes), or an already parsed analysis
+        schema: Structured output schema
+
+    Returns:
+        EmailAnalysis: The validated email analysis
+
+    Raises:
+        ValueError: If the response has no content or the content does not match the schema
+    """
+    if isinstance(api_response, schema):
+        return api_response
+
+    if isinstance(api_response, (str, bytes)):
+        content = api_response
+    else:
+        message = api_response.choices[0].message
+        # The SDK already validated the content against the schema
+        if getattr(message, 'parsed', None) is not None:
+            return message.parsed
+        if getattr(message, 'refusal', None):
+            raise ValueError(f"The model refused to analyze the email: {message.refusal}")
+        content = message.content
+
+    if not content:
+        raise ValueError("Could not find JSON content in API response")
+    try:
+        return get_validator(schema).validate_json(content)
+    except pydantic.ValidationError as e:
+        raise ValueError(f"Failed to parse email analysis JSON: {str(e)}")
@@ -0,0 +1,130 @@
+import atexit
+import csv
+import json
+import queue
+import threading
+import uuid
+from typing import Dict, Optional
+
+from Metrics import get_metrics
+
+# Queue markers for the writer thread
+_FLUSH = object()
+_CLOSE = object()
+
+
+class BufferedResultsWriter:
+    """
+    Appends accuracy records to the results CSV from a background thread.
+    Records are buffered and written in batches, so scoring never waits on file I/O.
+    Every record is tagged with the run id and prompt version, and pending records are
+    flushed when the writer is closed or the interpreter exits.
+    """
+
+    def __init__(
+        self,
+        path: str = 'Results.csv',
+        run_id: Optional[str] = None,
+        prompt_version: Optional[str] = None,
+        batch_size: int = 100,
+        flush_interval: float = 1.0,
+    ):
+        self.path = path
+        self.run_id = run_id or uuid.uuid4().hex
+        self.prompt_version = prompt_version
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.written = 0
+        self._queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="results-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def write(self, record: Dict):
+        """
+        Queue a record for writing. Returns immediately.
+
+        Args:
+            record: Accuracy results of one email
+        """
+        if self._closed:
+            raise ValueError("Cannot write to a closed results writer")
+        tagged = {"run_id": self.run_id, "prompt_version": self.prompt_version}
+        tagged.update(record)
+        self._queue.put(tagged)
+
+    def flush(self):
+        """
+        Block until every record queued so far has been written.
+        """
+        if self._closed:
+            return
+        done = threading.Event()
+        self._queue.put((_FLUSH, done))
+        done.wait()
+
+    def close(self):
+        """
+        Flush pending records and stop the writer thread.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_CLOSE)
+        self._thread.join()
+        atexit.unregister(self.close)
+
+    def _write_rows(self, buffer):
+        if not buffer:
+            return
+        try:
+            with get_metrics().timer("results_flush_seconds"):
+                with open(self.path, mode='a', newline='') as csv_file:
+                    writer = csv.writer(csv_file)
+                    # Each row is a single-column JSON entry
+                    writer.writerows([json.dumps(record)] for record in buffer)
+            self.written += len(buffer)
+            get_metrics().increment("results_written", len(buffer))
+        except OSError as e:
+            # Losing a batch of results must not kill the writer thread
+            print(f"Failed to write {len(buffer)} results to {self.path}: {e}")
+        buffer.clear()
+
+    def _run(self):
+        buffer = []
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                self._write_rows(buffer)
+                continue
+            if item is _CLOSE:
+                self._write_rows(buffer)
+                return
+            if isinstance(item, tuple) and item[0] is _FLUSH:
+                self._write_rows(buffer)
+                item[1].set()
+                continue
+            buffer.append(item)
+            if len(buffer) >= self.batch_size:
+                self._write_rows(buffer)
+
+
+_default_writer = None
+
+
+def get_results_writer(**kwargs) -> BufferedResultsWriter:
+    """
+    Get the process-wide results writer.
+
+    Args:
+        **kwargs: BufferedResultsWriter settings, only used when the writer is first created
+
+    Returns:
+        BufferedResultsWriter: Shared results writer
+    """
+    global _default_writer
+    if _default_writer is None or _default_writer._closed:
+        _default_writer = BufferedResultsWriter(**kwargs)
+    return _default_writer
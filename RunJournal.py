@@ -0,0 +1,152 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterator, Optional, Set, Union
+
+from pydantic import BaseModel
+
+from PromptTemplate import Messages
+from ResponseCache import ResponseCache
+
+# Dataset columns that identify an email, whatever preprocessing is applied to them
+_ROW_COLUMNS = ("Sender", "Recipients", "Subject", "EmailBody")
+
+
+class RunJournal:
+    """
+    Append-only JSONL journal of completed model calls, keyed by a fingerprint of the dataset row
+    and of the rendered request (template, preprocessing, model and schema), so resuming with a
+    different dataset or configuration never reuses an analysis made for something else.
+    Every record is flushed as soon as it is written, so a run that dies partway through
+    (rate limit, network error, Ctrl-C) can be resumed without paying for those calls again.
+    """
+
+    def __init__(self, path: str = 'run_journal.jsonl', fsync: bool = False):
+        self.path = path
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._file = open(path, mode='a', encoding='utf-8')
+        # Terminate a line left truncated by a crash so the next record starts cleanly
+        if self._file.tell() > 0:
+            with open(path, mode='rb') as journal_file:
+                journal_file.seek(-1, os.SEEK_END)
+                if journal_file.read(1) != b"\n":
+                    self._file.write("\n")
+                    self._file.flush()
+
+    @staticmethod
+    def make_key(row: Dict[str, str], prompt: Union[str, Messages], model: str, schema: type[BaseModel]) -> str:
+        """
+        Fingerprint of one model call.
+
+        Args:
+            row: Dataset row of the email
+            prompt: Rendered messages sent for it, after preprocessing
+            model: Model name
+            schema: Structured output schema
+
+        Returns:
+            str: Hex digest identifying the row and the request
+        """
+        digest = hashlib.sha256()
+        for part in (*(row.get(column, "") for column in _ROW_COLUMNS), ResponseCache.make_key(prompt, model, schema)):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def load(self, prompt_version: str) -> Dict[str, Dict]:
+        """
+        Read the completed analyses recorded for a prompt version.
+        A truncated last line, left by a crash mid-write, is ignored, and so are records written
+        without a fingerprint, which cannot be matched safely.
+
+        Args:
+            prompt_version: Prompt version the analyses must have been produced with
+
+        Returns:
+            Dict[str, Dict]: Analysis by `make_key` fingerprint, the latest record winning
+        """
+        completed = {}
+        for record in self._records():
+            if record.get("prompt_version") == prompt_version and record.get("key"):
+                completed[record["key"]] = record["analysis"]
+        return completed
+
+    def unfinished_run_id(self, prompt_version: str) -> Optional[str]:
+        """
+        The run that most recently journaled an analysis for a prompt version, if it never
+        reached `finish`, so resuming it carries on under the same run id.
+
+        Args:
+            prompt_version: Prompt version of the run being resumed
+
+        Returns:
+            Optional[str]: Run id, or None if the latest run finished or no run recorded one
+        """
+        run_id = None
+        finished = set()
+        for record in self._records():
+            if record.get("prompt_version") != prompt_version or not record.get("run_id"):
+                continue
+            if record.get("finished"):
+                finished.add(record["run_id"])
+            else:
+                run_id = record["run_id"]
+        return run_id if run_id not in finished else None
+
+    def run_keys(self, run_id: str) -> Set[str]:
+        """
+        Fingerprints of the analyses a run journaled, whose accuracy that run already logged.
+        """
+        return {record["key"] for record in self._records() if record.get("run_id") == run_id and record.get("key")}
+
+    def _records(self) -> Iterator[Dict]:
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, mode='r', encoding='utf-8') as journal_file:
+            for line in journal_file:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+    def record(self, row_id: str, key: str, prompt_version: str, analysis: Dict, run_id: Optional[str] = None):
+        """
+        Append a completed analysis to the journal.
+
+        Args:
+            row_id: Identifier of the dataset row
+            key: Fingerprint of the call from `make_key`
+            prompt_version: Prompt version used for the call
+            analysis: Parsed EmailAnalysis dictionary
+            run_id: Run that produced the analysis
+        """
+        self._append({
+            "row_id": row_id,
+            "key": key,
+            "prompt_version": prompt_version,
+            "run_id": run_id,
+            "timestamp": time.time(),
+            "analysis": analysis
+        })
+
+    def _append(self, record: Dict):
+        line = json.dumps(record, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+
+    def finish(self, run_id: str, prompt_version: str):
+        """
+        Mark a run as complete, so a later `--resume` starts a new run instead of continuing it.
+        """
+        self._append({"run_id": run_id, "prompt_version": prompt_version, "finished": True, "timestamp": time.time()})
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
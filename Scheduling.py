@@ -0,0 +1,166 @@
+import asyncio
+import contextlib
+import heapq
+import itertools
+import re
+import time
+from typing import AsyncIterator, Dict, List, Optional
+
+from EmailClass import UrgencyLevel
+from Metrics import Metrics, get_metrics
+
+URGENCY_RANKS = {
+    UrgencyLevel.STANDARD: 0,
+    UrgencyLevel.URGENT: 1,
+    UrgencyLevel.IMMEDIATE: 2,
+    UrgencyLevel.EMERGENCY: 3,
+}
+
+# Urgency levels allowed to use the reserved slots
+PRIORITY_LEVELS = (UrgencyLevel.IMMEDIATE, UrgencyLevel.EMERGENCY)
+
+# Keyword heuristic, checked from the most to the least urgent level
+_URGENCY_PATTERNS = [
+    (UrgencyLevel.EMERGENCY, re.compile(
+        r"\b(emergenc(y|ies)|stranded|stuck (at|in) the airport|hospitali[sz]ed|accident|evacuat\w*|"
+        r"lost (my |our )?passports?|stolen|natural disaster|injur(ed|y)|sos)\b", re.IGNORECASE)),
+    (UrgencyLevel.IMMEDIATE, re.compile(
+        r"\b(immediately|right now|right away|asap|today|tonight|within the hour|missed (my |our |the )?(flight|connection)|"
+        r"(flight|train) (was |has been )?cancell?ed|denied boarding|leaving (in|within) \d+ hours?)\b", re.IGNORECASE)),
+    (UrgencyLevel.URGENT, re.compile(
+        r"\b(urgent(ly)?|as soon as possible|quickly|tomorrow|deadline|last[- ]minute|illness|reschedul\w*|"
+        r"time[- ]sensitive|promptly)\b", re.IGNORECASE)),
+]
+
+
+def estimate_urgency(subject: str, body: str) -> UrgencyLevel:
+    """
+    Cheap keyword estimate of the urgency of an email, used to order the model calls before
+    the model has seen it.
+
+    Args:
+        subject: Email subject
+        body: Email body
+
+    Returns:
+        UrgencyLevel: The most urgent level whose keywords appear, STANDARD if none do
+    """
+    text = f"{subject}\n{body}"
+    for level, pattern in _URGENCY_PATTERNS:
+        if pattern.search(text):
+            return level
+    return UrgencyLevel.STANDARD
+
+
+class PriorityScheduler:
+    """
+    Grants model call slots in urgency order instead of arrival order.
+    `reserved` of the `max_concurrency` slots are kept for IMMEDIATE and EMERGENCY emails, so a
+    burst of standard mail cannot hold every slot when a stranded traveler writes in. Waiting
+    emails age: every `aging_seconds` spent in the queue counts as one urgency level, so
+    low-priority mail is delayed but never starved. Queue waits are recorded per urgency level
+    as `queue_wait_seconds`.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        reserved: int = 1,
+        aging_seconds: float = 30.0,
+        metrics: Optional[Metrics] = None,
+    ):
+        if not 0 <= reserved < max_concurrency:
+            raise ValueError(f"reserved must be between 0 and {max_concurrency - 1}, got {reserved}")
+        self.max_concurrency = max_concurrency
+        self.reserved = reserved
+        self.aging_seconds = aging_seconds
+        self.metrics = metrics if metrics is not None else get_metrics()
+        self.in_flight = 0
+        self.shared_in_flight = 0
+        self.waits: Dict[UrgencyLevel, List[float]] = {level: [] for level in URGENCY_RANKS}
+        # One heap per lane; a waiter's key is its arrival time moved earlier by its urgency,
+        # which orders waiters by urgency plus age without re-sorting as time passes
+        self._priority_lane: List = []
+        self._shared_lane: List = []
+        self._sequence = itertools.count()
+
+    def _key(self, urgency: UrgencyLevel, arrival: float) -> float:
+        return arrival - URGENCY_RANKS[urgency] * self.aging_seconds
+
+    def _dispatch(self):
+        while self.in_flight < self.max_concurrency:
+            candidates = []
+            for lane in (self._priority_lane, self._shared_lane):
+                # Waiters cancelled while queued are dropped lazily
+                while lane and lane[0][2].cancelled():
+                    heapq.heappop(lane)
+                if lane and (lane is self._priority_lane or self.shared_in_flight < self.max_concurrency - self.reserved):
+                    candidates.append(lane)
+            if not candidates:
+                return
+            lane = min(candidates, key=lambda candidate: candidate[0][:2])
+            _, _, waiter, shared = heapq.heappop(lane)
+            self.in_flight += 1
+            if shared:
+                self.shared_in_flight += 1
+            waiter.set_result(None)
+
+    def _release(self, shared: bool):
+        self.in_flight -= 1
+        if shared:
+            self.shared_in_flight -= 1
+        self._dispatch()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, urgency: UrgencyLevel) -> AsyncIterator[float]:
+        """
+        Hold a model call slot for the enclosed block.
+
+        Args:
+            urgency: Early urgency estimate of the email
+
+        Yields:
+            float: Seconds spent waiting for the slot
+        """
+        arrival = time.monotonic()
+        shared = urgency not in PRIORITY_LEVELS
+        waiter = asyncio.get_running_loop().create_future()
+        lane = self._shared_lane if shared else self._priority_lane
+        heapq.heappush(lane, (self._key(urgency, arrival), next(self._sequence), waiter, shared))
+        self._dispatch()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            # Granted just before the cancellation arrived: hand the slot on
+            if waiter.done() and not waiter.cancelled():
+                self._release(shared)
+            else:
+                waiter.cancel()
+            raise
+        wait = time.monotonic() - arrival
+        self.waits[urgency].append(wait)
+        self.metrics.observe("queue_wait_seconds", wait, urgency=urgency.value)
+        try:
+            yield wait
+        finally:
+            self._release(shared)
+
+    def summary(self) -> Dict[str, Dict]:
+        """
+        Queue waits per urgency level.
+
+        Returns:
+            Dict: Count, mean, p95 and max wait in seconds for every level that had emails
+        """
+        summary = {}
+        for level, waits in self.waits.items():
+            if not waits:
+                continue
+            ordered = sorted(waits)
+            summary[level.value] = {
+                "count": len(ordered),
+                "mean_seconds": sum(ordered) / len(ordered),
+                "p95_seconds": ordered[min(int(0.95 * len(ordered)), len(ordered) - 1)],
+                "max_seconds": ordered[-1],
+            }
+        return summary
@@ -0,0 +1,128 @@
+import asyncio
+import functools
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from pydantic import BaseModel, create_model
+
+from AnalysisEngine import AsyncAnalysisEngine
+from EmailClass import EmailAnalysis
+from Metrics import Metrics, get_metrics
+from PromptTemplate import Messages
+from ResponseParsing import get_validator, parse_openai_email_analysis
+
+# Sections of EmailAnalysis that can be requested on their own; together they cover every field
+SECTIONS: Dict[str, Tuple[str, ...]] = {
+    "triage": ("primary_purpose", "sentiment", "requires_immediate_attention", "priority_score"),
+    "metadata": ("email_id", "subject", "sender_email", "recipient_email", "language_detected"),
+    "classification": ("secondary_purposes", "booking_type", "support_type"),
+    "content": ("services_mentioned", "monetary_references", "competitor_mentions"),
+    "trip": ("trip_details",),
+    "handling": ("contains_sensitive_data", "gdpr_relevant", "follow_up_required", "confidence_score"),
+}
+
+
+@functools.lru_cache(maxsize=None)
+def get_profile(name: str, base: type[BaseModel] = EmailAnalysis) -> type[BaseModel]:
+    """
+    Get the pydantic model of a named schema profile, built once per name.
+    A profile keeps the annotations and descriptions of its fields from `base`, so it can be
+    sent as a structured-output schema and validated like the full model.
+
+    Args:
+        name: "full" or one of SECTIONS, e.g. "triage"
+        base: Model the profile is derived from
+
+    Returns:
+        type[BaseModel]: `base` itself for "full", otherwise a model with the section's fields
+
+    Raises:
+        KeyError: If the profile name is unknown
+    """
+    if name == "full":
+        return base
+    if name not in SECTIONS:
+        raise KeyError(f"Unknown schema profile {name!r}, expected 'full' or one of {list(SECTIONS)}")
+    fields = {field: (base.model_fields[field].annotation, base.model_fields[field]) for field in SECTIONS[name]}
+    return create_model(f"{base.__name__}{name.capitalize()}", __doc__=f"{name.capitalize()} section of {base.__name__}.", **fields)
+
+
+def merge_sections(parts: Iterable[Union[BaseModel, Dict]], schema: type[BaseModel] = EmailAnalysis) -> BaseModel:
+    """
+    Merge section analyses back into one full analysis.
+
+    Args:
+        parts: Section models or dictionaries covering every field of `schema`
+        schema: Full analysis model
+
+    Returns:
+        BaseModel: Validated full analysis
+
+    Raises:
+        ValueError: If the merged fields do not validate against `schema`
+    """
+    merged: Dict[str, Any] = {}
+    for part in parts:
+        merged.update(part.model_dump(mode='json') if isinstance(part, BaseModel) else part)
+    try:
+        return get_validator(schema).validate_python(merged)
+    except Exception as e:
+        raise ValueError(f"Merged sections do not form a valid {schema.__name__}: {e}")
+
+
+class SectionedAnalyzer:
+    """
+    Requests an analysis as several smaller section schemas sent in parallel through one engine.
+    The `priority_sections` (triage by default) are issued first and get the engine's next free
+    concurrency slot ahead of every other section, including those of other emails, so they are
+    answered first; `on_section` is called as each section arrives, letting routing act on the
+    triage fields before the full analysis is merged. The time from the start of an email to each
+    section is recorded as `section_seconds`.
+    """
+
+    def __init__(
+        self,
+        engine: AsyncAnalysisEngine,
+        sections: Sequence[str] = tuple(SECTIONS),
+        on_section: Optional[Callable[[str, BaseModel, float], Any]] = None,
+        metrics: Optional[Metrics] = None,
+        priority_sections: Sequence[str] = ("triage",),
+    ):
+        missing = set(engine.schema.model_fields) - {field for section in sections for field in SECTIONS[section]}
+        if missing:
+            raise ValueError(f"Sections {list(sections)} do not cover the fields {sorted(missing)}")
+        self.engine = engine
+        self.priority_sections = set(priority_sections)
+        self.sections = sorted(sections, key=lambda section: section not in self.priority_sections)
+        self.on_section = on_section
+        self.metrics = metrics if metrics is not None else get_metrics()
+        self.schema = engine.schema
+
+    async def analyze(self, messages: Messages) -> BaseModel:
+        """
+        Analyze one email section by section.
+
+        Args:
+            messages: Rendered messages for the email
+
+        Returns:
+            BaseModel: Merged full analysis
+
+        Raises:
+            ValueError: If a section response cannot be parsed or the sections do not merge
+        """
+        start = time.perf_counter()
+
+        async def request(section: str):
+            profile = get_profile(section, self.schema)
+            priority = -1 if section in self.priority_sections else 0
+            response = await self.engine.analyze(messages, schema=profile, priority=priority)
+            analysis = parse_openai_email_analysis(response, profile)
+            elapsed = time.perf_counter() - start
+            self.metrics.observe("section_seconds", elapsed, section=section)
+            if self.on_section is not None:
+                self.on_section(section, analysis, elapsed)
+            return analysis
+
+        parts: List[BaseModel] = await asyncio.gather(*(request(section) for section in self.sections))
+        return merge_sections(parts, self.schema)
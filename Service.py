@@ -0,0 +1,415 @@
+import argparse
+import asyncio
+import json
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from pydantic import BaseModel
+
+from AnalysisEngine import AsyncAnalysisEngine
+from Metrics import InMemoryMetrics, Metrics, get_metrics
+from ModelClient import configure_client_manager
+from PromptTemplate import PromptTemplate, load_prompt_template
+from Resilience import CircuitBreaker, ResilientCaller
+from ResponseCache import ResponseCache
+from ResponseParsing import get_validator, parse_openai_email_analysis
+
+MAX_BODY_BYTES = 1_000_000
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class BadRequest(ValueError):
+    """
+    Raised for a request the service cannot handle; answered with a 400.
+    """
+    pass
+
+
+def parse_email(payload: Any) -> Dict[str, str]:
+    """
+    Validate one email of a request body.
+
+    Args:
+        payload: JSON object with `subject` and `email_body`, and optionally `sender_email`,
+            `recipient_email` (string or list) and `email_id`
+
+    Returns:
+        Dict[str, str]: The email fields as strings
+
+    Raises:
+        BadRequest: If the payload is not an object or misses a required field
+    """
+    if not isinstance(payload, dict):
+        raise BadRequest("Each email must be a JSON object")
+    missing = [field for field in ("subject", "email_body") if not isinstance(payload.get(field), str)]
+    if missing:
+        raise BadRequest(f"Missing string fields: {', '.join(missing)}")
+    recipients = payload.get("recipient_email", "")
+    if isinstance(recipients, list):
+        recipients = ", ".join(str(recipient) for recipient in recipients)
+    return {
+        "subject": payload["subject"],
+        "email_body": payload["email_body"],
+        "sender_email": str(payload.get("sender_email", "")),
+        "recipient_email": str(recipients),
+        "email_id": str(payload.get("email_id", "")),
+    }
+
+
+def parse_content_length(value: Optional[str]) -> int:
+    """
+    Validate the Content-Length header of a request.
+
+    Args:
+        value: Header value, or None if the request has no body
+
+    Returns:
+        int: Body size in bytes
+
+    Raises:
+        BadRequest: If the value is not a non-negative integer
+    """
+    if not value:
+        return 0
+    try:
+        length = int(value)
+    except ValueError:
+        raise BadRequest(f"Invalid Content-Length: {value!r}")
+    if length < 0:
+        raise BadRequest(f"Invalid Content-Length: {value!r}")
+    return length
+
+
+class MicroBatcher:
+    """
+    Collects items submitted concurrently and hands them to `handler` together, once `window`
+    seconds after the first item of a batch or as soon as `max_batch` items are waiting.
+    """
+
+    def __init__(self, handler: Callable[[List[Any]], Awaitable[List[Any]]], window: float = 0.005, max_batch: int = 32):
+        self.handler = handler
+        self.window = window
+        self.max_batch = max_batch
+        self.batches = 0
+        self._pending: List[Tuple[Any, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._running = set()
+
+    async def submit(self, item: Any) -> Any:
+        """
+        Add an item to the current batch and wait for its result.
+
+        Raises:
+            Exception: The error the handler returned for this item
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            # Keep a reference so the batch is not garbage collected mid-flight
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch: List[Tuple[Any, asyncio.Future]]):
+        self.batches += 1
+        try:
+            results = await self.handler([item for item, _ in batch])
+        except Exception as e:
+            results = [e] * len(batch)
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+class AnalysisService:
+    """
+    Long-running analysis service. The prompt template, the validators, the model client
+    pool and the response cache are set up once and stay warm between requests.
+    Concurrent requests are micro-batched: emails arriving within `window` seconds are rendered
+    together, identical prompts in flight are sent to the model once, and the cache is read and
+    written with one query per batch, in a worker thread so SQLite never blocks the event loop.
+
+    Endpoints:
+        POST /analyze: one email, answered with its EmailAnalysis JSON
+        POST /analyze_batch: `{"emails": [...]}`, answered with `{"results": [...]}` in the same
+            order, holding an analysis or `{"error": ...}` per email
+        GET /health: service status
+        GET /metrics: Prometheus text-format metrics
+    """
+
+    def __init__(
+        self,
+        template: PromptTemplate,
+        engine: AsyncAnalysisEngine,
+        cache: Optional[ResponseCache] = None,
+        window: float = 0.005,
+        max_batch: int = 32,
+        metrics: Optional[Metrics] = None,
+    ):
+        self.template = template
+        self.engine = engine
+        self.cache = cache
+        self.metrics = metrics if metrics is not None else get_metrics()
+        self.batcher = MicroBatcher(self._analyze_many, window=window, max_batch=max_batch)
+        self.started_at = time.time()
+        self.in_flight = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._calls: Dict[str, asyncio.Future] = {}
+        # Build the validator and schema fingerprint now rather than on the first request
+        get_validator(engine.schema)
+        ResponseCache.make_key("", engine.model, engine.schema)
+
+    async def analyze(self, email: Dict[str, str]) -> BaseModel:
+        """
+        Analyze one email, batched with the other emails submitted at the same time.
+
+        Args:
+            email: Email fields, as returned by `parse_email`
+
+        Returns:
+            BaseModel: The validated analysis
+        """
+        return await self.batcher.submit(email)
+
+    async def analyze_batch(self, emails: List[Dict[str, str]]) -> List[Any]:
+        """
+        Analyze several emails concurrently.
+
+        Returns:
+            List: The analysis, or the exception, of every email in order
+        """
+        return await asyncio.gather(*(self.analyze(email) for email in emails), return_exceptions=True)
+
+    async def _call(self, messages) -> BaseModel:
+        response = await self.engine.analyze(messages)
+        return parse_openai_email_analysis(response, self.engine.schema)
+
+    async def _analyze_many(self, emails: List[Dict[str, str]]) -> List[Any]:
+        self.metrics.increment("micro_batches")
+        self.metrics.increment("micro_batch_emails", len(emails))
+        keyed = []
+        for email in emails:
+            messages = self.template.render(
+                subject=email["subject"],
+                sender_email=email["sender_email"],
+                recipient_email=email["recipient_email"],
+                email_body=email["email_body"]
+            )
+            keyed.append((ResponseCache.make_key(messages, self.engine.model, self.engine.schema), messages))
+        unique = dict(keyed)
+        analyses: Dict[str, Any] = {}
+        if self.cache is not None:
+            validator = get_validator(self.engine.schema)
+            cached = await asyncio.to_thread(self.cache.get_many, list(unique))
+            analyses = {key: validator.validate_python(analysis) for key, analysis in cached.items()}
+        missing = [key for key in unique if key not in analyses]
+        calls, owned = [], set()
+        for key in missing:
+            # The same prompt may already be in flight for an earlier batch
+            call = self._calls.get(key)
+            if call is None:
+                call = asyncio.ensure_future(self._call(unique[key]))
+                self._calls[key] = call
+                call.add_done_callback(lambda _, key=key: self._calls.pop(key, None))
+                owned.add(key)
+            calls.append(call)
+        responses = await asyncio.gather(*calls, return_exceptions=True)
+        analyses.update(zip(missing, responses))
+        if self.cache is not None:
+            await asyncio.to_thread(
+                self.cache.set_many,
+                [(key, analyses[key].model_dump(mode='json')) for key in owned if not isinstance(analyses[key], Exception)],
+                self.engine.model
+            )
+        results = []
+        for email, (key, _) in zip(emails, keyed):
+            analysis = analyses[key]
+            if not isinstance(analysis, Exception) and email["email_id"] and "email_id" in type(analysis).model_fields:
+                analysis = analysis.model_copy(update={"email_id": email["email_id"]})
+            results.append(analysis)
+        return results
+
+    def health(self) -> Dict:
+        breaker = self.engine.resilience.breaker if self.engine.resilience is not None else None
+        degraded = breaker is not None and breaker.state != "closed"
+        return {
+            "status": "degraded" if degraded else "ok",
+            "uptime_seconds": round(time.time() - self.started_at, 3),
+            "in_flight": self.in_flight,
+            "model": self.engine.model,
+            "prompt_version": self.template.version,
+            "micro_batches": self.batcher.batches,
+        }
+
+    async def _dispatch(self, method: str, path: str, body: bytes) -> Tuple[int, str, bytes]:
+        if path == "/health":
+            return 200, "application/json", json.dumps(self.health()).encode("utf-8")
+        if path == "/metrics":
+            if not isinstance(self.metrics, InMemoryMetrics):
+                return 404, "application/json", b'{"error": "Metrics are not kept in memory"}'
+            return 200, "text/plain; version=0.0.4", self.metrics.prometheus_text().encode("utf-8")
+        if path not in ("/analyze", "/analyze_batch"):
+            return 404, "application/json", json.dumps({"error": f"Unknown path {path}"}).encode("utf-8")
+        if method != "POST":
+            return 405, "application/json", b'{"error": "Use POST"}'
+        try:
+            payload = json.loads(body or b"null")
+        except ValueError as e:
+            raise BadRequest(f"Invalid JSON: {e}")
+        if path == "/analyze":
+            analysis = await self.analyze(parse_email(payload))
+            return 200, "application/json", analysis.model_dump_json().encode("utf-8")
+        if not isinstance(payload, dict) or not isinstance(payload.get("emails"), list):
+            raise BadRequest('Expected {"emails": [...]}')
+        results = await self.analyze_batch([parse_email(email) for email in payload["emails"]])
+        body = [
+            {"error": f"{type(result).__name__}: {result}"} if isinstance(result, Exception) else result.model_dump(mode='json')
+            for result in results
+        ]
+        return 200, "application/json", json.dumps({"results": body}).encode("utf-8")
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            # HTTP/1.1 keep-alive: serve requests on the connection until the client closes it
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    return
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    return
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                path = target.split("?", 1)[0]
+                start = time.perf_counter()
+                self.in_flight += 1
+                # Without a valid length the body cannot be skipped, so the connection is closed after answering
+                length = None
+                try:
+                    length = parse_content_length(headers.get("content-length"))
+                    if length > MAX_BODY_BYTES:
+                        status, content_type, body = 413, "application/json", b'{"error": "Request body too large"}'
+                    else:
+                        status, content_type, body = await self._dispatch(method, path, await reader.readexactly(length))
+                except BadRequest as e:
+                    status, content_type, body = 400, "application/json", json.dumps({"error": str(e)}).encode("utf-8")
+                except Exception as e:
+                    status, content_type, body = 500, "application/json", json.dumps({"error": f"{type(e).__name__}: {e}"}).encode("utf-8")
+                finally:
+                    self.in_flight -= 1
+                self.metrics.increment("service_requests", path=path, status=status)
+                self.metrics.observe("service_request_seconds", time.perf_counter() - start, path=path)
+                keep_alive = (
+                    version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                    and length is not None and length <= MAX_BODY_BYTES
+                )
+                writer.write(
+                    f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Length: {len(body)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + body
+                )
+                await writer.drain()
+                if not keep_alive:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8080) -> asyncio.AbstractServer:
+        """
+        Start listening. The pooled model client is created on this event loop right away.
+
+        Returns:
+            asyncio.AbstractServer: The listening server, e.g. to read the bound port
+        """
+        self.engine._get_client()
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        return self._server
+
+    async def serve_forever(self, host: str = "127.0.0.1", port: int = 8080):
+        server = await self.start(host, port)
+        address = server.sockets[0].getsockname()
+        print(f"Analysis service listening on http://{address[0]}:{address[1]}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.engine.aclose()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve email analyses over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--prompt", default="Prompt.md", help="Markdown prompt template")
+    parser.add_argument("--concurrency", type=int, default=16, help="Maximum number of model requests in flight")
+    parser.add_argument("--rpm", type=int, default=None, help="Requests-per-minute budget")
+    parser.add_argument("--tpm", type=int, default=None, help="Tokens-per-minute budget")
+    parser.add_argument("--pool-size", type=int, default=32, help="Maximum number of pooled HTTP connections")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Request timeout in seconds")
+    parser.add_argument("--cache", default="response_cache.sqlite", help="Path of the response cache")
+    parser.add_argument("--no-cache", action="store_true", help="Always call the model")
+    parser.add_argument("--window-ms", type=float, default=5.0, help="Micro-batching window in milliseconds")
+    parser.add_argument("--max-batch", type=int, default=32, help="Maximum number of emails per micro-batch")
+    parser.add_argument("--resilient", action="store_true", help="Retry, hedge and circuit break the model calls")
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    configure_client_manager(
+        max_connections=args.pool_size,
+        max_keepalive_connections=args.pool_size,
+        timeout=args.timeout,
+        max_retries=0 if args.resilient else 2
+    )
+    engine = AsyncAnalysisEngine(
+        max_concurrency=args.concurrency,
+        requests_per_minute=args.rpm,
+        tokens_per_minute=args.tpm,
+        # A service sheds load rather than letting requests pile up behind a failing backend
+        resilience=ResilientCaller(breaker=CircuitBreaker(mode="shed")) if args.resilient else None
+    )
+    cache = None if args.no_cache else ResponseCache(args.cache)
+    service = AnalysisService(
+        load_prompt_template(args.prompt),
+        engine,
+        cache=cache,
+        window=args.window_ms / 1000,
+        max_batch=args.max_batch
+    )
+    try:
+        asyncio.run(service.serve_forever(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if cache is not None:
+            cache.close()
+
+
+if __name__ == "__main__":
+    main()
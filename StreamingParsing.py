@@ -0,0 +1,176 @@
+import json
+import re
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# Fields needed to route an email, generated first by the EmailAnalysis field order
+ROUTING_FIELDS = ("requires_immediate_attention", "primary_purpose", "sentiment.urgency")
+
+_STRING_STOP = re.compile(r'["\\]')
+_SCALAR_CHARS = re.compile(r'[-+0-9.eEa-z]*')
+_WHITESPACE = " \t\r\n"
+
+
+class _Frame:
+    __slots__ = ("container", "path", "key")
+
+    def __init__(self, container, path: str):
+        self.container = container
+        self.path = path
+        self.key = None
+
+
+class IncrementalJSONParser:
+    """
+    Parses a JSON document fed in arbitrary chunks, such as the content deltas of a streamed
+    completion, and reports every value as soon as it is complete. Each character is read
+    once, so the cost stays linear in the length of the response.
+    A number or literal is only complete once the character after it arrives, since "0.8" may
+    still become "0.85".
+    """
+
+    def __init__(self):
+        self.value = None
+        self.done = False
+        self._stack: List[_Frame] = []
+        self._buffer: List[str] = []
+        self._in_string = False
+        self._in_scalar = False
+        self._escaped = False
+        self._is_key = False
+
+    def _child_path(self, frame: Optional[_Frame]) -> str:
+        if frame is None:
+            return ""
+        key = frame.key if isinstance(frame.container, dict) else len(frame.container)
+        return f"{frame.path}.{key}" if frame.path else str(key)
+
+    def _complete(self, value: Any, completed: List[Tuple[str, Any]], path: Optional[str] = None):
+        parent = self._stack[-1] if self._stack else None
+        if path is None:
+            path = self._child_path(parent)
+        if parent is None:
+            self.value = value
+            self.done = True
+        elif isinstance(parent.container, dict):
+            parent.container[parent.key] = value
+            parent.key = None
+        else:
+            parent.container.append(value)
+        completed.append((path, value))
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """
+        Parse the next chunk of the document.
+
+        Args:
+            chunk: Next piece of the JSON text
+
+        Returns:
+            List[Tuple[str, Any]]: Values completed by this chunk with their dotted paths
+            (e.g. "sentiment.urgency", list items by index), innermost first
+
+        Raises:
+            ValueError: If the text is not valid JSON
+        """
+        completed: List[Tuple[str, Any]] = []
+        i, n = 0, len(chunk)
+        while i < n:
+            if self._in_string:
+                if self._escaped:
+                    self._buffer.append(chunk[i])
+                    self._escaped = False
+                    i += 1
+                    continue
+                match = _STRING_STOP.search(chunk, i)
+                if match is None:
+                    self._buffer.append(chunk[i:])
+                    break
+                self._buffer.append(chunk[i:match.start()])
+                i = match.end()
+                if match.group() == "\\":
+                    self._buffer.append("\\")
+                    self._escaped = True
+                    continue
+                self._in_string = False
+                text = json.loads('"' + "".join(self._buffer) + '"')
+                if self._is_key:
+                    self._stack[-1].key = text
+                else:
+                    self._complete(text, completed)
+                continue
+            if self._in_scalar:
+                match = _SCALAR_CHARS.match(chunk, i)
+                self._buffer.append(match.group())
+                i = match.end()
+                if i == n:
+                    break
+                self._in_scalar = False
+                self._complete(json.loads("".join(self._buffer)), completed)
+                continue
+
+            char = chunk[i]
+            i += 1
+            if char in _WHITESPACE or char == ":" or char == ",":
+                continue
+            if char == "{" or char == "[":
+                parent = self._stack[-1] if self._stack else None
+                self._stack.append(_Frame({} if char == "{" else [], self._child_path(parent)))
+            elif char == "}" or char == "]":
+                if not self._stack:
+                    raise ValueError(f"Unexpected {char!r} in JSON stream")
+                frame = self._stack.pop()
+                self._complete(frame.container, completed, frame.path)
+            elif char == '"':
+                self._in_string = True
+                self._buffer = []
+                top = self._stack[-1] if self._stack else None
+                self._is_key = top is not None and isinstance(top.container, dict) and top.key is None
+            else:
+                self._in_scalar = True
+                self._buffer = [char]
+        return completed
+
+
+class FieldWatcher:
+    """
+    Feeds streamed content deltas to an IncrementalJSONParser and calls `callback` once, with
+    the values of `fields`, as soon as all of them are complete. Parsing stops after that, the
+    full response is validated by the SDK when the stream ends.
+    """
+
+    def __init__(self, callback: Callable[[Dict[str, Any]], Any], fields: Iterable[str] = ROUTING_FIELDS):
+        self.callback = callback
+        self.fields = tuple(fields)
+        self.values: Dict[str, Any] = {}
+        self.fired = False
+        self._parser = IncrementalJSONParser()
+
+    def feed(self, delta: str) -> bool:
+        """
+        Parse the next content delta.
+
+        Returns:
+            bool: Whether the callback has been called
+        """
+        if self.fired:
+            return True
+        for path, value in self._parser.feed(delta):
+            if path in self.fields:
+                self.values[path] = value
+        if len(self.values) == len(self.fields):
+            self.fired = True
+            self.callback(dict(self.values))
+        return self.fired
+
+
+def needs_immediate_routing(values: Dict[str, Any]) -> bool:
+    """
+    Whether the routing fields of an email call for the emergency queue.
+
+    Args:
+        values: Values passed to a FieldWatcher callback for ROUTING_FIELDS
+
+    Returns:
+        bool: True for emails requiring immediate attention or with emergency urgency
+    """
+    return bool(values.get("requires_immediate_attention")) or values.get("sentiment.urgency") == "emergency"
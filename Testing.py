@@ -1,10 +1,173 @@
 from pydantic import BaseModel, EmailStr
 from enum import Enum
-from typing import List, Optional, Dict, Any, get_origin, get_args, Union, OrderedDict
+from typing import List, Optional, Dict, Any, Iterable, get_origin, get_args, Union, OrderedDict
 from datetime import datetime
-import csv
-import inspect
+import numpy as np
+import functools
 import json
+from itertools import chain
+from ResultsSink import BufferedResultsWriter, get_results_writer
+from EmailClass import EmailAnalysis
+
+# Placeholder for fields absent from a flattened JSON
+_MISSING = object()
+
+
+def _score_exact(pred_value: Any, true_value: Any) -> float:
+    if isinstance(true_value, datetime):
+        # Convert to timestamps and calculate difference-based accuracy
+        pred_ts = pred_value.timestamp()
+        true_ts = true_value.timestamp()
+        # Allow for 24-hour difference with linear penalty
+        max_diff = 86400  # 24 hours in seconds
+        diff = abs(pred_ts - true_ts)
+        return max(0.0, 1.0 - (diff / max_diff))
+    # Exact match for strings and other types
+    return 1.0 if pred_value == true_value else 0.0
+
+
+def _score_bool(pred_value: Any, true_value: Any) -> float:
+    return 1.0 if pred_value == true_value else 0.0
+
+
+def _score_number(pred_value: Any, true_value: Any) -> float:
+    # Normalize numerical differences
+    max_val = max(abs(pred_value), abs(true_value))
+    if max_val == 0:
+        return 1.0 if pred_value == true_value else 0.0
+    return max(0.0, 1.0 - abs(pred_value - true_value) / max_val)
+
+
+def _hashable(value: Any) -> Any:
+    # Nested objects (e.g. competitor mentions) are compared by their canonical JSON
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, sort_keys=True, default=str)
+    return value
+
+
+def _jaccard(pred_value: List, true_value: List) -> float:
+    pred_set = {_hashable(value) for value in pred_value}
+    true_set = {_hashable(value) for value in true_value}
+    return len(pred_set.intersection(true_set)) / len(pred_set.union(true_set))
+
+
+def _score_list(pred_value: Any, true_value: Any) -> float:
+    if not pred_value or not true_value:
+        return 1.0 if pred_value == true_value else 0.0
+    # Calculate Jaccard similarity for lists
+    return _jaccard(pred_value, true_value)
+
+
+def _penalty_step(enum_length: int) -> float:
+    # Accuracy lost per ordinal step between two values; a single-member enum has no steps
+    return 1.0 / (enum_length - 1) if enum_length > 1 else 1.0
+
+
+def _make_enum_scorer(ordinals: Dict[Any, int], penalty_step: float):
+    def score(pred_value: Any, true_value: Any) -> float:
+        if pred_value == true_value:
+            return 1.0
+        pred_idx = ordinals.get(pred_value)
+        true_idx = ordinals.get(true_value)
+        if pred_idx is None or true_idx is None:
+            return 0.0  # Invalid enum value
+        # Calculate distance-based penalty
+        return max(0.0, 1.0 - abs(pred_idx - true_idx) * penalty_step)
+    return score
+
+
+class ScoringPlan:
+    """
+    Scoring rules of a pydantic model, compiled once from its field annotations.
+    Maps every flattened field path to its type and a specialized scorer, and every
+    enum to a value -> ordinal lookup table used for soft accuracy.
+    """
+    
+    def __init__(self, model_class: type[BaseModel]):
+        self.model_class = model_class
+        self.field_types: Dict[str, type] = {}
+        self.soft_accuracy_fields: Dict[str, str] = {}
+        self.enum_lengths: Dict[str, int] = {}
+        self.enum_ordinals: Dict[str, Dict[Any, int]] = {}
+        self.scorers: Dict[str, Any] = {}
+        self._compile(model_class, "")
+    
+    @staticmethod
+    def _unwrap_optional(annotation: Any) -> Any:
+        if get_origin(annotation) is Union:
+            args = [arg for arg in get_args(annotation) if arg is not type(None)]
+            if len(args) == 1:
+                return args[0]
+        return annotation
+    
+    def _add_enum(self, enum_class: type[Enum]):
+        if enum_class.__name__ not in self.enum_ordinals:
+            members = list(enum_class)
+            ordinals = {}
+            for i, member in enumerate(members):
+                ordinals[member] = i
+                ordinals[member.value] = i
+            self.enum_ordinals[enum_class.__name__] = ordinals
+            self.enum_lengths[enum_class.__name__] = len(members)
+    
+    def _compile(self, model_class: type[BaseModel], parent_path: str):
+        for name, field_info in model_class.model_fields.items():
+            path = f"{parent_path}.{name}" if parent_path else name
+            annotation = self._unwrap_optional(field_info.annotation)
+            origin = get_origin(annotation)
+            
+            if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+                # Nested models are flattened into dot-notation paths
+                self._compile(annotation, path)
+            elif isinstance(annotation, type) and issubclass(annotation, Enum):
+                self._add_enum(annotation)
+                enum_type = annotation.__name__
+                self.soft_accuracy_fields[path] = enum_type
+                self.field_types[path] = str
+                penalty_step = _penalty_step(self.enum_lengths[enum_type])
+                self.scorers[path] = _make_enum_scorer(self.enum_ordinals[enum_type], penalty_step)
+            elif origin in (list, List) or annotation is list:
+                for arg in get_args(annotation):
+                    if isinstance(arg, type) and issubclass(arg, Enum):
+                        self._add_enum(arg)
+                self.field_types[path] = list
+                self.scorers[path] = _score_list
+            elif annotation is bool:
+                self.field_types[path] = bool
+                self.scorers[path] = _score_bool
+            elif annotation in (int, float):
+                self.field_types[path] = annotation
+                self.scorers[path] = _score_number
+            elif annotation is str:
+                self.field_types[path] = str
+                self.scorers[path] = _score_exact
+            elif origin in (dict, Dict) or annotation is dict:
+                self.field_types[path] = dict
+                self.scorers[path] = _score_exact
+            else:
+                self.field_types[path] = Any
+                self.scorers[path] = _score_exact
+    
+    def scorer(self, field_path: str):
+        """
+        Get the scorer for a field path; unknown paths use exact matching.
+        """
+        return self.scorers.get(field_path, _score_exact)
+
+
+@functools.lru_cache(maxsize=None)
+def compile_scoring_plan(model_class: type[BaseModel]) -> ScoringPlan:
+    """
+    Get the scoring plan of a model, compiled once and shared by every EmailAnalysisTesting.
+    
+    Args:
+        model_class: Pydantic model being scored
+        
+    Returns:
+        ScoringPlan: Compiled scoring plan
+    """
+    return ScoringPlan(model_class)
+
 
 class EmailAnalysisTesting:
     """
@@ -12,22 +175,27 @@ class EmailAnalysisTesting:
     Automatically parses model structure for type checking and enum handling.
     """
     
-    def __init__(self, model_class: type[BaseModel]):
+    def __init__(self, model_class: type[BaseModel], results_writer: Optional[BufferedResultsWriter] = None, log_results: bool = True):
         self.model_class = model_class
-        self.enum_lengths = self._get_enum_lengths()
-        self.soft_accuracy_fields = self._get_soft_accuracy_fields()
-        self.field_types = self._get_field_types()
+        self.results_writer = results_writer
+        self.log_results = log_results
+        self.scoring_plan = compile_scoring_plan(model_class)
+        self.enum_lengths = self.scoring_plan.enum_lengths
+        self.soft_accuracy_fields = self.scoring_plan.soft_accuracy_fields
+        self.field_types = self.scoring_plan.field_types
     
-    def _parse_json_input(self, json_input: Union[str, Dict]) -> Dict:
+    def _parse_json_input(self, json_input: Union[str, Dict, BaseModel]) -> Dict:
         """
-        Parse JSON input that could be either a string or dictionary.
+        Parse JSON input that could be a string, dictionary or validated model instance.
         
         Args:
-            json_input: JSON string or dictionary
+            json_input: JSON string, dictionary or pydantic model
             
         Returns:
             Dict: Parsed JSON dictionary
         """
+        if isinstance(json_input, BaseModel):
+            return json_input.model_dump(mode='json')
         if isinstance(json_input, str):
             try:
                 # Handle double-escaped JSON strings from CSV
@@ -44,98 +212,7 @@ class EmailAnalysisTesting:
         elif isinstance(json_input, dict):
             return json_input
         else:
-            raise ValueError(f"Input must be either a JSON string or dictionary, got {type(json_input)}")
-    
-    def _get_enum_lengths(self) -> Dict[str, int]:
-        """
-        Automatically discover all enums in the model and their lengths.
-        
-        Returns:
-            Dict[str, int]: Dictionary mapping enum class names to their lengths
-        """
-        enum_lengths = {}
-        
-        # Get all classes defined in the module
-        for name, obj in inspect.getmembers(self.model_class):
-            # Check nested classes
-            if inspect.isclass(obj):
-                # Look for enum classes
-                if isinstance(obj, type) and issubclass(obj, Enum):
-                    enum_lengths[obj.__name__] = len(list(obj))
-                
-        # Also check imported enums from model's annotations
-        for field_type in self.model_class.__annotations__.values():
-            if get_origin(field_type) is None:  # Direct type
-                if isinstance(field_type, type) and issubclass(field_type, Enum):
-                    enum_lengths[field_type.__name__] = len(list(field_type))
-            elif get_origin(field_type) in (list, Dict):  # Handle Optional/List/Dict
-                args = get_args(field_type)
-                for arg in args:
-                    if isinstance(arg, type) and issubclass(arg, Enum):
-                        enum_lengths[arg.__name__] = len(list(arg))
-        
-        return enum_lengths
-    
-    def _get_soft_accuracy_fields(self) -> Dict[str, str]:
-        """
-        Automatically identify fields that should use soft accuracy (enums).
-        
-        Returns:
-            Dict[str, str]: Dictionary mapping field paths to their enum types
-        """
-        soft_accuracy_fields = {}
-        schema = self.model_class.schema()
-        
-        def process_properties(properties: Dict, parent_path: str = ""):
-            for prop_name, prop_data in properties.items():
-                current_path = f"{parent_path}.{prop_name}" if parent_path else prop_name
-                
-                # Check if it's an enum reference
-                if "allOf" in prop_data and prop_data["allOf"][0].get("$ref", "").startswith("#/definitions/"):
-                    enum_type = prop_data["allOf"][0]["$ref"].split("/")[-1]
-                    if enum_type in self.enum_lengths:
-                        soft_accuracy_fields[current_path] = enum_type
-                
-                # Recursively process nested objects
-                if "properties" in prop_data:
-                    process_properties(prop_data["properties"], current_path)
-        
-        process_properties(schema.get("properties", {}))
-        return soft_accuracy_fields
-    
-    def _get_field_types(self) -> Dict[str, type]:
-        """
-        Get the types of all fields in the model.
-        
-        Returns:
-            Dict[str, type]: Dictionary mapping field paths to their types
-        """
-        field_types = {}
-        schema = self.model_class.schema()
-        
-        def process_properties(properties: Dict, parent_path: str = ""):
-            for prop_name, prop_data in properties.items():
-                current_path = f"{parent_path}.{prop_name}" if parent_path else prop_name
-                
-                # Map JSON schema types to Python types
-                type_mapping = {
-                    "string": str,
-                    "integer": int,
-                    "number": float,
-                    "boolean": bool,
-                    "array": list,
-                    "object": dict
-                }
-                
-                if "type" in prop_data:
-                    field_types[current_path] = type_mapping.get(prop_data["type"], Any)
-                
-                # Handle nested objects
-                if "properties" in prop_data:
-                    process_properties(prop_data["properties"], current_path)
-        
-        process_properties(schema.get("properties", {}))
-        return field_types
+            raise ValueError(f"Input must be a JSON string, dictionary or pydantic model, got {type(json_input)}")
     
     def calculate_soft_accuracy(self, pred_value: str, true_value: str, enum_type: str) -> float:
         """
@@ -152,24 +229,13 @@ class EmailAnalysisTesting:
         if pred_value == true_value:
             return 1.0
         
-        enum_length = self.enum_lengths[enum_type]
-        penalty_step = 1.0 / (enum_length - 1)
-        
-        # Get the enum class from the model
-        enum_class = None
-        for name, obj in inspect.getmembers(self.model_class):
-            if inspect.isclass(obj) and issubclass(obj, Enum) and obj.__name__ == enum_type:
-                enum_class = obj
-                break
-        
-        if enum_class is None:
-            raise ValueError(f"Enum class {enum_type} not found")
+        penalty_step = _penalty_step(self.enum_lengths[enum_type])
         
-        # Convert enum values to indices
-        try:
-            pred_idx = list(enum_class).index(enum_class(pred_value))
-            true_idx = list(enum_class).index(enum_class(true_value))
-        except ValueError:
+        # Convert enum values to indices with the precomputed lookup table
+        ordinals = self._enum_ordinals(enum_type)
+        pred_idx = ordinals.get(pred_value)
+        true_idx = ordinals.get(true_value)
+        if pred_idx is None or true_idx is None:
             return 0.0  # Invalid enum value
         
         # Calculate distance-based penalty
@@ -181,6 +247,8 @@ class EmailAnalysisTesting:
     def calculate_field_accuracy(self, pred_value: Any, true_value: Any, field_path: str) -> float:
         """
         Calculate accuracy for a single field, handling different types appropriately.
+        The scorer for each field path (enum distance, boolean, numeric, list Jaccard or
+        exact match) is looked up in the compiled scoring plan.
         
         Args:
             pred_value: Predicted value
@@ -196,47 +264,7 @@ class EmailAnalysisTesting:
         if pred_value is None or true_value is None:
             return 0.0
         
-        # Handle soft accuracy fields (enums)
-        if field_path in self.soft_accuracy_fields:
-            return self.calculate_soft_accuracy(
-                pred_value,
-                true_value,
-                self.soft_accuracy_fields[field_path]
-            )
-        
-        # Get expected type for the field
-        field_type = self.field_types.get(field_path, Any)
-        
-        # Handle different types
-        if field_type == bool:
-            return 1.0 if pred_value == true_value else 0.0
-        
-        if field_type in (int, float):
-            # Normalize numerical differences
-            max_val = max(abs(pred_value), abs(true_value))
-            if max_val == 0:
-                return 1.0 if pred_value == true_value else 0.0
-            return max(0.0, 1.0 - abs(pred_value - true_value) / max_val)
-        
-        if isinstance(true_value, datetime):
-            # Convert to timestamps and calculate difference-based accuracy
-            pred_ts = pred_value.timestamp()
-            true_ts = true_value.timestamp()
-            # Allow for 24-hour difference with linear penalty
-            max_diff = 86400  # 24 hours in seconds
-            diff = abs(pred_ts - true_ts)
-            return max(0.0, 1.0 - (diff / max_diff))
-        
-        if field_type == list:
-            if not pred_value or not true_value:
-                return 1.0 if pred_value == true_value else 0.0
-            # Calculate Jaccard similarity for lists
-            pred_set = set(pred_value)
-            true_set = set(true_value)
-            return len(pred_set.intersection(true_set)) / len(pred_set.union(true_set))
-        
-        # Default to exact match for strings and other types
-        return 1.0 if pred_value == true_value else 0.0
+        return self.scoring_plan.scorer(field_path)(pred_value, true_value)
     
     def flatten_dict(self, d: Dict, parent_key: str = '', sep: str = '.') -> Dict:
         """
@@ -250,34 +278,44 @@ class EmailAnalysisTesting:
         Returns:
             Dict: Flattened dictionary
         """
-        items = []
+        flat = {}
+        self._flatten_into(d, parent_key, sep, flat)
+        return flat
+    
+    def _flatten_into(self, d: Dict, parent_key: str, sep: str, flat: Dict):
+        # Writes straight into one output dict instead of rebuilding a dict per nesting level
         for k, v in d.items():
             new_key = f"{parent_key}{sep}{k}" if parent_key else k
             if isinstance(v, dict):
-                items.extend(self.flatten_dict(v, new_key, sep=sep).items())
+                self._flatten_into(v, new_key, sep, flat)
             else:
-                items.append((new_key, v))
-        return dict(items)
+                flat[new_key] = v
     
-    def calculate_accuracy(self, predicted_json: Dict, ground_truth_json: Dict, save_path: str = "accuracy_results.json"):
+    def calculate_accuracy(self, predicted_json: Dict, ground_truth_json: Dict, save_path: str = "accuracy_results.json", fields: Optional[Iterable[str]] = None,
+                           log: bool = True):
         """
         Calculate accuracy metrics between predicted and ground truth JSONs.
         
         Args:
             predicted_json: Predicted EmailAnalysis JSON
             ground_truth_json: Ground truth EmailAnalysis JSON
+            fields: Only score these field paths or top-level fields, for predictions that cover
+                part of the schema. Defaults to the fields of a schema profile (see SchemaProfiles.py)
+                when the prediction is an instance of one
+            log: Queue the results for the results writer (when `log_results` is set); off for
+                emails whose accuracy was already logged, e.g. by the run being resumed
             
         Returns:
             Dict[str, float]: Dictionary containing overall and field-wise accuracy scores
         """
 
+        if fields is None and isinstance(predicted_json, BaseModel) and not isinstance(predicted_json, self.model_class):
+            fields = type(predicted_json).model_fields
+        
         # Parse inputs to ensure we have dictionaries
         try:
-            print('parsing inputs')
             pred_dict = self._parse_json_input(predicted_json)
-            print('predicted json ok')
             truth_dict = self._parse_json_input(ground_truth_json)
-            print('truth json ok')
         except ValueError as e:
             raise ValueError(f"Error parsing JSON input: {e}")
 
@@ -285,6 +323,13 @@ class EmailAnalysisTesting:
         pred_flat = self.flatten_dict(pred_dict)
         true_flat = self.flatten_dict(truth_dict)
         
+        if fields is not None:
+            fields = set(fields)
+            true_flat = {
+                field: value for field, value in true_flat.items()
+                if field in fields or field.split('.', 1)[0] in fields
+            }
+        
         # Calculate field-wise accuracy
         field_accuracies = {}
         for field in true_flat:
@@ -298,7 +343,7 @@ class EmailAnalysisTesting:
                 field_accuracies[field] = 0.0
         
         # Calculate overall accuracy
-        overall_accuracy = sum(field_accuracies.values()) / len(field_accuracies)
+        overall_accuracy = sum(field_accuracies.values()) / len(field_accuracies) if field_accuracies else 0.0
         
         # Organize results in a nicely formatted dictionary for visualization
         results = {
@@ -307,14 +352,317 @@ class EmailAnalysisTesting:
             "field_accuracies": field_accuracies
         }
 
-        # Save results to a JSON file
-        results_json = json.dumps(results)
-
-        # Append the JSON string as a new row in the CSV
-        with open('Results.csv', mode='a', newline='') as csv_file:
-            writer = csv.writer(csv_file)
-            writer.writerow([results_json])  # Each row is a single-column JSON entry
+        # Queue the results for the background writer, which appends them to Results.csv
+        if self.log_results and log:
+            if self.results_writer is None:
+                self.results_writer = get_results_writer()
+            self.results_writer.write(results)
 
         return results
 
-        ## We can add more metrics like llm evaluation and a reasoning. This reasoning may help identify the cause of the error and improvements.
\ No newline at end of file
+        ## We can add more metrics like llm evaluation and a reasoning. This reasoning may help identify the cause of the error and improvements.
+    
+    def _enum_ordinals(self, enum_type: str) -> Dict[Any, int]:
+        """
+        Map the values of an enum to their position, for soft accuracy.
+        
+        Args:
+            enum_type: Name of the enum class
+            
+        Returns:
+            Dict[Any, int]: Enum value to ordinal
+        """
+        if enum_type not in self.scoring_plan.enum_ordinals:
+            raise ValueError(f"Enum class {enum_type} not found")
+        return self.scoring_plan.enum_ordinals[enum_type]
+    
+    def _score_column(self, field_path: str, pred: np.ndarray, true: np.ndarray) -> np.ndarray:
+        """
+        Score one field for every email at once, with the same rules as `calculate_field_accuracy`.
+        
+        Args:
+            field_path: Path to the field in dot notation
+            pred: Object array of predicted values, one per email
+            true: Object array of ground truth values, one per email
+            
+        Returns:
+            np.ndarray: Accuracy score between 0 and 1 per email
+        """
+        n = len(true)
+        pred_none = np.equal(pred, None)
+        true_none = np.equal(true, None)
+        scores = np.zeros(n)
+        scores[pred_none & true_none] = 1.0
+        valid = ~(pred_none | true_none)
+        if not valid.any():
+            return scores
+        pred, true = pred[valid], true[valid]
+        
+        field_type = self.field_types.get(field_path, Any)
+        if field_path in self.soft_accuracy_fields:
+            enum_type = self.soft_accuracy_fields[field_path]
+            ordinals = self._enum_ordinals(enum_type)
+            penalty_step = _penalty_step(self.enum_lengths[enum_type])
+            pred_idx = np.array([ordinals.get(value, -1) for value in pred])
+            true_idx = np.array([ordinals.get(value, -1) for value in true])
+            column = np.maximum(0.0, 1.0 - np.abs(pred_idx - true_idx) * penalty_step)
+            column[(pred_idx < 0) | (true_idx < 0)] = 0.0
+            column[(pred == true).astype(bool)] = 1.0
+        elif field_type in (int, float):
+            value_types = set(map(type, pred)) | set(map(type, true))
+            if not value_types <= {int, float, bool}:
+                column = self._score_column_scalar(field_path, pred, true)
+            else:
+                pred_num = pred.astype(float)
+                true_num = true.astype(float)
+                max_val = np.maximum(np.abs(pred_num), np.abs(true_num))
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    column = np.maximum(0.0, 1.0 - np.abs(pred_num - true_num) / max_val)
+                zero = max_val == 0
+                column[zero] = (pred_num[zero] == true_num[zero]).astype(float)
+        elif field_type == list:
+            column = np.array([
+                _jaccard(p, t) if p and t else float(p == t)
+                for p, t in zip(pred, true)
+            ])
+        elif any(issubclass(value_type, datetime) for value_type in set(map(type, true))):
+            column = self._score_column_scalar(field_path, pred, true)
+        else:
+            column = (pred == true).astype(float)
+        
+        scores[valid] = column
+        return scores
+    
+    def _score_column_scalar(self, field_path: str, pred: np.ndarray, true: np.ndarray) -> np.ndarray:
+        return np.array([self.calculate_field_accuracy(p, t, field_path) for p, t in zip(pred, true)])
+    
+    def _flatten_columns(self, pred_level: List[Any], true_level: List[Any], parent_key: str = '', sep: str = '.'):
+        """
+        Flatten many JSONs straight into columns, with the same field paths as `flatten_dict`.
+        Each nesting level is processed for all rows at once instead of flattening row by row.
+        
+        Args:
+            pred_level: Predicted values at this nesting level, one per email
+            true_level: Ground truth values at this nesting level, one per email
+            parent_key: Field path of this level
+            sep: Separator for nested keys
+            
+        Yields:
+            Tuple: Field path, predicted column and ground truth column, with `_MISSING` where absent
+        """
+        true_dicts = [value for value in true_level if isinstance(value, dict)]
+        # Keys in order of first appearance in the ground truth
+        for key in dict.fromkeys(chain.from_iterable(true_dicts)):
+            field = f"{parent_key}{sep}{key}" if parent_key else key
+            true_values = [value.get(key, _MISSING) if isinstance(value, dict) else _MISSING for value in true_level]
+            pred_values = [value.get(key, _MISSING) if isinstance(value, dict) else _MISSING for value in pred_level]
+            nested = [isinstance(value, dict) for value in true_values]
+            if not any(nested):
+                yield field, [_MISSING if isinstance(value, dict) else value for value in pred_values], true_values
+                continue
+            # Emails where the value is a leaf are scored under this path, nested dicts are expanded
+            if not all(nested):
+                yield (
+                    field,
+                    [_MISSING if isinstance(value, dict) else value for value in pred_values],
+                    [_MISSING if is_nested else value for value, is_nested in zip(true_values, nested)]
+                )
+            yield from self._flatten_columns(pred_values, true_values, field, sep)
+    
+    def calculate_batch_accuracy(self, predicted_jsons: List[Any], ground_truth_jsons: List[Any]) -> Dict:
+        """
+        Calculate accuracy metrics for many predictions at once.
+        Predictions and ground truths are flattened into one column per field path and each
+        column is scored with NumPy in a single pass. Scores match `calculate_accuracy`;
+        per-email results are not written to the results CSV.
+        
+        Args:
+            predicted_jsons: Predicted EmailAnalysis JSONs
+            ground_truth_jsons: Ground truth EmailAnalysis JSONs, in the same order
+            
+        Returns:
+            Dict: Number of emails, average overall and field-wise accuracies, and the
+            overall accuracy of every email under `row_accuracies`
+        """
+        if len(predicted_jsons) != len(ground_truth_jsons):
+            raise ValueError("Predictions and ground truths must have the same length")
+        n = len(ground_truth_jsons)
+        if n == 0:
+            return {"count": 0, "overall_accuracy": 0.0, "field_accuracies": {}, "row_accuracies": np.zeros(0)}
+        fields, scores, present = self._score_batch(predicted_jsons, ground_truth_jsons)
+        row_accuracies = scores.sum(axis=1) / present.sum(axis=1)
+        field_accuracies = scores.sum(axis=0) / present.sum(axis=0)
+        return {
+            "count": n,
+            "overall_accuracy": float(row_accuracies.mean()),
+            "field_accuracies": {field: float(accuracy) for field, accuracy in zip(fields, field_accuracies)},
+            "row_accuracies": row_accuracies
+        }
+    
+    def calculate_batch_aggregate(self, predicted_jsons: List[Any], ground_truth_jsons: List[Any]) -> "AccuracyAggregate":
+        """
+        Score many predictions at once like `calculate_batch_accuracy`, returning running sums
+        instead of averages so results from separate chunks can be merged.
+        
+        Args:
+            predicted_jsons: Predicted EmailAnalysis JSONs
+            ground_truth_jsons: Ground truth EmailAnalysis JSONs, in the same order
+            
+        Returns:
+            AccuracyAggregate: Sums of the overall and field-wise accuracies
+        """
+        aggregate = AccuracyAggregate()
+        if not ground_truth_jsons and not predicted_jsons:
+            return aggregate
+        fields, scores, present = self._score_batch(predicted_jsons, ground_truth_jsons)
+        aggregate.count = len(ground_truth_jsons)
+        aggregate.overall_sum = float((scores.sum(axis=1) / present.sum(axis=1)).sum())
+        for field, total, counted in zip(fields, scores.sum(axis=0), present.sum(axis=0)):
+            aggregate.field_sums[field] = float(total)
+            aggregate.field_counts[field] = int(counted)
+        return aggregate
+    
+    def _score_batch(self, predicted_jsons: List[Any], ground_truth_jsons: List[Any]):
+        """
+        Score matrix of a batch: one row per email and one column per field path, with a mask of
+        the fields present in each ground truth.
+        """
+        if len(predicted_jsons) != len(ground_truth_jsons):
+            raise ValueError("Predictions and ground truths must have the same length")
+        n = len(ground_truth_jsons)
+        try:
+            pred_rows = [self._parse_json_input(pred) for pred in predicted_jsons]
+            true_rows = [self._parse_json_input(truth) for truth in ground_truth_jsons]
+        except ValueError as e:
+            raise ValueError(f"Error parsing JSON input: {e}")
+        
+        columns = list(self._flatten_columns(pred_rows, true_rows))
+        fields = [field for field, _, _ in columns]
+        scores = np.zeros((n, len(columns)))
+        present = np.zeros((n, len(columns)), dtype=bool)
+        for j, (field, pred_values, true_values) in enumerate(columns):
+            pred_column = np.fromiter(pred_values, dtype=object, count=n)
+            true_column = np.fromiter(true_values, dtype=object, count=n)
+            present[:, j] = [value is not _MISSING for value in true_values]
+            # A field missing from the prediction scores 0
+            scored = present[:, j] & np.array([value is not _MISSING for value in pred_values])
+            if scored.all():
+                scores[:, j] = self._score_column(field, pred_column, true_column)
+            elif scored.any():
+                scores[scored, j] = self._score_column(field, pred_column[scored], true_column[scored])
+        return fields, scores, present
+
+class AccuracyAggregate:
+    """
+    Running sums of accuracy results, so large runs can be summarized in constant memory.
+    Aggregates built from different chunks of a run can be merged.
+    """
+    
+    def __init__(self):
+        self.count = 0
+        self.overall_sum = 0.0
+        self.field_sums = {}
+        self.field_counts = {}
+    
+    def add(self, accuracy_results: Dict):
+        """
+        Add the result of `calculate_accuracy` for one email.
+        
+        Args:
+            accuracy_results: Dictionary with overall and field-wise accuracy scores
+        """
+        self.count += 1
+        self.overall_sum += accuracy_results['overall_accuracy']
+        for field, accuracy in accuracy_results['field_accuracies'].items():
+            self.field_sums[field] = self.field_sums.get(field, 0.0) + accuracy
+            self.field_counts[field] = self.field_counts.get(field, 0) + 1
+    
+    def merge(self, other: "AccuracyAggregate") -> "AccuracyAggregate":
+        """
+        Add the sums of another aggregate into this one.
+        
+        Args:
+            other: Aggregate to merge
+            
+        Returns:
+            AccuracyAggregate: This aggregate
+        """
+        self.count += other.count
+        self.overall_sum += other.overall_sum
+        for field, total in other.field_sums.items():
+            self.field_sums[field] = self.field_sums.get(field, 0.0) + total
+            self.field_counts[field] = self.field_counts.get(field, 0) + other.field_counts[field]
+        return self
+    
+    def summary(self) -> Dict:
+        """
+        Average accuracies over every added email.
+        
+        Returns:
+            Dict: Number of emails, overall average accuracy and field-wise average accuracies
+        """
+        return {
+            "count": self.count,
+            "overall_accuracy": self.overall_sum / self.count if self.count else 0.0,
+            "field_accuracies": {
+                field: total / self.field_counts[field]
+                for field, total in self.field_sums.items()
+            }
+        }
+
+
+def report_accuracy(summary):
+    """
+    Print an accuracy summary produced by AccuracyAggregate.
+    """
+    print(f"\nBatch Testing Results:")
+    print(f"Overall Average Accuracy: {summary['overall_accuracy']:.2%}")
+    print("\nField-wise Average Accuracies:")
+    for field, accuracy in summary['field_accuracies'].items():
+        print(f"{field}: {accuracy:.2%}")
+
+
+def batch_testing(predictions, ground_truths, vectorized = False, workers = None, chunk_size = 500):
+    """
+    Test multiple predictions against their ground truths
+    
+    Args:
+        predictions: List of prediction JSONs
+        ground_truths: List of ground truth JSONs
+        vectorized: Score all pairs at once with NumPy, without logging every pair to Results.csv
+        workers: Score chunks of pairs in this many processes, without logging every pair to Results.csv
+        chunk_size: Number of pairs sent to a worker process at a time
+        
+    Returns:
+        Dict: Overall and field-wise average accuracies
+    """
+    if workers is not None and workers > 1:
+        # Imported here because the parallel scorer itself imports this module
+        from ParallelScoring import parallel_batch_accuracy
+        summary = parallel_batch_accuracy(
+            predictions,
+            ground_truths,
+            EmailAnalysis,
+            workers=workers,
+            chunk_size=chunk_size,
+            vectorized=vectorized
+        )
+        report_accuracy(summary)
+        return summary
+    
+    tester = EmailAnalysisTesting(EmailAnalysis)
+    
+    if vectorized:
+        summary = tester.calculate_batch_accuracy(predictions, ground_truths)
+        report_accuracy(summary)
+        return summary
+    
+    # Calculate accuracy for each pair and keep running averages
+    aggregate = AccuracyAggregate()
+    for pred, truth in zip(predictions, ground_truths):
+        accuracy_results = tester.calculate_accuracy(pred, truth)
+        aggregate.add(accuracy_results)
+    
+    summary = aggregate.summary()
+    report_accuracy(summary)
+    return summary
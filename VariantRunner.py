@@ -0,0 +1,237 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+
+from AnalysisEngine import AsyncAnalysisEngine, DEFAULT_MODEL
+from EmailClass import EmailAnalysis
+from ModelClient import configure_client_manager
+from Pipeline import iter_dataset_rows
+from Preprocessing import EmailPreprocessor
+from PromptTemplate import Messages, PromptTemplate, load_prompt_template
+from ResponseCache import CacheMissError, ResponseCache
+from ResponseParsing import get_validator, parse_openai_email_analysis
+from Testing import AccuracyAggregate, EmailAnalysisTesting
+
+
+@dataclass
+class Variant:
+    """
+    One prompt/model combination under test.
+    """
+    name: str
+    template: PromptTemplate
+    model: str = DEFAULT_MODEL
+    preprocessor: Optional[EmailPreprocessor] = None
+    analyses: List[Any] = field(default_factory=list)
+    failed: int = 0
+    summary: Optional[Dict] = None
+
+
+class VariantRunner:
+    """
+    Evaluates several prompt/model variants over the same dataset in a single run.
+    The dataset is read and its ground truths parsed once. Every variant x email call goes
+    through one shared AsyncAnalysisEngine, so the variants share the concurrency pool and
+    rate limits, and identical rendered prompts for the same model are only sent once. Email
+    bodies are cleaned once per preprocessor configuration, however many variants share it.
+    """
+
+    def __init__(
+        self,
+        variants: Sequence[Variant],
+        engine: AsyncAnalysisEngine,
+        tester: Optional[EmailAnalysisTesting] = None,
+        cache: Optional[ResponseCache] = None,
+    ):
+        self.variants = list(variants)
+        self.engine = engine
+        self.tester = tester or EmailAnalysisTesting(engine.schema, log_results=False)
+        self.cache = cache
+        self.requests = 0
+        self.deduplicated = 0
+        self._calls: Dict[str, asyncio.Future] = {}
+        self._cleaned: Dict[Tuple[Tuple, int], str] = {}
+
+    async def _analyze(self, messages: Messages, model: str) -> Any:
+        key = ResponseCache.make_key(messages, model, self.engine.schema)
+        call = self._calls.get(key)
+        if call is not None:
+            self.deduplicated += 1
+            return await call
+        call = asyncio.ensure_future(self._fetch(key, messages, model))
+        self._calls[key] = call
+        return await call
+
+    async def _fetch(self, key: str, messages: Messages, model: str) -> Any:
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return get_validator(self.engine.schema).validate_python(cached)
+            if self.cache.cache_only:
+                raise CacheMissError("Prompt is not in the response cache")
+        self.requests += 1
+        response = await self.engine.analyze(messages, model=model)
+        analysis = parse_openai_email_analysis(response, self.engine.schema)
+        if self.cache is not None:
+            self.cache.set(key, analysis.model_dump(mode='json'), model)
+        return analysis
+
+    async def _run_variant(self, variant: Variant, rows: List[Dict[str, str]]):
+        calls = []
+        for index, row in enumerate(rows):
+            email_body = row['EmailBody']
+            if variant.preprocessor is not None:
+                key = (variant.preprocessor.config, index)
+                if key not in self._cleaned:
+                    self._cleaned[key] = variant.preprocessor.clean(email_body).text
+                email_body = self._cleaned[key]
+            messages = variant.template.render(
+                subject=row['Subject'],
+                sender_email=row['Sender'],
+                recipient_email=row['Recipients'],
+                email_body=email_body
+            )
+            calls.append(self._analyze(messages, variant.model))
+        variant.analyses = await asyncio.gather(*calls, return_exceptions=True)
+
+    async def run(self, rows: Sequence[Dict[str, str]]) -> List[Variant]:
+        """
+        Analyze and score every row with every variant.
+
+        Args:
+            rows: Dataset rows, e.g. from `iter_dataset_rows`
+
+        Returns:
+            List[Variant]: The variants, with their analyses and accuracy summaries filled in
+        """
+        rows = list(rows)
+        ground_truths = [self.tester._parse_json_input(json.loads(row['GroundTruth'])) for row in rows]
+        self._calls = {}
+        self._cleaned = {}
+        try:
+            await asyncio.gather(*(self._run_variant(variant, rows) for variant in self.variants))
+        finally:
+            await self.engine.aclose()
+
+        for variant in self.variants:
+            scored = [
+                (analysis, truth) for analysis, truth in zip(variant.analyses, ground_truths)
+                if not isinstance(analysis, BaseException)
+            ]
+            variant.failed = len(rows) - len(scored)
+            if scored:
+                aggregate = self.tester.calculate_batch_aggregate(*map(list, zip(*scored)))
+            else:
+                aggregate = AccuracyAggregate()
+            variant.summary = aggregate.summary()
+        return self.variants
+
+
+def format_comparison(variants: Sequence[Variant]) -> str:
+    """
+    Side-by-side table of the overall and field-wise accuracies of every variant.
+
+    Args:
+        variants: Variants returned by `VariantRunner.run`
+
+    Returns:
+        str: Plain-text table with one column per variant
+    """
+    fields = []
+    for variant in variants:
+        for field_name in variant.summary['field_accuracies']:
+            if field_name not in fields:
+                fields.append(field_name)
+    label_width = max([len("overall"), len("failed")] + [len(field_name) for field_name in fields])
+    widths = [max(len(variant.name), 8) for variant in variants]
+
+    def line(label, cells):
+        return "  ".join([label.ljust(label_width)] + [cell.rjust(width) for cell, width in zip(cells, widths)])
+
+    lines = [line("", [variant.name for variant in variants])]
+    lines.append(line("overall", [f"{variant.summary['overall_accuracy']:.2%}" for variant in variants]))
+    lines.append(line("failed", [str(variant.failed) for variant in variants]))
+    for field_name in fields:
+        cells = []
+        for variant in variants:
+            accuracy = variant.summary['field_accuracies'].get(field_name)
+            cells.append("-" if accuracy is None else f"{accuracy:.2%}")
+        lines.append(line(field_name, cells))
+    return "\n".join(lines)
+
+
+def build_variants(
+    prompt_paths: Sequence[str],
+    models: Sequence[str],
+    preprocessors: Optional[Dict[str, Optional[EmailPreprocessor]]] = None,
+) -> List[Variant]:
+    """
+    One variant per prompt file, model and preprocessing combination.
+
+    Args:
+        prompt_paths: Markdown prompt templates
+        models: Model names
+        preprocessors: Email body preprocessors by name, None entries meaning the raw body
+
+    Returns:
+        List[Variant]: Variants named after the prompt file, and the model and preprocessing when several are compared
+    """
+    preprocessors = preprocessors or {"": None}
+    variants = []
+    for path in prompt_paths:
+        template = load_prompt_template(path)
+        for model in models:
+            for preprocessing, preprocessor in preprocessors.items():
+                name = path if len(models) == 1 else f"{path}@{model}"
+                if len(preprocessors) > 1:
+                    name = f"{name}+{preprocessing}"
+                variants.append(Variant(name=name, template=template, model=model, preprocessor=preprocessor))
+    return variants
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare prompt/model variants over the email dataset")
+    parser.add_argument("--prompt", action="append", help="Prompt template to compare, can be repeated")
+    parser.add_argument("--model", action="append", help="Model to compare, can be repeated")
+    parser.add_argument("--dataset", default="AcaiEmailsDataset.csv")
+    parser.add_argument("--compare-preprocessing", action="store_true", help="Run every variant on raw and on preprocessed email bodies")
+    parser.add_argument("--max-body-tokens", type=int, default=None, help="Token budget of the preprocessed email bodies")
+    parser.add_argument("--concurrency", type=int, default=8, help="Maximum number of model requests in flight")
+    parser.add_argument("--rpm", type=int, default=None, help="Requests-per-minute budget")
+    parser.add_argument("--tpm", type=int, default=None, help="Tokens-per-minute budget")
+    parser.add_argument("--cache", default="response_cache.sqlite", help="SQLite response cache file")
+    parser.add_argument("--no-cache", action="store_true", help="Always call the model")
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    configure_client_manager(api_key=os.getenv('OPENAI_API_KEY'))
+    preprocessors = None
+    if args.compare_preprocessing:
+        preprocessors = {"raw": None, "preprocessed": EmailPreprocessor(args.max_body_tokens)}
+    variants = build_variants(args.prompt or ["Prompt.md"], args.model or [DEFAULT_MODEL], preprocessors)
+    cache = None if args.no_cache else ResponseCache(args.cache)
+    engine = AsyncAnalysisEngine(
+        schema=EmailAnalysis,
+        max_concurrency=args.concurrency,
+        requests_per_minute=args.rpm,
+        tokens_per_minute=args.tpm
+    )
+    runner = VariantRunner(variants, engine, cache=cache)
+
+    start = time.perf_counter()
+    asyncio.run(runner.run(iter_dataset_rows(args.dataset)))
+    print(f"Evaluated {len(variants)} variants in {time.perf_counter() - start:.2f}s: "
+          f"{runner.requests} model calls, {runner.deduplicated} duplicate prompts shared")
+    print(format_comparison(variants))
+    if cache is not None:
+        cache.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,103 +1,154 @@
 import openai
 import pydantic
 from EmailClass import EmailAnalysis
+from AnalysisEngine import AsyncAnalysisEngine, DEFAULT_MODEL, ensure_no_running_loop
+from ModelClient import configure_client_manager, get_client_manager
+from ResponseCache import ResponseCache, CacheMissError
+from PromptTemplate import load_prompt_template, to_messages
+from ResponseParsing import get_validator, parse_openai_email_analysis
+from Pipeline import EvaluationPipeline, iter_dataset_rows
+from ResultsSink import get_results_writer
+from RunJournal import RunJournal
+from AdaptiveSampling import AdaptiveSampler, load_baseline
+from Metrics import InMemoryMetrics, get_metrics
+from Preprocessing import EmailPreprocessor
+from NearDuplicates import NearDuplicateIndex
+from FastTriage import FastTriageModel, TriageCascade
+from SchemaProfiles import SECTIONS, SectionedAnalyzer, get_profile
+from StreamingParsing import FieldWatcher, needs_immediate_routing
+from Scheduling import PriorityScheduler
+from Resilience import BREAKER_MODES, CircuitBreaker, ResilientCaller, RetryPolicy
+from ColumnarStore import ColumnarResultsStore
 from dotenv import load_dotenv
 import os
-from Testing import EmailAnalysisTesting
-import pandas as pd
+from Testing import EmailAnalysisTesting, AccuracyAggregate, batch_testing, report_accuracy
 from openai import OpenAI
 import json
-import re
 import csv
-def parse_openai_email_analysis(api_response: str):
+import argparse
+import asyncio
+import time
+def call_model(prompt, schema = EmailAnalysis, client = None, on_routing = None, resilience = None):
+    # Reuse the pooled client so every email does not pay for a new connection
+    if client is None:
+        client = get_client_manager().get_client()
+    routed = []
+
+    def route_once(values):
+        # A retried attempt streams the routing fields again
+        if not routed:
+            routed.append(values)
+            on_routing(values)
+
+    def attempt():
+        if on_routing is not None:
+            # Stream the completion so the routing fields can be acted on before the rest is generated
+            watcher = FieldWatcher(route_once)
+            with client.beta.chat.completions.stream(
+                model=DEFAULT_MODEL,
+                messages=to_messages(prompt),
+                response_format=schema
+            ) as stream:
+                for event in stream:
+                    if event.type == "content.delta":
+                        watcher.feed(event.delta)
+                return stream.get_final_completion()
+        return client.beta.chat.completions.parse(
+            model=DEFAULT_MODEL,
+            messages=to_messages(prompt),
+            response_format=schema
+        )
+
+    if resilience is not None:
+        # Retried and circuit broken like the pipeline's calls; not hedged, the client is synchronous
+        return resilience.call_sync(attempt)
+    return attempt()
+
+def batch_call_model(prompts, schema = EmailAnalysis, max_concurrency = 8, requests_per_minute = None, tokens_per_minute = None, client = None, model = DEFAULT_MODEL):
     """
-    Parse the OpenAI API response string and extract the email analysis JSON.
+    Call the model for every rendered prompt concurrently. This runs its own event loop;
+    async code awaits `AsyncAnalysisEngine.analyze_batch` instead.
     
     Args:
-        api_response (str): The full response string from OpenAI's chat completion API
+        prompts: List of rendered prompts (messages), one per email
+        schema: Structured output schema
+        max_concurrency: Maximum number of requests in flight
+        requests_per_minute: Optional requests-per-minute budget
+        tokens_per_minute: Optional tokens-per-minute budget
+        client: Optional AsyncOpenAI client, defaults to the pooled client of the event loop
+        model: Model name
         
     Returns:
-        dict: The parsed email analysis JSON object
+        list: Responses in the same order as `prompts`
         
     Raises:
-        ValueError: If no valid JSON is found in the content
-        json.JSONDecodeError: If the extracted JSON is invalid
+        RuntimeError: If called from a running event loop
     """
-    try:
-        content_match = re.search(r"content='(\{.*?\})'", api_response, re.DOTALL)
-        
-        if not content_match:
-            raise ValueError("Could not find JSON content in API response")
-            
-        # Extract the content (which contains our JSON)
-        content = content_match.group(1)
-        
-        # Clean up the content
-        # Replace any escaped characters
-        content = content.replace('\\n', '\n')
-        content = content.replace('\\"', '"')
-        content = content.replace('\\\\', '\\')
-        
-        # Parse the JSON string
-        email_analysis = json.loads(content)
-        
-        return email_analysis
-    except (json.JSONDecodeError, AttributeError) as e:
-        raise ValueError(f"Failed to parse email analysis JSON: {str(e)}")
-
-def call_model(prompt, schema = EmailAnalysis ):
-    client = OpenAI(
-        # api_key= Insert your API key here
-    ) 
-    # I had problems getting os.getenv to work with the API key so I just hardcoded it in here.
-    response = client.beta.chat.completions.parse(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": prompt}
-        ],
-        response_format=schema
-    
+    ensure_no_running_loop("batch_call_model", "AsyncAnalysisEngine.analyze_batch")
+    engine = AsyncAnalysisEngine(
+        client=client,
+        model=model,
+        schema=schema,
+        max_concurrency=max_concurrency,
+        requests_per_minute=requests_per_minute,
+        tokens_per_minute=tokens_per_minute
     )
-    return response
-
-def batch_call_model(prompt, emails):
-    responses = []
-    for email in emails:
-        responses.append(call_model(prompt))
+    responses = engine.run_batch(prompts)
+    report_engine_stats(engine)
     return responses
 
-def batch_testing(predictions, ground_truths):
+def report_engine_stats(engine):
+    """
+    Print the model latency and prompt caching statistics of an AsyncAnalysisEngine.
     """
-    Test multiple predictions against their ground truths
+    if engine.calls:
+        average_latency = engine.total_latency / engine.calls
+        print(f"Model latency: {average_latency * 1000:.0f} ms per email over {engine.calls} calls")
+    if engine.prompt_tokens:
+        uncached_tokens = engine.prompt_tokens - engine.cached_prompt_tokens
+        print(f"Prompt tokens: {engine.cached_prompt_tokens} cached, {uncached_tokens} uncached "
+              f"({engine.cached_prompt_tokens / engine.prompt_tokens:.1%} cached)")
+
+def analyze_emails(prompts, cache = None, schema = EmailAnalysis, model = DEFAULT_MODEL, **batch_kwargs):
+    """
+    Get the parsed analysis for every prompt, reading through the response cache.
+    Only prompts missing from the cache are sent to the model, and their analyses are stored.
     
     Args:
-        predictions: List of prediction JSONs
-        ground_truths: List of ground truth JSONs
+        prompts: List of rendered prompts (messages), one per email
+        cache: Optional ResponseCache
+        schema: Structured output schema
+        model: Model name
+        **batch_kwargs: Extra arguments for batch_call_model
+        
+    Returns:
+        list: Validated analyses in the same order as `prompts`
+        
+    Raises:
+        CacheMissError: If the cache is in cache-only mode and a prompt is not cached
     """
-    tester = EmailAnalysisTesting(EmailAnalysis)
+    analyses = [None] * len(prompts)
+    keys = [None] * len(prompts)
+    missing = []
+    for i, prompt in enumerate(prompts):
+        if cache is not None:
+            keys[i] = cache.make_key(prompt, model, schema)
+            cached = cache.get(keys[i])
+            if cached is not None:
+                analyses[i] = get_validator(schema).validate_python(cached)
+        if analyses[i] is None:
+            missing.append(i)
     
-    # Calculate accuracy for each pair
-    all_accuracies = []
-    for pred, truth in zip(predictions, ground_truths):
-        accuracy_results = tester.calculate_accuracy(pred, truth)
-        all_accuracies.append(accuracy_results)
+    if missing and cache is not None and cache.cache_only:
+        raise CacheMissError(f"{len(missing)} of {len(prompts)} prompts are not in the response cache")
     
-    # Calculate average accuracies
-    overall_accuracy = sum(res['overall_accuracy'] for res in all_accuracies) / len(all_accuracies)
-    
-    # Calculate average field accuracies
-    field_accuracies = {}
-    for field in all_accuracies[0]['field_accuracies'].keys():
-        field_accuracies[field] = sum(
-            res['field_accuracies'][field] 
-            for res in all_accuracies
-        ) / len(all_accuracies)
-    
-    print(f"\nBatch Testing Results:")
-    print(f"Overall Average Accuracy: {overall_accuracy:.2%}")
-    print("\nField-wise Average Accuracies:")
-    for field, accuracy in field_accuracies.items():
-        print(f"{field}: {accuracy:.2%}")
+    if missing:
+        responses = batch_call_model([prompts[i] for i in missing], schema=schema, model=model, **batch_kwargs)
+        for i, response in zip(missing, responses):
+            analyses[i] = parse_openai_email_analysis(response, schema)
+            if cache is not None:
+                cache.set(keys[i], analyses[i].model_dump(mode='json'), model)
+    return analyses
 
 def add_json_column_to_csv(existing_csv, json_data, output_csv):
     # Used to the ground truth JSON data to the existing CSV file witht he emails
@@ -124,54 +175,283 @@ def add_json_column_to_csv(existing_csv, json_data, output_csv):
         writer.writeheader()
         writer.writerows(reader)
 
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate the email analysis prompt against the dataset")
+    parser.add_argument("--dataset", default="AcaiEmailsDataset.csv", help="CSV file with the emails and ground truth")
+    parser.add_argument("--prompt", default="Prompt.md", help="Markdown prompt template")
+    parser.add_argument("--results", default="Results.csv", help="CSV file the accuracy records are appended to")
+    parser.add_argument("--store", default=None, metavar="DIR",
+                        help="Also append predictions and per-field accuracies to this columnar Parquet store")
+    parser.add_argument("--journal", default="run_journal.jsonl", help="Append-only journal of completed model calls")
+    parser.add_argument("--resume", action="store_true", help="Skip emails already analyzed in the journal with the same prompt, model and preprocessing")
+    parser.add_argument("--queue-size", type=int, default=64, help="Capacity of the queues between pipeline stages")
+    parser.add_argument("--concurrency", type=int, default=8, help="Maximum number of model requests in flight")
+    parser.add_argument("--rpm", type=int, default=None, help="Requests-per-minute budget")
+    parser.add_argument("--tpm", type=int, default=None, help="Tokens-per-minute budget")
+    parser.add_argument("--pool-size", type=int, default=20, help="Maximum number of pooled HTTP connections")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Request timeout in seconds")
+    parser.add_argument("--cache", default="response_cache.sqlite", help="Path of the response cache")
+    parser.add_argument("--no-cache", action="store_true", help="Always call the model")
+    parser.add_argument("--cache-only", action="store_true", help="Fail instead of calling the model on a cache miss")
+    parser.add_argument("--cache-max-entries", type=int, default=None, help="Evict least recently used entries beyond this size")
+    parser.add_argument("--cache-max-age", type=float, default=None, help="Evict entries older than this many seconds")
+    parser.add_argument("--preprocess", action="store_true", help="Strip HTML, quoted replies, signatures and legal footers from the email bodies")
+    parser.add_argument("--max-body-tokens", type=int, default=None, help="Cut preprocessed email bodies to this many tokens (implies --preprocess)")
+    parser.add_argument("--near-duplicates", type=int, default=None, metavar="BITS",
+                        help="Reuse the analysis of an email whose SimHash is within BITS bits of one already analyzed")
+    parser.add_argument("--fast-path", default=None, metavar="MODEL",
+                        help="Triage emails with this local classifier (see FastTriage.py) and skip the model when it is confident")
+    parser.add_argument("--fast-path-threshold", type=float, default=0.9, help="Confidence needed to skip the model")
+    parser.add_argument("--schema-profile", default="full", choices=["full", *SECTIONS],
+                        help="Only request and score this section of the analysis, e.g. triage")
+    parser.add_argument("--sectioned", action="store_true",
+                        help="Request the analysis as parallel section calls merged into one, triage first")
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream the completions and route emergency emails as soon as their routing fields are generated")
+    parser.add_argument("--priority", action="store_true",
+                        help="Order model calls by an early urgency estimate instead of arrival order")
+    parser.add_argument("--reserved-slots", type=int, default=None,
+                        help="Priority: concurrency slots kept for immediate and emergency emails (default: a quarter of --concurrency)")
+    parser.add_argument("--aging-seconds", type=float, default=30.0,
+                        help="Priority: queue time that raises a waiting email by one urgency level")
+    parser.add_argument("--resilient", action="store_true",
+                        help="Retry with jittered backoff, hedge slow calls and stop calling a degraded backend")
+    parser.add_argument("--max-attempts", type=int, default=4, help="Resilient: attempts per model call")
+    parser.add_argument("--hedge-percentile", type=float, default=0.95,
+                        help="Resilient: send a duplicate request once a call is slower than this percentile of recent calls (0 disables)")
+    parser.add_argument("--hedge-budget", type=float, default=0.1, help="Resilient: maximum share of calls that are hedged")
+    parser.add_argument("--breaker-mode", choices=BREAKER_MODES, default="queue",
+                        help="Resilient: reject calls (shed) or hold them back (queue) while the circuit is open")
+    parser.add_argument("--breaker-cooldown", type=float, default=10.0, help="Resilient: seconds the circuit stays open")
+    parser.add_argument("--adaptive", action="store_true", help="Sample emails in stratified random order and stop early")
+    parser.add_argument("--tolerance", type=float, default=0.02, help="Adaptive: target half width of the overall accuracy interval")
+    parser.add_argument("--field-tolerance", type=float, default=0.05, help="Adaptive: target half width of every field interval")
+    parser.add_argument("--confidence", type=float, default=0.95, help="Adaptive: confidence level of the intervals")
+    parser.add_argument("--min-samples", type=int, default=30, help="Adaptive: emails scored before stopping is considered")
+    parser.add_argument("--max-samples", type=int, default=None, help="Adaptive: maximum number of emails drawn")
+    parser.add_argument("--baseline", default=None, help="Adaptive: summary JSON of a baseline run, stop on a significant regression")
+    parser.add_argument("--seed", type=int, default=None, help="Adaptive: sampling seed")
+    parser.add_argument("--save-summary", default=None, help="Write the accuracy summary to this JSON file")
+    parser.add_argument("--metrics-file", default=None, help="Write Prometheus text-format metrics to this file (e.g. metrics.prom)")
+    parser.add_argument("--metrics-json", default=None, help="Write the metrics summary to this JSON file")
+    args = parser.parse_args(argv)
+    if args.schema_profile != "full" and (args.sectioned or args.near_duplicates is not None or args.resume):
+        parser.error("--schema-profile only requests part of the analysis and cannot be combined "
+                     "with --sectioned, --near-duplicates or --resume")
+    if args.stream and args.sectioned:
+        parser.error("--stream cannot be combined with --sectioned")
+    if args.reserved_slots is not None and not 0 <= args.reserved_slots < args.concurrency:
+        parser.error(f"--reserved-slots must be between 0 and {args.concurrency - 1} (below --concurrency)")
+    return args
+
+def report_metrics(metrics):
+    """
+    Print the time spent in every pipeline stage and the HTTP retries of the run.
+    """
+    if not isinstance(metrics, InMemoryMetrics):
+        return
+    summary = metrics.summary()
+    print("\nStage timings:")
+    for name, timer in summary['timers'].items():
+        if name.startswith("stage_seconds"):
+            stage = name[len("stage_seconds{stage="):-1]
+            print(f"{stage}: {timer['total_seconds']:.3f}s total, {timer['mean_seconds'] * 1000:.2f} ms mean over {timer['count']}")
+    for name, timer in summary['timers'].items():
+        if name.startswith("section_seconds"):
+            section = name[len("section_seconds{section="):-1]
+            print(f"time to {section} section: {timer['mean_seconds'] * 1000:.2f} ms mean, {timer['max_seconds'] * 1000:.2f} ms max")
+    early = summary['timers'].get("early_fields_seconds")
+    if early:
+        full = summary['timers']["model_request_seconds"]
+        print(f"routing fields: {early['mean_seconds'] * 1000:.2f} ms mean after the request started, "
+              f"full response: {full['mean_seconds'] * 1000:.2f} ms mean")
+    retries = summary['counters'].get("retries", 0)
+    if retries:
+        print(f"HTTP retries: {retries:g}")
+
+def route_early(task, values):
+    """
+    Routing callback of streamed runs: announce emails for the emergency queue while their analysis is still generating.
+    """
+    if needs_immediate_routing(values):
+        print(f"Routing {task.row_id} ({task.row['Subject']}) to the emergency queue: "
+              f"urgency {values['sentiment.urgency']}, purpose {values['primary_purpose']}")
+
+def report_queue_wait(queue_wait):
+    """
+    Print the time emails waited for a model call slot, per estimated urgency level.
+    """
+    print("\nQueue wait by estimated urgency:")
+    for level, wait in queue_wait.items():
+        print(f"{level}: {wait['count']} emails, {wait['mean_seconds'] * 1000:.0f} ms mean, "
+              f"{wait['p95_seconds'] * 1000:.0f} ms p95, {wait['max_seconds'] * 1000:.0f} ms max")
+
+def report_adaptive(summary):
+    """
+    Print the estimates of an adaptive sampling run with their confidence intervals.
+    """
+    print(f"\nAdaptive Sampling Results ({summary['count']} of {summary['population']} emails, "
+          f"stopped on {summary['stop_reason']}):")
+    print(f"Overall Accuracy: {summary['overall_accuracy']:.2%} ± {summary['overall_interval']:.2%}")
+    print("\nField-wise Accuracies:")
+    for field, accuracy in summary['field_accuracies'].items():
+        print(f"{field}: {accuracy:.2%} ± {summary['field_intervals'][field]:.2%}")
+    if summary['regressions']:
+        print(f"\nSignificant regressions against the baseline: {', '.join(summary['regressions'])}")
+
+def main(argv=None):
+    args = parse_args(argv)
     load_dotenv()
+    configure_client_manager(
+        max_connections=args.pool_size,
+        max_keepalive_connections=args.pool_size,
+        timeout=args.timeout,
+        # The resilience layer does the retrying, the SDK would otherwise retry every attempt again
+        max_retries=0 if args.resilient else 2
+    )
     
     # Import the prompt from the markdown file
-    
+    template = load_prompt_template(args.prompt)
+    print(f"Prompt version: {template.version}")
 
-    # Import the response schema
-    response_schema = EmailAnalysis.schema_json()
-    response_schema = json.loads(response_schema)
-    json_data = []
+    journal = RunJournal(args.journal)
+    completed = journal.load(template.version) if args.resume else {}
+    # Resuming a run that did not finish keeps its run id, so its records and store files stay together
+    run_id = journal.unfinished_run_id(template.version) if args.resume else None
+    logged = journal.run_keys(run_id) if run_id is not None else set()
 
-    # Import the emails and ground truth data
-    dataset = pd.read_csv('AcaiEmailsDataset.csv')
+    # Accuracy records are tagged with the run id and prompt version and written in the background
+    results_writer = get_results_writer(path=args.results, prompt_version=template.version, run_id=run_id)
+    print(f"Run id: {results_writer.run_id}")
+    tester = EmailAnalysisTesting(EmailAnalysis, results_writer=results_writer)
     
-    emails = dataset['EmailBody']
-    ground_truth = dataset['GroundTruth']
-    subject = dataset['Subject']
-    sender_email = dataset['Sender']
-    recipient_email = dataset['Recipients']
-
-    tester = EmailAnalysisTesting(EmailAnalysis)
+    cache = None
+    if not args.no_cache:
+        cache = ResponseCache(
+            args.cache,
+            max_entries=args.cache_max_entries,
+            max_age_seconds=args.cache_max_age,
+            cache_only=args.cache_only
+        )
     
-
-    for email, gt, subj, sender, recipient in zip(emails, ground_truth, subject, sender_email, recipient_email):
-        with open('Prompt.md', 'r') as file:
-            prompt = file.read()
-        formatted_prompt = prompt.format(
-            subject=subj,
-            sender_email=sender,
-            recipient_email=recipient,
-            email_body=email
+    resilience = None
+    if args.resilient:
+        resilience = ResilientCaller(
+            retry=RetryPolicy(max_attempts=args.max_attempts),
+            breaker=CircuitBreaker(cooldown=args.breaker_cooldown, mode=args.breaker_mode),
+            hedge_percentile=args.hedge_percentile or None,
+            hedge_budget=args.hedge_budget
         )
-        
-        # Get the response of the model for each email
-        response = call_model(formatted_prompt)
-        response_data = parse_openai_email_analysis(str(response))
-        #print('response data:',response_data)
-        prediction = json.dumps(response_data, indent=4, default=str)
-        #print('prediction:',prediction)
-        json_data.append(prediction)
-        print(len(json_data))
-        ground_truth = json.loads(gt)
-        #print('ground truth',gt)
-        #break
-        # Calculate accuracy and save to a csv
-        accuracy_results = tester.calculate_accuracy(response_data, ground_truth)
-        
-    #add_json_column_to_csv('AcaiEmailsDataset.csv', json_data, 'AcaiEmailsDataset.csv')
+    engine = AsyncAnalysisEngine(
+        max_concurrency=args.concurrency,
+        requests_per_minute=args.rpm,
+        tokens_per_minute=args.tpm,
+        schema=get_profile(args.schema_profile),
+        resilience=resilience
+    )
+    scheduler = None
+    if args.priority:
+        reserved = args.reserved_slots if args.reserved_slots is not None else args.concurrency // 4
+        scheduler = PriorityScheduler(args.concurrency, reserved=reserved, aging_seconds=args.aging_seconds)
+    store = None
+    if args.store:
+        store = ColumnarResultsStore(args.store, run_id=results_writer.run_id, prompt_version=template.version)
+    if args.resume:
+        print(f"Resuming: {len(completed)} analyses journaled for prompt version {template.version}, "
+              f"reused for the emails whose row and request fingerprint match")
+    
+    sampler = None
+    rows = iter_dataset_rows(args.dataset)
+    if args.adaptive:
+        sampler = AdaptiveSampler(
+            list(rows),
+            tester,
+            tolerance=args.tolerance,
+            field_tolerance=args.field_tolerance,
+            confidence=args.confidence,
+            min_samples=args.min_samples,
+            max_samples=args.max_samples,
+            baseline=load_baseline(args.baseline) if args.baseline else None,
+            seed=args.seed
+        )
+        rows = sampler.rows()
+    pipeline = EvaluationPipeline(
+        engine,
+        template,
+        tester,
+        cache=cache,
+        sink=sampler.observe if sampler is not None else None,
+        # Small queues keep the number of calls made after a stopping rule fires low
+        queue_size=min(args.queue_size, args.concurrency) if sampler is not None else args.queue_size,
+        # Sampled rows are numbered in draw order, so they cannot be matched with journal entries
+        # Partial profiles are not journaled, their analyses could not be resumed as full ones
+        journal=journal if sampler is None and args.schema_profile == "full" else None,
+        completed=completed if sampler is None else None,
+        logged=logged,
+        run_id=results_writer.run_id,
+        preprocessor=EmailPreprocessor(args.max_body_tokens) if args.preprocess or args.max_body_tokens else None,
+        near_duplicates=NearDuplicateIndex(args.near_duplicates) if args.near_duplicates is not None else None,
+        triage=TriageCascade(FastTriageModel.load(args.fast_path), args.fast_path_threshold) if args.fast_path else None,
+        sections=SectionedAnalyzer(engine) if args.sectioned else None,
+        on_routing=route_early if args.stream else None,
+        scheduler=scheduler,
+        store=store
+    )
+    
+    # Stream the emails through render -> model call -> parse -> score, only calling the model for uncached prompts
+    start = time.perf_counter()
+    try:
+        summary = asyncio.run(pipeline.run(rows))
+        journal.finish(results_writer.run_id, template.version)
+    finally:
+        journal.close()
+        results_writer.close()
+        if store is not None:
+            store.close()
+        if cache is not None:
+            cache.close()
+    print(f"Analyzed {summary['processed']} emails in {time.perf_counter() - start:.2f}s "
+          f"({summary['failed']} failed, {summary['resumed']} resumed from the journal)")
+    report_engine_stats(engine)
+    if store is not None:
+        print(f"Columnar store: {store.written} predictions written to {args.store} (run {store.run_id})")
+    if resilience is not None:
+        breaker = resilience.breaker
+        print(f"Resilience: {resilience.retries} retries, {resilience.hedges} hedged calls ({resilience.hedges_won} won by the hedge), "
+              f"circuit opened {breaker.opened} times, {breaker.shed} calls shed")
+    if 'body_tokens_before' in summary:
+        before, after = summary['body_tokens_before'], summary['body_tokens_after']
+        print(f"Email body tokens: {before} before preprocessing, {after} after "
+              f"({1 - after / before if before else 0:.1%} saved)")
+    if 'reused' in summary:
+        print(f"Near-duplicates: {summary['reused']} analyses reused, {summary['reused']} model calls skipped "
+              f"(accuracy {summary['reused_accuracy']:.2%} on reused emails vs {summary['other_accuracy']:.2%} on the rest)")
+    if 'triaged' in summary:
+        triage = summary['triage_accuracy']
+        print(f"Fast path: {summary['triaged']} emails triaged locally without a model call "
+              f"({pipeline.triage.in_sample} emails the classifier was trained on sent to the model)")
+        for field, accuracy in triage['field_accuracies'].items():
+            print(f"  {field}: {accuracy:.2%}")
+    if 'queue_wait' in summary:
+        report_queue_wait(summary['queue_wait'])
+    if cache is not None:
+        print(f"Response cache: {cache.hits} hits, {cache.misses} misses")
+    if sampler is not None:
+        summary = sampler.summary()
+        report_adaptive(summary)
+    elif summary['count']:
+        report_accuracy(summary)
+    if args.save_summary:
+        with open(args.save_summary, 'w') as file:
+            json.dump(summary, file, indent=2)
+    
+    metrics = get_metrics()
+    report_metrics(metrics)
+    if isinstance(metrics, InMemoryMetrics):
+        if args.metrics_file:
+            metrics.write_prometheus(args.metrics_file)
+        if args.metrics_json:
+            metrics.write_json(args.metrics_json)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()